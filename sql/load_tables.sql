@@ -1,3 +1,7 @@
+-- Manual load of the scraper CSV files. The scrapers can also create and fill these
+-- tables themselves: pass an output_sinks.SqliteSink or output_sinks.PostgresSink as
+-- the 'sink' argument of GfncScraper.scrape / YfncScraper.scrape.
+
 -- -- --- Create performance table
 -- drop table if exists performance;
 -- create table performance(
@@ -1,5 +1,82 @@
 import csv
+import multiprocessing
 import os
+from metrics import Metrics, ProgressReporter
+from page_store import PageStore
+from scrape_manifest import ScrapeManifest
+
+# Scraper instance used by the worker processes of AbstractScraper.map_tickers.
+# It is set once per worker by _init_worker so the scraper is not shipped with every task.
+_worker_scraper = None
+
+
+def _init_worker(scraper):
+    global _worker_scraper
+    _worker_scraper = scraper
+    # Drop the metrics inherited from the parent; the worker only reports its own
+    _worker_scraper.metrics.drain()
+
+
+def _run_worker_task(task):
+    """
+    @return: tuple (ticker, result, error, metrics). metrics is a snapshot of the metrics
+    recorded by the worker while running the task, to be merged by the parent process.
+    """
+    method_name, ticker = task
+    ticker, result, error = _call_extractor(_worker_scraper, method_name, ticker)
+    return ticker, result, error, _worker_scraper.metrics.drain()
+
+
+def _call_extractor(scraper, method_name, ticker):
+    """
+    Runs scraper.<method_name>(ticker) and traps any exception so that one bad page
+    does not bring down the whole run (or the process pool). Trapped exceptions are
+    counted in scraper.metrics by exception type.
+    @return: tuple (ticker, result, error). error is None on success.
+    """
+    try:
+        return ticker, getattr(scraper, method_name)(ticker), None
+    except Exception, E:
+        scraper.metrics.incr("parse_failures_total", type=type(E).__name__)
+        return ticker, None, "%s: %s" % (type(E).__name__, E)
+
+
+class CsvRowWriter(object):
+    """
+    Pipe delimited CSV writer that flushes to disk every 'flush_rows' rows, so the rows
+    scraped so far survive a crash of a long run.
+    """
+    flush_rows = 100
+
+    def __init__(self, csvfields, outputfile, metrics=None):
+        """
+        @param csvfields: fieldnames of the rows
+        @type csvfields: list
+        @param outputfile: output file name
+        @type outputfile: str
+        @param metrics: registry counting the rows written, per output file
+        @type metrics: metrics.Metrics
+        """
+        self.f = open(outputfile, "wb")
+        self.metrics = metrics
+        self.output_name = os.path.basename(outputfile)
+        self.writer = csv.DictWriter(self.f, fieldnames=csvfields,
+                                     delimiter='|',
+                                     quoting=csv.QUOTE_MINIMAL)
+        self.writer.writeheader()
+        self.nrows = 0
+
+    def writerow(self, row):
+        self.writer.writerow(row)
+        self.nrows += 1
+        if self.nrows % CsvRowWriter.flush_rows == 0:
+            self.f.flush()
+
+    def close(self):
+        self.f.close()
+        if self.metrics is not None:
+            self.metrics.incr("rows_written_total", self.nrows, output=self.output_name)
+
 
 class AbstractScraper(object):
     """
@@ -7,22 +84,44 @@ class AbstractScraper(object):
     """
     # Utility method for writing CSV files
     @staticmethod
-    def writecsv(csvfields, funddata, outputfile):
+    def writecsv(csvfields, funddata, outputfile, metrics=None):
         """
+        Writes rows to a pipe delimited CSV file as they are produced. funddata may be a
+        generator, in which case rows are never held in memory all at once.
         @param csvfields: fieldnames in the funddata dictionary
         @type csvfields: list
-        @param funddata: list of dicts containing data
-        @type funddata: list (of dicts)
+        @param funddata: dicts containing data
+        @type funddata: iterable (of dicts)
         @param outputfile: output file name
         @type outputfile: str
+        @param metrics: registry counting the rows written
+        @type metrics: metrics.Metrics
         """
-        with open(outputfile, "wb") as f:
-            writer = csv.DictWriter(f, fieldnames=csvfields,
-                                    delimiter='|',
-                                    quoting=csv.QUOTE_MINIMAL)
-            writer.writeheader()
+        writer = CsvRowWriter(csvfields, outputfile, metrics)
+        try:
             for item in funddata:
                 writer.writerow(item)
+        finally:
+            writer.close()
+
+    def write_table(self, sink, table, schema, rows):
+        """
+        Streams rows into table of an output sink, see output_sinks
+        @param sink: output sink
+        @type sink: output_sinks.OutputSink
+        @param table: table name
+        @type table: str
+        @param schema: list of (csv field, column, column type) triples
+        @type schema: list
+        @param rows: dicts containing data
+        @type rows: iterable (of dicts)
+        """
+        writer = sink.open_table(table, schema, self.metrics)
+        try:
+            for row in rows:
+                writer.writerow(row)
+        finally:
+            writer.close()
 
     # Utility method for generating names for intermediate files
     @staticmethod
@@ -37,19 +136,37 @@ class AbstractScraper(object):
         suffixed_input_path = os.path.join(dirname, input_file_name + suffix + input_file_extn)
         return suffixed_input_path
 
-    def __init__(self, fundpages_location, tickerlist_file, delimiter="|"):
+    def __init__(self, fundpages_location, tickerlist_file, delimiter="|", nworkers=1,
+                 manifest_file=None, metrics_file=None):
         """
         Constructs abstract page scraper object.
-        @param fundpages_location: Location of downloaded html fund pages (string)
+        @param fundpages_location: Location of downloaded html fund pages (string). Either
+        a folder of html files or a pack store, see page_store.PageStore
         @type fundpages_location: str
         @param tickerlist_file: Location of csv file containing ticker symbol list
         @type tickerlist_file: str
         @param delimiter: delimiter in tickerlist_file
         @type delimiter: str
+        @param nworkers: number of worker processes used for scraping. 1 scrapes serially
+        in the current process.
+        @type nworkers: int
+        @param manifest_file: Location of the scrape manifest. When given, scraping is
+        incremental: only pages that are new or changed since the previous run are
+        re-extracted, see scrape_manifest.ScrapeManifest
+        @type manifest_file: str
+        @param metrics_file: When given, scrape metrics (read/tidy/parse/extract times, rows
+        written, parse failures by exception type) are written to <metrics_file>.json and
+        <metrics_file>.prom after every pass over the tickers, see metrics.Metrics
+        @type metrics_file: str
         """
         self.fundpages_location = fundpages_location
+        self.nworkers = nworkers
+        self.manifest_file = manifest_file
+        self.metrics = Metrics()
+        self.metrics_file = metrics_file
         assert os.path.exists(self.fundpages_location), \
             "[AbstractScraper] Folder %s does not exist" % self.fundpages_location
+        self.store = PageStore.open(self.fundpages_location)
 
         assert os.path.exists(tickerlist_file), \
             "[AbstractScraper] Folder %s does not exist" % tickerlist_file
@@ -58,3 +175,103 @@ class AbstractScraper(object):
         with open(tickerlist_file, "rb") as f:
             reader = csv.reader(f, delimiter=delimiter)
             self.tickers = [record[0] for record in reader]
+
+    def read_page(self, key):
+        """
+        Reads the page stored under key, timing the read
+        @raise IOError: if there is no page for key
+        """
+        with self.metrics.timer("scrape_read_seconds"):
+            return self.store.get(key)
+
+    def timed_extract(self, table, extractor, ticker, tree):
+        """
+        Runs extractor(ticker, tree), timing it as the extraction of table
+        """
+        with self.metrics.timer("scrape_extract_seconds", table=table):
+            return extractor(ticker, tree)
+
+    def extract_tables(self, tables, ticker, tree):
+        """
+        Extracts tables from a parsed page with the scraper's compiled extraction specs
+        (self.extractor, see extraction_spec), in one walk over the page
+        @param tables: names of the specs to extract
+        @type tables: list
+        @return: list of row dicts, one per table, each starting with the ticker
+        @rtype: list
+        """
+        rows = self.extractor.extract(tree, tables)
+        result = []
+        for table in tables:
+            row = {"ticker": ticker}
+            row.update(rows[table])
+            result.append(row)
+        return result
+
+    def map_tickers(self, method_name, page_key="%s"):
+        """
+        Runs the per-ticker extractor self.<method_name>(ticker) over self.tickers and
+        yields (ticker, result) pairs in tickerlist order. With nworkers > 1 the tickers
+        are sharded across a process pool; results are merged back in tickerlist order
+        so the output is identical to a serial run. With a manifest_file, tickers whose
+        page is unchanged since the last run yield the result recorded then.
+
+        Exceptions raised by the extractor are reported per ticker and the ticker is
+        skipped. Tickers for which the extractor returns None are skipped as well.
+        Progress is reported at most every ProgressReporter interval, and the metrics of
+        worker processes are merged into self.metrics.
+        @param method_name: name of the per-ticker extractor method
+        @type method_name: str
+        @param page_key: format string giving the page store key of a ticker's page
+        @type page_key: str
+        """
+        ticker_count = len(self.tickers)
+        cached = {}
+        if self.manifest_file is not None:
+            manifest = ScrapeManifest(self.manifest_file)
+            for ticker in self.tickers:
+                result = manifest.lookup(method_name, ticker, self.store, page_key % ticker)
+                if result is not None:
+                    cached[ticker] = result
+            print "%d of %d pages unchanged since last run" % (len(cached), ticker_count)
+        else:
+            manifest = None
+        pending = [ticker for ticker in self.tickers if ticker not in cached]
+
+        if self.nworkers > 1 and len(pending) > 0:
+            pool = multiprocessing.Pool(self.nworkers, initializer=_init_worker, initargs=(self,))
+            chunksize = max(1, len(pending) // (self.nworkers * 16))
+            tasks = [(method_name, ticker) for ticker in pending]
+            results = pool.imap(_run_worker_task, tasks, chunksize)
+        else:
+            pool = None
+            results = (_call_extractor(self, method_name, ticker) + (None,) for ticker in pending)
+
+        progress = ProgressReporter(ticker_count, label=method_name)
+        try:
+            for ticker in self.tickers:
+                if ticker in cached:
+                    result, error = cached[ticker], None
+                    self.metrics.incr("pages_unchanged_total", method=method_name)
+                else:
+                    _, result, error, worker_metrics = results.next()
+                    if worker_metrics is not None:
+                        self.metrics.merge(worker_metrics)
+                    if manifest is not None and error is None and result is not None:
+                        manifest.record(method_name, ticker, result)
+
+                if error is not None:
+                    print "[%s] could not scrape %s" % (error, ticker)
+                elif result is not None:
+                    yield ticker, result
+
+                progress.update()
+
+            if manifest is not None:
+                manifest.save(method_name, self.tickers)
+            if self.metrics_file is not None:
+                self.metrics.export(self.metrics_file)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
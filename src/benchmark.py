@@ -0,0 +1,510 @@
+import argparse
+import collections
+import contextlib
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urlparse
+from abstract_scraper import CsvRowWriter
+from fund_pipeline import FundPipeline
+from fundpage_downloader import FundpageDownloader
+from gfnc_key_mappings import GfncKeymappings
+from gfnc_scraper import GfncScraper
+from mock_finance_server import MockFinanceServer
+from output_sinks import CsvSink
+from synthetic_corpus import SyntheticCorpus
+from ticker_generator import TickerGenerator
+from yfnc_key_mappings import YfncKeymappings
+from yfnc_scraper import YfncScraper
+
+
+class StageTimer(object):
+    """
+    Accumulates wall clock time per named stage over many pages
+    """
+    def __init__(self):
+        self.seconds = collections.OrderedDict()
+        self.breakdowns = set()
+
+    @contextlib.contextmanager
+    def stage(self, name, breakdown=False):
+        """
+        @param breakdown: True for stages that re-time part of another stage; they are
+        reported but left out of the total
+        @type breakdown: bool
+        """
+        if breakdown:
+            self.breakdowns.add(name)
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.time() - start
+
+    def report(self, npages):
+        """
+        @param npages: number of pages processed
+        @type npages: int
+        @return: dict of stage name -> {"seconds", "pages_per_sec"}, including a "total" stage
+        """
+        stages = collections.OrderedDict()
+        total = sum(seconds for name, seconds in self.seconds.items() if name not in self.breakdowns)
+        for name, seconds in self.seconds.items() + [("total", total)]:
+            stages[name] = {"seconds": round(seconds, 4),
+                            "pages_per_sec": round(npages / seconds, 2) if seconds > 0 else None}
+        return stages
+
+
+@contextlib.contextmanager
+def quiet():
+    """
+    Silences the per-page progress and error messages of the scrapers while timing
+    """
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        yield
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def peak_rss_kb():
+    """
+    @return: high-water mark of the resident set size of this process, in kB. It never
+    goes down, so it only measures one benchmark if that runs in a process of its own.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _bench_scraper(bench, pages_location, tickerlist_file, output_folder, parser):
+    """
+    Runs bench_gfnc or bench_yfnc in a worker process
+    @return: tuple (stage report, RSS high-water mark at the start and at the end in kB)
+    """
+    start_rss_kb = peak_rss_kb()
+    report = globals()[bench](pages_location, tickerlist_file, output_folder, parser)
+    return report, start_rss_kb, peak_rss_kb()
+
+
+def in_subprocess(bench, *args):
+    """
+    Runs a scraper benchmark in a fresh worker process, so its peak RSS is not mixed up
+    with the memory of the benchmarks that ran before it
+    @param bench: name of the benchmark function, "bench_gfnc" or "bench_yfnc"
+    @type bench: str
+    @return: tuple (stage report, peak RSS dict)
+    """
+    pool = multiprocessing.Pool(1)
+    try:
+        report, start_rss_kb, end_rss_kb = pool.apply(_bench_scraper, (bench,) + args)
+    finally:
+        pool.close()
+        pool.join()
+    # The worker is forked from this process and starts with its resident pages
+    return report, collections.OrderedDict([("high_water_mark", end_rss_kb), ("at_start", start_rss_kb),
+                                            ("growth", end_rss_kb - start_rss_kb)])
+
+
+def check_extracted(source, rows):
+    """
+    Guards the benchmark against timing extractors that find nothing, e.g. after a change
+    of the page layout of the synthetic corpus
+    @param rows: table name -> extracted rows
+    @type rows: dict
+    @raise ValueError: if every row of a table is empty
+    """
+    for table, table_rows in rows.items():
+        if not any(value not in ("", None) for row in table_rows
+                   for field, value in row.items() if field != "ticker"):
+            raise ValueError("[benchmark] Every %s %s row is empty" % (source, table))
+
+
+def bench_gfnc(pages_location, tickerlist_file, output_folder, parser):
+    """
+    Times the stages of GfncScraper.scrape page by page: read, tidy (bs4 backend only),
+    parse, the extraction of the three tables in one walk, standardization and the CSV
+    write. Each table is also extracted on its own as the extract_<table> breakdown
+    stages, so a regression of one table is not hidden in the combined extract stage.
+    """
+    scraper = GfncScraper(pages_location, tickerlist_file, parser=parser)
+    timer = StageTimer()
+    rows = {"performance": [], "risk": [], "profile": []}
+
+    with quiet():
+        for ticker in scraper.tickers:
+            with timer.stage("read"):
+                html = scraper.store.get(ticker)
+            if parser == "bs4":
+                from bs4 import BeautifulSoup
+                from tidylib import tidy_document
+                with timer.stage("tidy"):
+                    html, errors = tidy_document(html)
+                with timer.stage("parse"):
+                    tree = BeautifulSoup(html)
+            else:
+                with timer.stage("parse"):
+                    tree = scraper.backend.parse(html)
+            with timer.stage("extract"):
+                performance, risk, profile = scraper.extract_page(ticker, tree)
+            for table in ["performance", "risk", "profile"]:
+                with timer.stage("extract_%s" % table, breakdown=True):
+                    getattr(scraper, "extract_%s" % table)(ticker, tree)
+            rows["performance"].append(performance)
+            rows["risk"].append(risk)
+            rows["profile"].append(profile)
+
+        check_extracted("gfnc", rows)
+        with timer.stage("standardize"):
+            rows["profile"] = GfncScraper.standardize_profiles(rows["profile"])
+
+        fields = {"performance": GfncKeymappings.performance_fields,
+                  "risk": GfncKeymappings.risk_fields,
+                  "profile": GfncKeymappings.profile_fields}
+        with timer.stage("write"):
+            for table in ["performance", "risk", "profile"]:
+                write_rows(fields[table], rows[table],
+                           os.path.join(output_folder, "gfnc_%s.csv" % table))
+
+    return timer.report(len(scraper.tickers))
+
+
+def bench_yfnc(pages_location, tickerlist_file, output_folder, parser):
+    """
+    Times the stages of YfncScraper.scrape page by page: read, parse, the three
+    extractors, standardization and the CSV write.
+    """
+    scraper = YfncScraper(pages_location, tickerlist_file, parser=parser)
+    timer = StageTimer()
+    rows = {"performance": [], "risk": [], "profile": []}
+    npages = 0
+
+    with quiet():
+        for ticker in scraper.tickers:
+            for table in ["profile", "performance", "risk"]:
+                with timer.stage("read"):
+                    html = scraper.store.get("%s_%s" % (ticker, table))
+                with timer.stage("parse"):
+                    tree = scraper.backend.parse(html)
+                with timer.stage("extract_%s" % table):
+                    rows[table].append(getattr(scraper, "extract_%s" % table)(ticker, tree))
+                npages += 1
+
+        check_extracted("yfnc", rows)
+        with timer.stage("standardize"):
+            rows["profile"] = YfncScraper.standardize_profile_rows(rows["profile"])
+            rows["risk"] = YfncScraper.standardize_risk_rows(rows["risk"])
+
+        fields = {"performance": YfncKeymappings.performance_fields,
+                  "risk": YfncKeymappings.risk_fields,
+                  "profile": YfncKeymappings.profile_fields}
+        with timer.stage("write"):
+            for table in ["performance", "risk", "profile"]:
+                write_rows(fields[table], rows[table],
+                           os.path.join(output_folder, "yfnc_%s.csv" % table))
+
+    return timer.report(npages)
+
+
+def bench_downloader(nfunds, source, nworkers=8, throttle="adaptive", rate=20.0, seed=0, **faults):
+    """
+    Runs TickerGenerator and FundpageDownloader against a MockFinanceServer serving a
+    synthetic corpus of nfunds funds, and checks what they saved against what was served.
+    @param source: "gfnc" or "yfnc"
+    @type source: str
+    @param nworkers: download threads
+    @type nworkers: int
+    @param throttle: "adaptive" or "fixed", see FundpageDownloader
+    @type throttle: str
+    @param rate: (starting) requests per second of the downloader
+    @type rate: float
+    @param faults: latency, captcha_rate, error_rate, rate_limit and throttle of the
+    server, see MockFinanceServer
+    @return: benchmark result dict
+    """
+    if "server_throttle" in faults:
+        faults["throttle"] = faults.pop("server_throttle")
+    server = MockFinanceServer(SyntheticCorpus(nfunds=nfunds, seed=seed, captcha_rate=0), seed=seed, **faults)
+    base_url = server.start()
+    host = urlparse.urlsplit(base_url).netloc
+    workdir = tempfile.mkdtemp(prefix="download_benchmark_")
+    try:
+        # Ticker discovery: the marketwatch list pages must yield exactly the corpus tickers
+        tickerlist_file = os.path.join(workdir, "tickers.csv")
+        start = time.time()
+        with quiet():
+            tkgen = TickerGenerator(os.path.join(workdir, "tickerpages"), rate_limits={})
+            failed = tkgen.download_marketwatch_ticker_pages(base_url + "/tools/mutual-fund/list/")
+            # Injected failures hit the list pages too; retry them like a rerun would
+            for _ in range(5):
+                if failed:
+                    failed = tkgen.download_marketwatch_ticker_pages(base_url + "/tools/mutual-fund/list/",
+                                                                     failed)
+            tkgen.extract_marketwatch_tickers(tickerlist_file)
+            tkgen.http_client.session.close()
+        with open(tickerlist_file, "rb") as f:
+            found = [line.split("|")[0] for line in f]
+        tickers = {"seconds": round(time.time() - start, 4),
+                   "found": len(found),
+                   "correct": found == server.corpus.tickers}
+
+        requests_before = sum(server.stats.values())
+        downloader = FundpageDownloader(tickerlist_file=tickerlist_file,
+                                        downloads_folder=os.path.join(workdir, source),
+                                        failed_downloads_file=os.path.join(workdir, "failed.csv"),
+                                        source=source, fresh=True, nworkers=nworkers,
+                                        rate_limits={host: (rate, nworkers)}, throttle=throttle,
+                                        retry_backoff=1.0, base_url=base_url)
+        if throttle == "adaptive":
+            # Let the rate grow past the cap meant for the real sites
+            downloader.rate_limiter.max_rate = max(downloader.rate_limiter.max_rate, 10 * rate)
+        start = time.time()
+        with quiet():
+            downloader.download_fundpages()
+        seconds = time.time() - start
+
+        # Every page the journal records as done must be the page that was served
+        kinds = {"gfnc": [("", "gfnc")],
+                 "yfnc": [("_profile", "pr"), ("_performance", "pm"), ("_risk", "rk")]}[source]
+        pages = collections.Counter()
+        for ticker in found:
+            if not downloader.journal.is_final(ticker):
+                pages["not_done"] += len(kinds)
+                continue
+            for suffix, kind in kinds:
+                saved = downloader.store.get(ticker + suffix)
+                pages["correct" if saved == server.pages[(kind, ticker)] else "wrong"] += 1
+        downloader.journal.close()
+        downloader.http_client.session.close()
+
+        return collections.OrderedDict([
+            ("commit", current_commit()),
+            ("timestamp", int(time.time())),
+            ("funds", nfunds),
+            ("source", source),
+            ("workers", nworkers),
+            ("throttle", throttle),
+            ("server", dict((name, getattr(server, name)) for name in
+                            ["latency", "captcha_rate", "error_rate", "rate_limit", "throttle"])),
+            ("tickers", tickers),
+            ("seconds", round(seconds, 4)),
+            ("pages_per_sec", round(pages["correct"] / seconds, 2) if seconds > 0 else None),
+            ("requests", sum(server.stats.values()) - requests_before),
+            ("responses", dict(server.stats)),
+            ("journal", downloader.journal.counts()),
+            ("pages", dict(pages)),
+            ("final_rate", round(downloader.rate_limiter.rates().get(host, rate), 2)
+             if throttle == "adaptive" else rate)
+        ])
+    finally:
+        server.stop()
+        shutil.rmtree(workdir)
+
+
+class FirstRowSink(object):
+    """
+    Wraps an output sink, recording the time the first row is written to any table
+    """
+    def __init__(self, sink):
+        self.sink = sink
+        self.first_row = None
+
+    def open_table(self, table, schema, metrics=None):
+        writer = self.sink.open_table(table, schema, metrics)
+        writerow = writer.writerow
+
+        def timed_writerow(row):
+            if self.first_row is None:
+                self.first_row = time.time()
+            writerow(row)
+        writer.writerow = timed_writerow
+        return writer
+
+
+def bench_pipeline(nfunds, source, nworkers=8, rate=200.0, seed=0, **faults):
+    """
+    Times downloading then scraping (FundpageDownloader, then the scraper over the saved
+    pages) against FundPipeline, both fetching from a MockFinanceServer with nworkers
+    requests in flight at a fixed rate. Reports time to first row and total time of both,
+    and whether both wrote the same rows.
+    @param faults: latency, captcha_rate, error_rate, rate_limit and throttle of the
+    server, see MockFinanceServer
+    @return: benchmark result dict
+    """
+    if "server_throttle" in faults:
+        faults["throttle"] = faults.pop("server_throttle")
+    server = MockFinanceServer(SyntheticCorpus(nfunds=nfunds, seed=seed, captcha_rate=0), seed=seed, **faults)
+    base_url = server.start()
+    rate_limits = {urlparse.urlsplit(base_url).netloc: (rate, nworkers)}
+    workdir = tempfile.mkdtemp(prefix="pipeline_benchmark_")
+    try:
+        tickerlist_file = os.path.join(workdir, "tickers.csv")
+        server.corpus.write_tickerlist(tickerlist_file)
+        result = collections.OrderedDict([("commit", current_commit()),
+                                          ("timestamp", int(time.time())),
+                                          ("funds", nfunds),
+                                          ("source", source),
+                                          ("workers", nworkers),
+                                          ("latency", server.latency)])
+        with quiet():
+            os.makedirs(os.path.join(workdir, "sequential"))
+            sink = FirstRowSink(CsvSink(os.path.join(workdir, "sequential")))
+            start = time.time()
+            downloader = FundpageDownloader(tickerlist_file=tickerlist_file,
+                                            downloads_folder=os.path.join(workdir, "pages"),
+                                            failed_downloads_file=os.path.join(workdir, "failed.csv"),
+                                            source=source, fresh=True, nworkers=nworkers,
+                                            rate_limits=rate_limits, throttle="fixed",
+                                            retry_backoff=1.0, base_url=base_url)
+            downloader.download_fundpages()
+            downloader.http_client.session.close()
+            scraper = {"gfnc": GfncScraper, "yfnc": YfncScraper}[source]
+            scraper(os.path.join(workdir, "pages"), tickerlist_file, parser="lxml").scrape(sink=sink)
+            result["sequential"] = {"first_row_seconds": round(sink.first_row - start, 4),
+                                    "seconds": round(time.time() - start, 4)}
+
+            os.makedirs(os.path.join(workdir, "pipeline"))
+            sink = FirstRowSink(CsvSink(os.path.join(workdir, "pipeline")))
+            start = time.time()
+            pipeline = FundPipeline(tickerlist_file, source=source, nfetchers=nworkers,
+                                    rate_limits=rate_limits, throttle="fixed", retry_backoff=1.0,
+                                    base_url=base_url)
+            pipeline.run(sink)
+            pipeline.http_client.session.close()
+            result["pipeline"] = {"first_row_seconds": round(sink.first_row - start, 4),
+                                  "seconds": round(time.time() - start, 4)}
+
+        # Same rows, in a different order
+        same = True
+        for filename in os.listdir(os.path.join(workdir, "sequential")):
+            with open(os.path.join(workdir, "sequential", filename), "rb") as f:
+                sequential_rows = sorted(f)
+            with open(os.path.join(workdir, "pipeline", filename), "rb") as f:
+                same = same and sorted(f) == sequential_rows
+        result["same_rows"] = same
+        return result
+    finally:
+        server.stop()
+        shutil.rmtree(workdir)
+
+
+def write_rows(fields, rows, outputfile):
+    writer = CsvRowWriter(fields, outputfile)
+    try:
+        for row in rows:
+            writer.writerow(row)
+    finally:
+        writer.close()
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"]).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(previous, current):
+    """
+    Prints pages/sec per stage of a previous benchmark result next to the current one
+    """
+    print "%-12s %-22s %12s %12s %8s" % ("scraper", "stage", "before", "after", "change")
+    for scraper in ["gfnc", "yfnc"]:
+        for stage, result in current["scrapers"].get(scraper, {}).items():
+            before = previous["scrapers"].get(scraper, {}).get(stage, {}).get("pages_per_sec")
+            after = result["pages_per_sec"]
+            if before and after:
+                change = "%+.1f%%" % (100.0 * (after - before) / before)
+            else:
+                change = "n/a"
+            print "%-12s %-22s %12s %12s %8s" % (scraper, stage, before, after, change)
+
+
+def run(nfunds, parser, seed=0, layout="loose"):
+    """
+    Generates a synthetic corpus of nfunds funds and benchmarks both scrapers on it, each
+    in a worker process of its own. peak_rss_kb holds the RSS high-water mark of each
+    worker; a forked worker starts with the resident pages of this process, listed as
+    at_start, so growth is the memory the scraper itself added.
+    @return: benchmark result dict
+    """
+    workdir = tempfile.mkdtemp(prefix="fund_benchmark_")
+    try:
+        corpus = SyntheticCorpus(nfunds=nfunds, seed=seed)
+        tickerlist_file = os.path.join(workdir, "tickers.csv")
+        corpus.write_tickerlist(tickerlist_file)
+        corpus.write_gfnc(os.path.join(workdir, "gfnc"), layout)
+        corpus.write_yfnc(os.path.join(workdir, "yfnc"), layout)
+
+        result = {
+            "commit": current_commit(),
+            "timestamp": int(time.time()),
+            "funds": nfunds,
+            "parser": parser,
+            "layout": layout,
+            "scrapers": collections.OrderedDict(),
+            "peak_rss_kb": collections.OrderedDict()
+        }
+        for source in ["gfnc", "yfnc"]:
+            result["scrapers"][source], result["peak_rss_kb"][source] = in_subprocess(
+                "bench_%s" % source, os.path.join(workdir, source), tickerlist_file, workdir, parser)
+        return result
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Benchmark the fund page scrapers on a synthetic corpus")
+    argparser.add_argument("--funds", type=int, default=1000, help="number of synthetic funds")
+    argparser.add_argument("--parser", choices=["bs4", "lxml"], default="bs4")
+    argparser.add_argument("--layout", choices=["loose", "pack"], default="loose")
+    argparser.add_argument("--seed", type=int, default=0)
+    argparser.add_argument("--output", help="file to save the results to as JSON")
+    argparser.add_argument("--compare", help="results of a previous run to compare against")
+    argparser.add_argument("--downloader", choices=["gfnc", "yfnc"],
+                           help="benchmark the downloaders against a mock_finance_server instead")
+    argparser.add_argument("--pipeline", choices=["gfnc", "yfnc"],
+                           help="compare downloading then scraping with fund_pipeline, against a "
+                                "mock_finance_server")
+    argparser.add_argument("--workers", type=int, default=8, help="download threads")
+    argparser.add_argument("--throttle", choices=["adaptive", "fixed"], default="adaptive")
+    argparser.add_argument("--rate", type=float, default=20.0, help="(starting) requests per second")
+    argparser.add_argument("--latency", type=float, default=0.0, help="average server delay in seconds")
+    argparser.add_argument("--captcha-rate", type=float, default=0.0)
+    argparser.add_argument("--error-rate", type=float, default=0.0)
+    argparser.add_argument("--rate-limit", type=float, help="requests per second the server serves")
+    argparser.add_argument("--server-throttle", choices=["429", "captcha"], default="429",
+                           help="server answer to requests over the rate limit")
+    args = argparser.parse_args()
+
+    if args.downloader or args.pipeline:
+        faults = dict(latency=args.latency, captcha_rate=args.captcha_rate, error_rate=args.error_rate,
+                      rate_limit=args.rate_limit, server_throttle=args.server_throttle)
+        if args.downloader:
+            benchmark = bench_downloader(args.funds, args.downloader, args.workers, args.throttle,
+                                         args.rate, args.seed, **faults)
+        else:
+            benchmark = bench_pipeline(args.funds, args.pipeline, args.workers, args.rate, args.seed,
+                                       **faults)
+        print json.dumps(benchmark, indent=2)
+        if args.output:
+            with open(args.output, "wb") as f:
+                json.dump(benchmark, f, indent=2)
+        sys.exit(0)
+
+    benchmark = run(args.funds, args.parser, args.seed, args.layout)
+    print json.dumps(benchmark, indent=2)
+
+    if args.output:
+        with open(args.output, "wb") as f:
+            json.dump(benchmark, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, "rb") as f:
+            compare(json.load(f), benchmark)
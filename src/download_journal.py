@@ -0,0 +1,140 @@
+import json
+import os
+import threading
+import time
+
+
+class DownloadJournal(object):
+    """
+    Append-only journal of the outcome of every download attempt, so an interrupted or
+    killed download run can be restarted and resumes where it stopped.
+
+    Every attempt is appended as one JSON line and flushed (and fsync'ed with sync=True)
+    before the downloader moves on:
+        {"ticker": "VFIAX", "status": "done", "http_status": 200, "bytes": 81234,
+         "attempt": 0, "time": 1414000000.0}
+
+    status is one of
+        done          the page(s) of the ticker were saved, or were unchanged (304)
+        missing       the host does not know the ticker (404/410)
+        captcha       a CAPTCHA page was served
+        rate_limited  the host refused the request (429/503)
+        server_error  the host failed with a server error (5xx); retried like rate_limited
+        http_error    any other error status
+        error         the request failed, e.g. timeout or connection reset; see "error"
+        failed        the ticker was given up after the last retry of a run
+
+    The state of a ticker is its last record. Tickers whose state is in final_statuses are
+    skipped by later runs. A line cut short by a crash is ignored on load.
+
+    Every record also carries the history a refresh scheduler needs: "last_done", the time
+    the ticker was last done (None if never), and "failures", the number of runs that ended
+    without the ticker done since then.
+    """
+    final_statuses = ("done", "missing")
+    # Statuses that end a ticker's run without it being done
+    failure_statuses = ("failed", "http_error", "missing")
+
+    def __init__(self, journal_file, sync=False):
+        """
+        @param journal_file: location of the journal, created if it does not exist
+        @type journal_file: str
+        @param sync: fsync every record, so records survive a power loss, not just a
+        crash of the process
+        @type sync: bool
+        """
+        self.journal_file = journal_file
+        self.sync = sync
+        self.lock = threading.Lock()
+        self.states = {}
+        self.nrecords = 0
+        complete = True
+        if os.path.exists(journal_file):
+            with open(journal_file, "rb") as f:
+                for line in f:
+                    complete = line.endswith("\n")
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.states[record["ticker"]] = record
+                    self.nrecords += 1
+        self.f = open(journal_file, "ab")
+        if not complete:
+            # End the line cut short by a crash, so the next record starts on its own line
+            self.f.write("\n")
+
+    def record(self, ticker, status, http_status=None, nbytes=0, attempt=0, **details):
+        """
+        Appends the outcome of one download attempt of ticker
+        @param status: see the class documentation
+        @type status: str
+        @param http_status: HTTP status of the response, if any
+        @type http_status: int
+        @param nbytes: bytes saved
+        @type nbytes: int
+        @param attempt: number of the attempt within the run, starting at 0
+        @type attempt: int
+        @param details: further fields of the record, e.g. error="Timeout: ..."
+        """
+        record = {"ticker": ticker, "status": status, "http_status": http_status,
+                  "bytes": nbytes, "attempt": attempt, "time": time.time()}
+        record.update(details)
+        with self.lock:
+            previous = self.states.get(ticker) or {}
+            if status == "done":
+                record["last_done"], record["failures"] = record["time"], 0
+            else:
+                record["last_done"] = previous.get("last_done")
+                record["failures"] = previous.get("failures", 0) + \
+                    (1 if status in DownloadJournal.failure_statuses else 0)
+            line = json.dumps(record, sort_keys=True) + "\n"
+            self.f.write(line)
+            self.f.flush()
+            if self.sync:
+                os.fsync(self.f.fileno())
+            self.states[ticker] = record
+            self.nrecords += 1
+
+    def state(self, ticker):
+        """
+        @return: last record of ticker, or None if it was never attempted
+        @rtype: dict
+        """
+        return self.states.get(ticker)
+
+    def is_final(self, ticker):
+        """
+        @return: True if ticker needs no further download attempts
+        """
+        state = self.states.get(ticker)
+        return state is not None and state["status"] in DownloadJournal.final_statuses
+
+    def counts(self):
+        """
+        @return: dict status -> number of tickers in that state
+        """
+        counts = {}
+        for state in self.states.values():
+            counts[state["status"]] = counts.get(state["status"], 0) + 1
+        return counts
+
+    def compact(self):
+        """
+        Rewrites the journal with only the last record of every ticker
+        """
+        with self.lock:
+            self.f.close()
+            tmpfile = self.journal_file + ".tmp"
+            with open(tmpfile, "wb") as f:
+                for ticker in sorted(self.states):
+                    f.write(json.dumps(self.states[ticker], sort_keys=True) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmpfile, self.journal_file)
+            self.nrecords = len(self.states)
+            self.f = open(self.journal_file, "ab")
+
+    def close(self):
+        with self.lock:
+            self.f.close()
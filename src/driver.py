@@ -1,6 +1,8 @@
 from gfnc_scraper import GfncScraper
 from yfnc_scraper import YfncScraper
+import os
 from fundpage_downloader import FundpageDownloader
+from refresh_scheduler import RefreshScheduler
 from ticker_generator import TickerGenerator
 
 tkgen = TickerGenerator(downloads_folder="../tickerpages")
@@ -8,20 +10,27 @@ tkgen.download_marketwatch_ticker_pages("http://www.marketwatch.com/tools/mutual
 tkgen.extract_marketwatch_tickers("../csv/marketwatch_ticker_list.csv")
 
 
-# Download fundpages recursively
+# Download fundpages. Blocked (CAPTCHA) pages are retried with backoff inside the
+# downloader; tickers that never got through are listed in failed_downloads.csv.
+# Every attempt is journaled in the downloads folder: running this again resumes an
+# interrupted run and retries only the tickers that are not done yet.
+# The refresh scheduler picks the pages that are due from the journal: the 500 largest funds
+# daily, the rest weekly, within a budget of requests per run.
 downloads_folder = "../html/gfnc_fund_pages"
 failed_downloads_file = "../csv/failed_downloads.csv"
 
-fundpage_downloader = FundpageDownloader(tickerlist_file=failed_downloads_file,
+fundpage_downloader = FundpageDownloader(tickerlist_file="../csv/marketwatch_ticker_list.csv",
                                          delimiter="|",
                                          downloads_folder=downloads_folder,
                                          failed_downloads_file=failed_downloads_file,
                                          source="gfnc",
-                                         fresh=False)
-while len(open(failed_downloads_file).readlines()) > 0:
-    fundpage_downloader.download_fundpages()
-
-fundpage_downloader.list_failed_downloads()
+                                         fresh=False,
+                                         metrics_file="../csv/gfnc_download_metrics")
+assets_file = "../csv/funds.csv"
+scheduler = RefreshScheduler(fundpage_downloader.tickers, fundpage_downloader.journal,
+                             RefreshScheduler.load_assets(assets_file) if os.path.exists(assets_file) else None,
+                             hot_set_size=500)
+fundpage_downloader.download_fundpages(scheduler.schedule(budget=5000))
 
 
 # test Yahoo Finance scraper
@@ -38,6 +47,7 @@ tickerlist_file = "/Users/rkekatpure/work/code/investing/csv/marketwatch_ticker_
 outputfile_prefix = "/Users/rkekatpure/work/code/investing/csv/gfnc.csv"
 gfnc_scraper = GfncScraper(fundpages_location=fundpages_location,
                                    tickerlist_file=tickerlist_file,
-                                   delimiter="|")
+                                   delimiter="|",
+                                   metrics_file="/Users/rkekatpure/work/code/investing/csv/gfnc_scrape_metrics")
 gfnc_scraper.scrape(outputfile_prefix)
 
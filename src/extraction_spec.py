@@ -0,0 +1,290 @@
+"""
+Declarative field extraction for fund pages.
+
+Where each field lives on a page is written down as a Spec, a table name plus a list of
+items:
+
+    Field(name, path, convert, type)
+        The text of the first node at path. convert(text) cleans it up (None means the
+        field is missing); type "float" converts the result to float, keeping "" for
+        empty values.
+
+    LabeledValues(path, label, values, keymap, ...)
+        Label/value cells read from every container node at path, e.g. the rows of a
+        table. The labels are mapped to output fields through keymap
+        {output field: label}, matching labels exactly or by prefix (see
+        prefix_index.PrefixIndex).
+
+Paths are parser_backends paths, lists of (tag, attrs, index) steps, plus the NEXT_SIBLING
+step which moves to the next sibling element.
+
+Specs are compiled once per scraper into a CompiledSpec for its parser backend. Every
+distinct path step is compiled once, and while a page is extracted every path prefix is
+evaluated once and memoized: fields sharing the descent to a table share the nodes on the
+way, and all fields of all tables are read in one walk over the page.
+"""
+from prefix_index import PrefixIndex
+
+# Path step selecting the next sibling element of the current node
+NEXT_SIBLING = ("+", {}, 0)
+
+
+class Field(object):
+    """
+    A single field read from the text of one node
+    """
+    def __init__(self, name, path, convert=None, type="text"):
+        """
+        @param name: output field
+        @type name: str
+        @param path: location of the node
+        @type path: list
+        @param convert: function(text) returning the field value, or None if it is missing
+        @type convert: function
+        @param type: "text" or "float"
+        @type type: str
+        """
+        assert type in ("text", "float"), "[Field] Unknown type %s" % type
+        self.name = name
+        self.path = path
+        self.convert = convert
+        self.type = type
+
+
+class LabeledValues(object):
+    """
+    Label/value pairs read from the cells of container nodes. Cells are lists of nodes
+    selected relative to a container; with a stride n, cell k of every group of n cells
+    is used, so one cell list can hold labels and values side by side.
+    """
+    def __init__(self, path, label, values, keymap, match="exact", stride=1, header=None,
+                 label_format="%(label)s%(suffix)s", normalize_label=None, convert=None,
+                 defaults=()):
+        """
+        @param path: location of the container nodes (last step index None for all of them)
+        @type path: list
+        @param label: (cell path, offset) of the label cells
+        @type label: tuple
+        @param values: list of (cell path, offset, suffix) of the value cells. suffix is
+        added to the label of the values of that column.
+        @type values: list
+        @param keymap: output field -> label (or label prefix)
+        @type keymap: dict
+        @param match: "exact" or "prefix". With "prefix", the last label starting with the
+        prefix of a field wins.
+        @type match: str
+        @param stride: number of cells per label
+        @type stride: int
+        @param header: path of a node within the container whose text is available to
+        label_format as %(header)s
+        @type header: list
+        @param label_format: format of the labels, from %(label)s, %(header)s and %(suffix)s
+        @type label_format: str
+        @param normalize_label: function applied to the text of the label cells
+        @type normalize_label: function
+        @param convert: function applied to the text of the value cells
+        @type convert: function
+        @param defaults: output fields set to "" when any container is found
+        @type defaults: list
+        """
+        assert match in ("exact", "prefix"), "[LabeledValues] Unknown match %s" % match
+        self.path = path
+        self.label = label
+        self.values = values
+        self.keymap = keymap
+        self.match = match
+        self.stride = stride
+        self.header = header
+        self.label_format = label_format
+        self.normalize_label = normalize_label
+        self.convert = convert
+        self.defaults = defaults
+        if match == "prefix":
+            self.index = PrefixIndex(keymap)
+        else:
+            self.fields_by_label = {}
+            for field, label_text in keymap.items():
+                self.fields_by_label.setdefault(label_text, []).append(field)
+
+    def select(self, raw):
+        """
+        @param raw: label -> value text
+        @return: output field -> converted value
+        """
+        if self.match == "prefix":
+            return self.index.select(raw, self.convert)
+        selected = {}
+        for label_text, value in raw.items():
+            for field in self.fields_by_label.get(label_text, []):
+                selected[field] = self.convert(value) if self.convert is not None else value
+        return selected
+
+
+class Spec(object):
+    """
+    The fields of one output table
+    """
+    def __init__(self, table, items):
+        """
+        @param table: output table name
+        @type table: str
+        @param items: Field and LabeledValues items
+        @type items: list
+        """
+        self.table = table
+        self.items = items
+
+
+def _step_key(step):
+    tag, attrs, index = step
+    return tag, tuple(sorted(attrs.items())), index
+
+
+class CompiledSpec(object):
+    """
+    A set of specs compiled for a parser backend
+    """
+    def __init__(self, specs, backend, metrics=None):
+        """
+        @param specs: specs to extract
+        @type specs: list (of Spec)
+        @param backend: parser backend, see parser_backends
+        @param metrics: registry counting missing fields and conversion errors per table
+        @type metrics: metrics.Metrics
+        """
+        self.specs = dict((spec.table, spec) for spec in specs)
+        self.tables = [spec.table for spec in specs]
+        self.backend = backend
+        self.metrics = metrics
+
+        # Compile every distinct step once
+        self.selectors = {}
+        for spec in specs:
+            for item in spec.items:
+                if isinstance(item, Field):
+                    paths = [item.path]
+                else:
+                    paths = [item.path, item.label[0]] + [path for path, offset, suffix in item.values]
+                    if item.header is not None:
+                        paths.append(item.header)
+                for path in paths:
+                    for step in path:
+                        key = _step_key(step)
+                        if step != NEXT_SIBLING and key not in self.selectors:
+                            self.selectors[key] = backend.compile([step])
+
+    def extract(self, tree, tables=None):
+        """
+        @param tree: parsed page
+        @param tables: tables to extract, defaults to all tables of the compiled specs
+        @type tables: list
+        @return: table -> row dict. Missing fields are absent from the row.
+        @rtype: dict
+        """
+        walker = _PageWalker(self, tree)
+        rows = {}
+        for table in tables or self.tables:
+            row = {}
+            for item in self.specs[table].items:
+                if isinstance(item, Field):
+                    self._extract_field(walker, table, item, row)
+                else:
+                    self._extract_labeled_values(walker, table, item, row)
+            rows[table] = row
+        return rows
+
+    def _count(self, name, **labels):
+        if self.metrics is not None:
+            self.metrics.incr(name, **labels)
+
+    def _extract_field(self, walker, table, item, row):
+        nodes = walker.nodes(item.path)
+        if not nodes:
+            self._count("fields_missing_total", table=table)
+            return
+        value = walker.text(nodes[0])
+        if item.convert is not None:
+            value = item.convert(value)
+            if value is None:
+                self._count("fields_missing_total", table=table)
+                return
+        if item.type == "float" and value != "":
+            try:
+                value = float(value)
+            except ValueError:
+                self._count("extract_errors_total", table=table, type="ValueError")
+                return
+        row[item.name] = value
+
+    def _extract_labeled_values(self, walker, table, item, row):
+        containers = [container for container in walker.nodes(item.path) if container is not None]
+        if not containers:
+            self._count("fields_missing_total", table=table)
+            return
+
+        raw = {}
+        for container in containers:
+            cells = _PageWalker(self, container, walker.texts)
+            header = None
+            if item.header is not None:
+                header_nodes = cells.nodes(item.header)
+                if not header_nodes:
+                    continue
+                header = cells.text(header_nodes[0])
+
+            label_path, label_offset = item.label
+            label_cells = cells.nodes(label_path)
+            if len(label_cells) % item.stride != 0:
+                self._count("extract_errors_total", table=table, type="ValueError")
+                continue
+            labels = [cells.text(cell) for cell in label_cells[label_offset::item.stride]]
+            if item.normalize_label is not None:
+                labels = [item.normalize_label(label_text) for label_text in labels]
+
+            for value_path, value_offset, suffix in item.values:
+                values = [cells.text(cell) for cell in cells.nodes(value_path)[value_offset::item.stride]]
+                raw.update(dict(zip([item.label_format % {"label": label_text, "header": header,
+                                                          "suffix": suffix}
+                                     for label_text in labels],
+                                    values)))
+
+        row.update(dict.fromkeys(item.defaults, ""))
+        row.update(item.select(raw))
+
+
+class _PageWalker(object):
+    """
+    Evaluates paths relative to a root node, memoizing the nodes of every path prefix and
+    the text of every node
+    """
+    def __init__(self, compiled, root, texts=None):
+        self.backend = compiled.backend
+        self.selectors = compiled.selectors
+        self.memo = {(): [root]}
+        self.texts = texts if texts is not None else {}
+
+    def nodes(self, path):
+        key = tuple(_step_key(step) for step in path)
+        return self._nodes(key)
+
+    def _nodes(self, key):
+        if key in self.memo:
+            return self.memo[key]
+        parents = self._nodes(key[:-1])
+        step = key[-1]
+        if step == _step_key(NEXT_SIBLING):
+            result = [sibling for sibling in (self.backend.next_sibling(parent) for parent in parents)
+                      if sibling is not None]
+        else:
+            result = [node for parent in parents
+                      for node in self.backend.select(parent, self.selectors[step])]
+        self.memo[key] = result
+        return result
+
+    def text(self, node):
+        # The memo holds on to the node, so its id is not reused while the page is walked
+        # (lxml creates element proxies on demand and frees them when unreferenced)
+        key = id(node)
+        if key not in self.texts:
+            self.texts[key] = (node, self.backend.text(node))
+        return self.texts[key][1]
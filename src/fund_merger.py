@@ -0,0 +1,345 @@
+"""
+Merge of the Google and Yahoo tables into one record per fund.
+
+The six scraper tables (gfnc_profiles, gfnc_risk, gfnc_performance, yfnc_profiles,
+yfnc_risk, yfnc_performance) are keyed by ticker. FundMerger joins them into the 'funds'
+table in bounded memory:
+
+    1. every table is sorted by ticker with an external sort: runs of run_size rows are
+       sorted in memory and spilled to temporary files, then merged with a heap
+    2. the sorted tables are joined with a streaming sort-merge (full outer) join, so
+       only the rows of the current ticker are held in memory
+    3. fields that both sources provide are resolved with the conflict rules of
+       merged_fields, all other fields are passed through
+
+Conflict rules of an overlapping field name its sources in order of preference and how
+the values are combined:
+
+    "first": the value of the first source that has one
+    "mean", "min", "max": the mean, minimum or maximum of the numeric values
+
+Values of different sources that disagree by more than conflict_tolerance (relative) are
+counted as merge_conflicts_total{field} in the metrics of the merger.
+"""
+import argparse
+import cPickle
+import csv
+import heapq
+import itertools
+import os
+import tempfile
+from gfnc_key_mappings import GfncKeymappings
+from metrics import Metrics
+from output_sinks import CsvSink
+import standardization
+from yfnc_key_mappings import YfncKeymappings
+
+# Source tables, as (table, schema) pairs
+source_tables = [
+    (GfncKeymappings.profile_table, GfncKeymappings.profile_schema),
+    (GfncKeymappings.risk_table, GfncKeymappings.risk_schema),
+    (GfncKeymappings.performance_table, GfncKeymappings.performance_schema),
+    (YfncKeymappings.profile_table, YfncKeymappings.profile_schema),
+    (YfncKeymappings.risk_table, YfncKeymappings.risk_schema),
+    (YfncKeymappings.performance_table, YfncKeymappings.performance_schema)
+]
+
+# Fields provided by both sources: merged column -> (rule, [(table, column), ...]) with the
+# sources in order of preference. Yahoo's risk statistics are preferred, as they come with
+# the category averages; Google's returns and assets are preferred, as its pages are
+# updated daily.
+merged_fields = {
+    "family": ("first", [(YfncKeymappings.profile_table, "family"),
+                         (GfncKeymappings.profile_table, "fund_family")]),
+    "net_assets": ("first", [(GfncKeymappings.profile_table, "total_assets"),
+                             (YfncKeymappings.profile_table, "net_assets")]),
+    "expense_ratio": ("first", [(GfncKeymappings.profile_table, "expense_ratio"),
+                                (YfncKeymappings.profile_table, "prospectus_net_expense_ratio")]),
+    "front_load": ("first", [(GfncKeymappings.profile_table, "front_load"),
+                             (YfncKeymappings.profile_table, "sales_load")]),
+    "r1y": ("first", [(GfncKeymappings.performance_table, "r1y"),
+                      (YfncKeymappings.performance_table, "r1")]),
+    "r3y": ("first", [(GfncKeymappings.performance_table, "r3y"),
+                      (YfncKeymappings.performance_table, "r3")]),
+    "r5y": ("first", [(GfncKeymappings.performance_table, "r5y"),
+                      (YfncKeymappings.performance_table, "r5")]),
+    "r10y": ("first", [(YfncKeymappings.performance_table, "r10")])
+}
+# Sentinels standing for a missing value in a source column
+missing_sentinels = {
+    (GfncKeymappings.profile_table, "total_assets"): GfncKeymappings.profile_missing_value
+}
+
+for _statistic in ["alpha", "beta", "sd", "sharpe"]:
+    for _years in [3, 5, 10]:
+        _column = "%s%d" % (_statistic, _years)
+        merged_fields[_column] = ("first", [(YfncKeymappings.risk_table, _column),
+                                            (GfncKeymappings.risk_table, _column)])
+
+
+def _numbers(values):
+    return [float(value) for value in values]
+
+
+rules = {
+    "first": lambda values: values[0],
+    "mean": lambda values: sum(_numbers(values)) / len(values),
+    "min": lambda values: min(_numbers(values)),
+    "max": lambda values: max(_numbers(values))
+}
+
+
+def external_sort(rows, key, run_size=100000, tmpdir=None):
+    """
+    Sorts a row stream holding at most run_size rows in memory. Sorted runs are pickled
+    to temporary files and merged with a heap; a stream that fits in one run is sorted in
+    memory.
+    @param rows: rows to sort
+    @type rows: iterable
+    @param key: function of a row returning its sort key
+    @type key: function
+    @param run_size: number of rows sorted in memory at a time
+    @type run_size: int
+    @param tmpdir: folder of the run files
+    @type tmpdir: str
+    @return: generator of the rows in key order. Rows with equal keys keep their order.
+    """
+    runs = []
+    chunk = None
+    try:
+        for chunk in standardization.chunks(rows, run_size):
+            chunk.sort(key=key)
+            if not runs and len(chunk) < run_size:
+                # The whole stream fits in memory
+                for row in chunk:
+                    yield row
+                return
+            run = tempfile.TemporaryFile(dir=tmpdir)
+            pickler = cPickle.Pickler(run, cPickle.HIGHEST_PROTOCOL)
+            for row in chunk:
+                pickler.dump(row)
+                # The pickler memoizes every object it writes; the runs are read back
+                # row by row, so the memo is not needed
+                pickler.clear_memo()
+            run.seek(0)
+            runs.append(run)
+        chunk = None
+
+        decorated = [_decorate(_read_run(run), number, key) for number, run in enumerate(runs)]
+        for row_key, number, position, row in heapq.merge(*decorated):
+            yield row
+    finally:
+        for run in runs:
+            run.close()
+
+
+def _decorate(rows, number, key):
+    """
+    Decorates the rows of stream 'number' as (key, number, position, row), which keeps
+    heap merges stable and never compares rows
+    """
+    for position, row in enumerate(rows):
+        yield key(row), number, position, row
+
+
+def _read_run(run):
+    unpickler = cPickle.Unpickler(run)
+    while True:
+        try:
+            yield unpickler.load()
+        except EOFError:
+            return
+
+
+def merge_join(streams, key):
+    """
+    Full outer sort-merge join of row streams sorted by key
+    @param streams: row streams, each sorted by key
+    @type streams: list
+    @param key: function of a row returning its join key
+    @type key: function
+    @return: generator of (key, rows) with one list of rows per stream (empty where the
+    stream has no row for key), in key order
+    """
+    decorated = [_decorate(stream, number, key) for number, stream in enumerate(streams)]
+    for row_key, group in itertools.groupby(heapq.merge(*decorated), lambda item: item[0]):
+        rows = [[] for stream in streams]
+        for _, number, position, row in group:
+            rows[number].append(row)
+        yield row_key, rows
+
+
+class FundMerger(object):
+    """
+    Joins the Google and Yahoo tables into the 'funds' table, see the module documentation
+    """
+    table = "funds"
+
+    # Relative difference above which two source values of a field count as a conflict
+    conflict_tolerance = 0.01
+
+    def __init__(self, run_size=100000, tmpdir=None, metrics_file=None):
+        """
+        @param run_size: number of rows sorted in memory at a time, per table
+        @type run_size: int
+        @param tmpdir: folder of the temporary sort files
+        @type tmpdir: str
+        @param metrics_file: prefix of the JSON/Prometheus metrics files, see metrics.Metrics
+        @type metrics_file: str
+        """
+        self.run_size = run_size
+        self.tmpdir = tmpdir
+        self.metrics = Metrics()
+        self.metrics_file = metrics_file
+
+        # Source fields of every output column:
+        #   column -> (rule, [(table, csv field, missing sentinel), ...])
+        # The merged columns follow the ticker, then the columns of a single source.
+        csv_fields = dict((table, dict((column, field) for field, column, column_type in schema))
+                          for table, schema in source_tables)
+        column_types = dict(((table, column), column_type) for table, schema in source_tables
+                            for field, column, column_type in schema)
+        self.sources = {}
+        self.schema = [("ticker", "ticker", "varchar(5)")]
+        merged_sources = set()
+        for column, (rule, sources) in sorted(merged_fields.items()):
+            merged_sources.update(sources)
+            self.sources[column] = (rule, [(table, csv_fields[table][source_column],
+                                            missing_sentinels.get((table, source_column)))
+                                           for table, source_column in sources])
+            self.schema.append((column, column, column_types[sources[0]]))
+        for table, schema in source_tables:
+            for field, column, column_type in schema:
+                if column == "ticker" or (table, column) in merged_sources:
+                    continue
+                assert column not in self.sources, \
+                    "[FundMerger] Column %s of %s needs a conflict rule" % (column, table)
+                self.sources[column] = ("first", [(table, field, missing_sentinels.get((table, column)))])
+                self.schema.append((column, column, column_type))
+        self.numeric = set(column for field, column, column_type in self.schema
+                           if column_type == "float")
+
+    def sorted_rows(self, table, rows):
+        """
+        @return: the rows of table sorted by ticker, counting them as rows_in_total{table}
+        """
+        def counted(rows):
+            for row in rows:
+                self.metrics.incr("rows_in_total", table=table)
+                yield row
+        return external_sort(counted(rows), lambda row: row["ticker"], self.run_size, self.tmpdir)
+
+    @staticmethod
+    def is_sentinel(value, sentinel):
+        if sentinel is None or value in ("", None):
+            return False
+        try:
+            return float(value) == sentinel
+        except ValueError:
+            return False
+
+    def conflicting(self, column, values):
+        if len(values) < 2:
+            return False
+        if column not in self.numeric:
+            return len(set(value.strip().lower() for value in values)) > 1
+        try:
+            numbers = _numbers(values)
+        except ValueError:
+            return len(set(values)) > 1
+        return max(numbers) - min(numbers) > \
+            FundMerger.conflict_tolerance * max(abs(number) for number in numbers + [1.0])
+
+    def merge_record(self, ticker, rows):
+        """
+        @param ticker: Ticker symbol
+        @param rows: table -> row of the ticker (absent tables have no row)
+        @type rows: dict
+        @return: unified record of the ticker
+        @rtype: dict
+        """
+        record = {"ticker": ticker}
+        for column, (rule, sources) in self.sources.items():
+            values = [rows[table].get(field, "") for table, field, sentinel in sources
+                      if table in rows and not FundMerger.is_sentinel(rows[table].get(field), sentinel)]
+            values = [value for value in values if value not in ("", None)]
+            if not values:
+                record[column] = ""
+                continue
+            if self.conflicting(column, values):
+                self.metrics.incr("merge_conflicts_total", field=column)
+            try:
+                record[column] = rules[rule](values)
+            except ValueError:
+                # Values that are not numbers cannot be combined; fall back to the first
+                record[column] = values[0]
+        return record
+
+    def merge(self, sources):
+        """
+        @param sources: table name -> rows keyed by csv field, for the source tables
+        available. Rows need not be sorted.
+        @type sources: dict
+        @return: generator of unified records in ticker order
+        """
+        tables = [table for table, schema in source_tables if table in sources]
+        streams = [self.sorted_rows(table, sources[table]) for table in tables]
+        for ticker, rows in merge_join(streams, lambda row: row["ticker"]):
+            for table, table_rows in zip(tables, rows):
+                if len(table_rows) > 1:
+                    # Keep the last row of a ticker scraped twice
+                    self.metrics.incr("duplicate_rows_total", table=table)
+            self.metrics.incr("funds_merged_total")
+            yield self.merge_record(ticker, dict((table, table_rows[-1])
+                                                 for table, table_rows in zip(tables, rows)
+                                                 if table_rows))
+
+    def merge_folder(self, folder, sink=None):
+        """
+        Merges the tables of an output_sinks.CsvSink folder (<folder>/<table>.csv) into the
+        funds table of sink
+        @param folder: folder of the source CSV files
+        @type folder: str
+        @param sink: output sink, defaults to CsvSink(folder)
+        @type sink: output_sinks.OutputSink
+        @return: names of the source tables found
+        @rtype: list
+        """
+        files = []
+        try:
+            sources = {}
+            for table, schema in source_tables:
+                filename = os.path.join(folder, "%s.csv" % table)
+                if os.path.exists(filename):
+                    f = open(filename, "rb")
+                    files.append(f)
+                    sources[table] = csv.DictReader(f, delimiter="|")
+
+            if sink is None:
+                sink = CsvSink(folder)
+            print "merging %s into %s" % (", ".join(sorted(sources)), sink)
+            writer = sink.open_table(FundMerger.table, self.schema, self.metrics)
+            try:
+                for record in self.merge(sources):
+                    writer.writerow(record)
+            finally:
+                writer.close()
+        finally:
+            for f in files:
+                f.close()
+            if self.metrics_file is not None:
+                self.metrics.export(self.metrics_file)
+        return sorted(sources)
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Merge the Google and Yahoo tables into one fund table")
+    argparser.add_argument("folder", help="folder of the <table>.csv files of an output_sinks.CsvSink")
+    argparser.add_argument("--run-size", type=int, default=100000,
+                           help="number of rows sorted in memory at a time")
+    argparser.add_argument("--metrics", help="prefix of the metrics files")
+    args = argparser.parse_args()
+
+    merger = FundMerger(run_size=args.run_size, metrics_file=args.metrics)
+    merger.merge_folder(args.folder)
+    print merger.metrics.summary()["counters"]
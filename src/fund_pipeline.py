@@ -0,0 +1,371 @@
+import Queue
+import argparse
+import collections
+import csv
+import os
+import threading
+import time
+import urlparse
+import output_sinks
+import parser_backends
+from extraction_spec import CompiledSpec
+from fundpage_downloader import FundpageDownloader
+from gfnc_key_mappings import GfncKeymappings
+from gfnc_scraper import GfncScraper
+from http_client import FetchResult, HttpClient
+from metrics import Metrics, ProgressReporter
+from page_store import PageStore
+from rate_limiter import AdaptiveRateController, HostRateLimiter
+from yfnc_key_mappings import YfncKeymappings
+from yfnc_scraper import YfncScraper
+
+
+# A page to fetch: ticker, url, page store key for archiving and the tables extracted from it
+PageTask = collections.namedtuple("PageTask", ["ticker", "url", "key", "tables"])
+
+# Output table, schema and batch standardization function (or None) of every extracted table
+output_tables = {
+    "gfnc": {
+        "performance": (GfncKeymappings.performance_table, GfncKeymappings.performance_schema, None),
+        "risk": (GfncKeymappings.risk_table, GfncKeymappings.risk_schema, None),
+        "profile": (GfncKeymappings.profile_table, GfncKeymappings.profile_schema,
+                    GfncScraper.standardize_profiles)
+    },
+    "yfnc": {
+        "profile": (YfncKeymappings.profile_table, YfncKeymappings.profile_schema,
+                    YfncScraper.standardize_profile_rows),
+        "performance": (YfncKeymappings.performance_table, YfncKeymappings.performance_schema, None),
+        "risk": (YfncKeymappings.risk_table, YfncKeymappings.risk_schema,
+                 YfncScraper.standardize_risk_rows)
+    }
+}
+
+
+class FundPipeline(object):
+    """
+    Downloads and scrapes fund pages in one pass, without writing pages to disk and reading
+    them back. Four stages run concurrently, joined by bounded queues:
+
+        download    nfetchers threads fetch pages into memory through the rate limiter.
+                    Every page is a task of its own, so the profile, performance and risk
+                    pages of a Yahoo ticker are fetched in parallel.
+        validate    checks every response: CAPTCHA pages, 429/503 answers, other server
+                    errors (5xx) and failed requests go back to the download stage with
+                    exponential backoff (blocked pages also slow the rate limiter down),
+                    404s and other errors are counted, good pages move on.
+        parse       nparsers threads parse each page as it arrives and extract its rows
+                    with the scrapers' compiled specs (see extraction_spec).
+        write       one thread standardizes the rows in small batches and writes them to
+                    the output sink, and archives the raw pages if asked to.
+
+    Parsing overlaps the network waits, so the first rows are written seconds after the
+    start and the whole run takes about as long as the downloads alone. Rows are written in
+    the order pages arrive, not in ticker list order. The bounded queues keep memory flat
+    when one stage is slower than the others.
+    """
+    def __init__(self, tickerlist_file, source="yfnc", delimiter="|", parser="lxml",
+                 nfetchers=8, nparsers=2, queue_size=64, rate_limits=None, throttle="adaptive",
+                 base_url=None, archive_folder=None, page_store="loose", max_retries=5,
+                 retry_backoff=60, batch_size=100, metrics_file=None):
+        """
+        @param tickerlist_file: Pipe delimited file of <ticker>|<fundname>
+        @type tickerlist_file: str
+        @param source: "gfnc" for google finance or "yfnc" for yahoo finance
+        @type source: str
+        @param delimiter: Delimiter used in tickerlist_file
+        @type delimiter: str
+        @param parser: parser backend, "lxml" or "bs4" (see parser_backends)
+        @type parser: str
+        @param nfetchers: number of pages in flight at a time
+        @type nfetchers: int
+        @param nparsers: number of parsing threads
+        @type nparsers: int
+        @param queue_size: capacity of the queues between the stages
+        @type queue_size: int
+        @param rate_limits: per-host request rates, see FundpageDownloader
+        @type rate_limits: dict
+        @param throttle: "adaptive" or "fixed", see FundpageDownloader
+        @type throttle: str
+        @param base_url: scheme and host to request the pages from instead of the real
+        sites, see mock_finance_server
+        @type base_url: str
+        @param archive_folder: When given, the raw pages are also saved to a page store in
+        this folder, as FundpageDownloader would
+        @type archive_folder: str
+        @param page_store: layout of the archive, "loose" or "pack"
+        @type page_store: str
+        @param max_retries: Number of times a blocked or failed page is retried before it is given up
+        @type max_retries: int
+        @param retry_backoff: Seconds to wait before the first retry of a blocked page. The
+        wait doubles with every further attempt.
+        @type retry_backoff: float
+        @param batch_size: rows standardized at a time. Small batches get rows out early.
+        @type batch_size: int
+        @param metrics_file: When given, metrics are written to <metrics_file>.json and
+        <metrics_file>.prom after run
+        @type metrics_file: str
+        """
+        if source not in output_tables:
+            raise ValueError("[FundPipeline] Unknown source %s" % source)
+        self.source = source
+        self.nfetchers = nfetchers
+        self.nparsers = nparsers
+        self.queue_size = queue_size
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.batch_size = batch_size
+        self.metrics = Metrics()
+        self.metrics_file = metrics_file
+        self.http_client = HttpClient(pool_size=max(10, nfetchers), metrics=self.metrics)
+        if rate_limits is None:
+            rate_limits = FundpageDownloader.default_rate_limits
+        if throttle == "adaptive":
+            self.rate_limiter = AdaptiveRateController(rate_limits, metrics=self.metrics)
+        elif throttle == "fixed":
+            self.rate_limiter = HostRateLimiter(rate_limits)
+        else:
+            raise ValueError("[FundPipeline] Unknown throttle %s" % throttle)
+
+        self.backend = parser_backends.create(parser, tidy=(source == "gfnc"), metrics=self.metrics)
+        specs = GfncScraper.specs if source == "gfnc" else YfncScraper.specs
+        self.extractor = CompiledSpec(specs, self.backend, self.metrics)
+
+        self.archive = None
+        if archive_folder is not None:
+            if not os.path.exists(archive_folder):
+                os.makedirs(archive_folder)
+            self.archive = PageStore.create(archive_folder, page_store)
+
+        urls = {}
+        for name in ["gfnc_baseurl", "yfnc_baseurl_profile", "yfnc_baseurl_performance",
+                     "yfnc_baseurl_risk"]:
+            url = getattr(FundpageDownloader, name)
+            urls[name] = FundpageDownloader.rebase(url, base_url) if base_url is not None else url
+        self.urls = urls
+
+        assert os.path.exists(tickerlist_file), \
+            "[FundPipeline] Tickerlist file %s does not exist" % tickerlist_file
+        with open(tickerlist_file, "rb") as f:
+            self.tickers = [record[0] for record in csv.reader(f, delimiter=delimiter)]
+
+        self.lock = threading.Lock()
+        self.counts = collections.Counter()
+        self.failed = []
+
+    def page_tasks(self, ticker):
+        """
+        @return: list of the PageTasks of ticker
+        """
+        if self.source == "gfnc":
+            return [PageTask(ticker, self.urls["gfnc_baseurl"] + ticker, ticker,
+                             ["performance", "risk", "profile"])]
+        return [PageTask(ticker, self.urls["yfnc_baseurl_%s" % kind] + ticker,
+                         "%s_%s" % (ticker, kind), [kind])
+                for kind in ["profile", "performance", "risk"]]
+
+    def run(self, sink):
+        """
+        Downloads, scrapes and writes the tables of all tickers to sink
+        @param sink: output sink receiving the gfnc_* or yfnc_* tables
+        @type sink: output_sinks.OutputSink
+        """
+        start = time.time()
+        # Entries are (time when ready, sequence number, attempt, PageTask). The queue is
+        # unbounded: the validator puts blocked pages back and must never wait on it.
+        fetch_queue = Queue.PriorityQueue()
+        validate_queue = Queue.Queue(self.queue_size)
+        parse_queue = Queue.Queue(self.queue_size)
+        write_queue = Queue.Queue(self.queue_size)
+
+        tasks = [task for ticker in self.tickers for task in self.page_tasks(ticker)]
+        for seq, task in enumerate(tasks):
+            fetch_queue.put((0, seq, 0, task))
+        state = {"remaining": len(tasks), "seq": len(tasks)}
+        progress = ProgressReporter(len(tasks), label="pages")
+
+        def fetcher():
+            while True:
+                with self.lock:
+                    if state["remaining"] == 0:
+                        return
+                try:
+                    ready, seq, attempt, task = fetch_queue.get(timeout=1)
+                except Queue.Empty:
+                    continue
+                # Entry is backing off; put it back and check again shortly
+                wait = ready - time.time()
+                if wait > 0:
+                    fetch_queue.put((ready, seq, attempt, task))
+                    time.sleep(min(wait, 1.0))
+                    continue
+                started = self.rate_limiter.acquire(task.url)
+                try:
+                    result, body = self.http_client.get(task.url)
+                except Exception, E:
+                    # Network errors (requests.RequestException) and anything else raised
+                    # by the request fail this attempt only; the validator retries it
+                    self.metrics.incr("download_errors_total", type=type(E).__name__)
+                    print "[%s] could not download %s" % (type(E).__name__, task.key)
+                    result, body = None, None
+                validate_queue.put((task, attempt, started, result, body))
+
+        def finish(outcome):
+            with self.lock:
+                self.counts[outcome] += 1
+                state["remaining"] -= 1
+                progress.update()
+                return state["remaining"] == 0
+
+        def validator():
+            done = state["remaining"] == 0
+            while not done:
+                task, attempt, started, result, body = validate_queue.get()
+                if result is not None:
+                    valid = FundpageDownloader.is_valid_page(result.status,
+                                                             body[:HttpClient.sniff_size])
+                    result = FetchResult(result.status, result.nbytes, False, not valid)
+                    self.rate_limiter.feedback(task.url, not FundpageDownloader.is_throttled(task.url, result),
+                                               started)
+                # Failed requests, blocked pages and server errors (5xx) are retried
+                if result is None or result.blocked or result.status >= 500:
+                    if result is not None and result.blocked:
+                        self.metrics.incr("captcha_hits_total" if result.status == 200 else "rate_limited_total",
+                                          source=self.source)
+                    elif result is not None:
+                        self.metrics.incr("server_errors_total", source=self.source, status=result.status)
+                    if attempt < self.max_retries:
+                        self.metrics.incr("download_retries_total", source=self.source)
+                        with self.lock:
+                            state["seq"] += 1
+                            seq = state["seq"]
+                        fetch_queue.put((time.time() + self.retry_backoff * 2 ** attempt, seq,
+                                         attempt + 1, task))
+                        continue
+                    self.failed.append(task.key)
+                    done = finish("failed")
+                elif result.status in (404, 410):
+                    done = finish("missing")
+                elif result.status != 200:
+                    done = finish("http_error")
+                else:
+                    self.metrics.incr("pages_downloaded_total", source=self.source)
+                    parse_queue.put((task, body))
+                    done = finish("parsed")
+            for _ in range(self.nparsers):
+                parse_queue.put(None)
+
+        def parser():
+            while True:
+                item = parse_queue.get()
+                if item is None:
+                    write_queue.put(None)
+                    return
+                task, body = item
+                if self.archive is not None:
+                    write_queue.put(("page", task.key, body))
+                try:
+                    with self.metrics.timer("scrape_parse_seconds"):
+                        tree = self.backend.parse(body)
+                    with self.metrics.timer("scrape_extract_seconds", table="all"):
+                        rows = self.extractor.extract(tree, task.tables)
+                except Exception, E:
+                    self.metrics.incr("parse_failures_total", type=type(E).__name__)
+                    print "[%s] could not parse %s" % (type(E).__name__, task.key)
+                    continue
+                for table in task.tables:
+                    row = {"ticker": task.ticker}
+                    row.update(rows[table])
+                    write_queue.put(("row", table, row))
+
+        # The write stage runs in this thread, as the sink writers are not thread safe
+        tables = output_tables[self.source]
+        writers = dict((table, sink.open_table(name, schema, self.metrics))
+                       for table, (name, schema, _) in tables.items())
+
+        threads = [threading.Thread(target=fetcher) for _ in range(self.nfetchers)] + \
+                  [threading.Thread(target=validator)] + \
+                  [threading.Thread(target=parser) for _ in range(self.nparsers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        batches = dict((table, []) for table in tables)
+        first_row = [None]
+
+        def flush(table):
+            standardize = tables[table][2]
+            rows = batches[table]
+            batches[table] = []
+            for row in (standardize(rows) if standardize is not None else rows):
+                writers[table].writerow(row)
+                if first_row[0] is None:
+                    first_row[0] = time.time() - start
+                    self.metrics.observe("pipeline_first_row_seconds", first_row[0])
+
+        try:
+            running = self.nparsers
+            while running > 0:
+                item = write_queue.get()
+                if item is None:
+                    running -= 1
+                    continue
+                kind, name, value = item
+                if kind == "page":
+                    self.archive.put(name, value)
+                    continue
+                batches[name].append(value)
+                if tables[name][2] is None or len(batches[name]) >= self.batch_size:
+                    flush(name)
+            for table in tables:
+                flush(table)
+        finally:
+            for writer in writers.values():
+                writer.close()
+            if self.archive is not None:
+                self.archive.close()
+
+        for thread in threads:
+            thread.join()
+        seconds = time.time() - start
+        self.metrics.observe("pipeline_seconds", seconds)
+        print "%s pages in %.1fs, first row after %.2fs" % (
+            ", ".join("%d %s" % (n, outcome) for outcome, n in sorted(self.counts.items())),
+            seconds, first_row[0] if first_row[0] is not None else float("nan"))
+        if self.metrics_file is not None:
+            self.metrics.export(self.metrics_file)
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Download and scrape fund pages in one pipelined pass")
+    argparser.add_argument("tickerlist", help="pipe delimited <ticker>|<fundname> file")
+    argparser.add_argument("location", help="output folder, database file or DSN of the sink")
+    argparser.add_argument("--source", choices=["gfnc", "yfnc"], default="yfnc")
+    argparser.add_argument("--sink", choices=["csv", "sqlite", "postgres", "arrow", "parquet"], default="csv")
+    argparser.add_argument("--parser", choices=["bs4", "lxml"], default="lxml")
+    argparser.add_argument("--fetchers", type=int, default=8, help="pages in flight at a time")
+    argparser.add_argument("--parsers", type=int, default=2, help="parsing threads")
+    argparser.add_argument("--archive", help="folder to also save the raw pages to")
+    argparser.add_argument("--base-url", help="request the pages from this host instead, e.g. a mock_finance_server")
+    argparser.add_argument("--rate", type=float,
+                           help="(starting) requests per second to the page host, by default that of "
+                                "the real site in FundpageDownloader.default_rate_limits")
+    argparser.add_argument("--metrics", help="prefix of the metrics files")
+    args = argparser.parse_args()
+
+    # The pages of a source come from one host; with --base-url that host takes the rate of
+    # the real site, instead of the one request per second of unlisted hosts
+    site = urlparse.urlsplit(FundpageDownloader.gfnc_baseurl if args.source == "gfnc"
+                             else FundpageDownloader.yfnc_baseurl_profile).netloc
+    host = urlparse.urlsplit(args.base_url).netloc if args.base_url else site
+    rate_limits = dict(FundpageDownloader.default_rate_limits)
+    rate_limits[host] = args.rate if args.rate is not None else rate_limits.get(site, 1.0)
+
+    pipeline = FundPipeline(args.tickerlist, source=args.source, parser=args.parser,
+                            nfetchers=args.fetchers, nparsers=args.parsers, rate_limits=rate_limits,
+                            base_url=args.base_url, archive_folder=args.archive,
+                            metrics_file=args.metrics)
+    sink = output_sinks.create(args.sink, args.location)
+    try:
+        pipeline.run(sink)
+    finally:
+        sink.close()
@@ -0,0 +1,598 @@
+"""
+In-memory fund screening over the scraped profile, risk and performance tables.
+
+The tables are loaded into a column store keyed by ticker: every column is a NumPy array
+with one cell per fund (NaN or None where a table has no value for the fund). Columns
+are addressed by their database column name (see the *_schema attributes of
+GfncKeymappings and YfncKeymappings), e.g. expense_ratio, sharpe5, r5y, or qualified with
+their table, e.g. gfnc_risk.sharpe5, when several tables have a column of that name.
+Unqualified names refer to the table loaded first.
+
+Queries are conjunctions of conditions, optionally followed by order by and limit:
+
+    expense_ratio < 0.5 and sharpe5 > sharpe5_cat order by r5y desc limit 20
+    family = 'Vanguard' and r1y between 5 and 15 order by expense_ratio
+    ticker in ('VFIAX', 'FXAIX')
+
+Conditions comparing a numeric column with a number are answered from a sorted index of
+the column (a binary search for the bounds of the range), conditions on text columns
+(ticker, family, ...) from a hash index. The candidate rows of the indexed conditions are
+intersected, smallest first, and the remaining conditions (comparisons between two
+columns, !=) are evaluated on the candidates only. order by ... limit k selects the top k
+rows with a partial sort. Indexes are built on first use and kept until a table is
+added, so repeated queries over ~27,000 funds take milliseconds.
+
+    >>> screener = FundScreener()
+    >>> screener.add_table("funds", [("ticker", "ticker", "varchar(5)"),
+    ...                              ("family", "family", "varchar(100)"),
+    ...                              ("er", "expense_ratio", "float"),
+    ...                              ("r5", "r5y", "float")],
+    ...                    [{"ticker": "AAAAX", "family": "Vanguard", "er": "0.2", "r5": "7.5"},
+    ...                     {"ticker": "BBBBX", "family": "Fidelity", "er": "0.9", "r5": "9.1"},
+    ...                     {"ticker": "CCCCX", "family": "Vanguard", "er": "0.1", "r5": ""}])
+    >>> [(row["ticker"], row["r5y"]) for row in screener.query("expense_ratio < 0.5 order by r5y desc")]
+    [('AAAAX', 7.5), ('CCCCX', None)]
+    >>> [row["ticker"] for row in screener.query("family = 'Vanguard' and expense_ratio <= 0.1")]
+    ['CCCCX']
+"""
+import argparse
+import csv
+import os
+import re
+import sys
+import time
+import numpy as np
+from fund_merger import missing_sentinels
+from gfnc_key_mappings import GfncKeymappings
+import standardization
+from yfnc_key_mappings import YfncKeymappings
+
+# Tables of the scrapers, in the order load_folder loads them
+tables = [
+    (YfncKeymappings.profile_table, YfncKeymappings.profile_schema),
+    (YfncKeymappings.risk_table, YfncKeymappings.risk_schema),
+    (YfncKeymappings.performance_table, YfncKeymappings.performance_schema),
+    (GfncKeymappings.profile_table, GfncKeymappings.profile_schema),
+    (GfncKeymappings.risk_table, GfncKeymappings.risk_schema),
+    (GfncKeymappings.performance_table, GfncKeymappings.performance_schema)
+]
+
+_token_pattern = re.compile(r"\s*(?:(?P<number>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)"
+                            r"|'(?P<string>[^']*)'"
+                            r"|(?P<name>[A-Za-z_][\w.]*)"
+                            r"|(?P<op><=|>=|!=|==|=|<|>|\(|\)|,))")
+
+_flipped = {"<": ">", "<=": ">=", ">": "<", ">=": "<=", "=": "=", "!=": "!="}
+
+
+class QueryError(ValueError):
+    """
+    Raised for queries that do not parse or refer to unknown columns
+    """
+    pass
+
+
+def tokenize(query):
+    """
+    @return: list of (kind, value) tokens, kind being "number", "string", "name" or "op"
+    """
+    tokens = []
+    position = 0
+    query = query.rstrip()
+    while position < len(query):
+        match = _token_pattern.match(query, position)
+        if match is None:
+            raise QueryError("[fund_screener] Cannot parse query at '%s'" % query[position:])
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "number":
+            value = float(value)
+        elif kind == "op" and value == "==":
+            value = "="
+        tokens.append((kind, value))
+        position = match.end()
+    return tokens
+
+
+class Query(object):
+    """
+    Parsed query: conditions, order by keys and limit
+
+    Conditions are tuples
+        ("compare", field, op, value)       field op number or 'string'
+        ("compare_fields", field, op, field)
+        ("between", field, low, high)
+        ("in", field, values)
+    """
+    def __init__(self, text):
+        self.tokens = tokenize(text)
+        self.position = 0
+        self.conditions = []
+        self.order_by = []
+        self.limit = None
+        self.parse()
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def next(self):
+        token = self.peek()
+        if token[0] is None:
+            raise QueryError("[fund_screener] Unexpected end of query")
+        self.position += 1
+        return token
+
+    def keyword(self, word):
+        kind, value = self.peek()
+        if kind == "name" and value.lower() == word:
+            self.position += 1
+            return True
+        return False
+
+    def expect(self, kind, value=None):
+        token_kind, token_value = self.next()
+        if token_kind != kind or (value is not None and token_value != value):
+            raise QueryError("[fund_screener] Expected %s, got '%s'" % (value or kind, token_value))
+        return token_value
+
+    def field(self):
+        return self.expect("name")
+
+    def literal(self):
+        kind, value = self.next()
+        if kind not in ("number", "string"):
+            raise QueryError("[fund_screener] Expected a number or a string, got '%s'" % value)
+        return value
+
+    def parse(self):
+        kind, value = self.peek()
+        if kind is not None and not (kind == "name" and value.lower() in ("order", "limit")):
+            self.conditions.append(self.condition())
+            while self.keyword("and"):
+                self.conditions.append(self.condition())
+
+        if self.keyword("order"):
+            if not self.keyword("by"):
+                raise QueryError("[fund_screener] Expected 'by' after 'order'")
+            while True:
+                field = self.field()
+                descending = self.keyword("desc")
+                if not descending:
+                    self.keyword("asc")
+                self.order_by.append((field, descending))
+                if self.peek() != ("op", ","):
+                    break
+                self.next()
+
+        if self.keyword("limit"):
+            limit = self.literal()
+            if not isinstance(limit, float) or limit != int(limit) or limit < 0:
+                raise QueryError("[fund_screener] limit must be a non-negative integer")
+            self.limit = int(limit)
+
+        if self.peek()[0] is not None:
+            raise QueryError("[fund_screener] Unexpected '%s'" % self.peek()[1])
+
+    def condition(self):
+        kind, value = self.next()
+        if kind in ("number", "string"):
+            # value op field, e.g. 0.5 > expense_ratio
+            op = self.expect("op")
+            if op not in _flipped:
+                raise QueryError("[fund_screener] Unknown operator %s" % op)
+            return ("compare", self.field(), _flipped[op], value)
+        if kind != "name":
+            raise QueryError("[fund_screener] Expected a column name, got '%s'" % value)
+
+        field = value
+        if self.keyword("between"):
+            low = self.literal()
+            if not self.keyword("and"):
+                raise QueryError("[fund_screener] Expected 'and' in between")
+            return ("between", field, low, self.literal())
+        if self.keyword("in"):
+            self.expect("op", "(")
+            values = [self.literal()]
+            while self.peek() == ("op", ","):
+                self.next()
+                values.append(self.literal())
+            self.expect("op", ")")
+            return ("in", field, values)
+
+        op = self.expect("op")
+        if op not in _flipped:
+            raise QueryError("[fund_screener] Unknown operator %s" % op)
+        kind, value = self.peek()
+        if kind == "name":
+            self.next()
+            return ("compare_fields", field, op, value)
+        return ("compare", field, op, self.literal())
+
+    def fields(self):
+        """
+        @return: columns the query refers to, in order of appearance
+        """
+        fields = []
+        for condition in self.conditions:
+            names = [condition[1]]
+            if condition[0] == "compare_fields":
+                names.append(condition[3])
+            fields.extend(name for name in names if name not in fields)
+        fields.extend(field for field, descending in self.order_by if field not in fields)
+        return fields
+
+
+class FundScreener(object):
+    """
+    Column store of fund tables with sorted and hash indexes, see the module documentation
+    """
+    def __init__(self):
+        self.tickers = []
+        # Hash index on ticker: ticker -> row id
+        self.row_ids = {}
+        # Qualified column name -> (row ids, values) as loaded, and column type
+        self.loaded = {}
+        self.types = {}
+        # Unqualified column name -> qualified name of the first table with that column
+        self.aliases = {"ticker": "ticker"}
+        self.types["ticker"] = "text"
+        self.reset()
+
+    def reset(self):
+        """
+        Drops the aligned columns and the indexes, after the set of rows changed
+        """
+        self.columns = {}
+        self.sorted_indexes = {}
+        self.hash_indexes = {}
+
+    def row_id(self, ticker):
+        if ticker not in self.row_ids:
+            self.row_ids[ticker] = len(self.tickers)
+            self.tickers.append(ticker)
+        return self.row_ids[ticker]
+
+    def add_table(self, table, schema, rows):
+        """
+        Adds the columns of a table, keyed by the ticker of its rows
+        @param table: table name, e.g. gfnc_profiles
+        @type table: str
+        @param schema: list of (csv field, column, column type) triples. The ticker field is
+        the key of the rows.
+        @type schema: list
+        @param rows: row dicts keyed by csv field
+        @type rows: iterable
+
+        Placeholder values standing for a missing value (fund_merger.missing_sentinels,
+        e.g. the -1.0 total_assets of gfnc_profiles) are loaded as missing.
+        """
+        schema = [(field, column, column_type) for field, column, column_type in schema
+                  if column != "ticker"]
+        ids = []
+        values = dict((field, []) for field, column, column_type in schema)
+        for row in rows:
+            ids.append(self.row_id(row["ticker"]))
+            for field, column, column_type in schema:
+                values[field].append(row.get(field, ""))
+        ids = np.array(ids, dtype=np.int64)
+
+        for field, column, column_type in schema:
+            name = "%s.%s" % (table, column)
+            if column_type == "float":
+                self.types[name] = "float"
+                column_values = standardization.to_float(values[field])
+                sentinel = missing_sentinels.get((table, column))
+                if sentinel is not None:
+                    column_values[column_values == sentinel] = np.nan
+                self.loaded[name] = (ids, column_values)
+            else:
+                self.types[name] = "text"
+                self.loaded[name] = (ids, [value if value != "" else None for value in values[field]])
+            self.aliases.setdefault(column, name)
+        self.reset()
+
+    def load_csv(self, filename, table, schema, delimiter="|"):
+        """
+        Adds a CSV file written by the scrapers (header of csv fields)
+        """
+        with open(filename, "rb") as f:
+            self.add_table(table, schema, csv.DictReader(f, delimiter=delimiter))
+
+    def load_folder(self, folder):
+        """
+        Adds the tables of an output_sinks.CsvSink folder (<folder>/<table>.csv) that exist,
+        Yahoo tables first
+        @return: names of the tables loaded
+        @rtype: list
+        """
+        loaded = []
+        for table, schema in tables:
+            filename = os.path.join(folder, "%s.csv" % table)
+            if os.path.exists(filename):
+                self.load_csv(filename, table, schema)
+                loaded.append(table)
+        return loaded
+
+    def resolve(self, name):
+        """
+        @return: qualified column name of name
+        @raise QueryError: for unknown columns
+        """
+        if name in self.types:
+            return name
+        if name in self.aliases:
+            return self.aliases[name]
+        raise QueryError("[fund_screener] Unknown column %s" % name)
+
+    def column(self, name):
+        """
+        @return: column name as an array with one cell per ticker: float64 (NaN for missing
+        values) for numeric columns, objects (None for missing values) for text columns
+        """
+        name = self.resolve(name)
+        if name not in self.columns:
+            if name == "ticker":
+                column = np.array(self.tickers, dtype=object)
+            elif self.types[name] == "float":
+                ids, values = self.loaded[name]
+                column = np.full(len(self.tickers), np.nan)
+                column[ids] = values
+            else:
+                ids, values = self.loaded[name]
+                column = np.empty(len(self.tickers), dtype=object)
+                column[ids] = values
+            self.columns[name] = column
+        return self.columns[name]
+
+    def sorted_index(self, name):
+        """
+        @return: tuple (sorted values, row ids in that order) of the cells of a numeric
+        column that have a value
+        """
+        name = self.resolve(name)
+        if name not in self.sorted_indexes:
+            column = self.column(name)
+            present = np.flatnonzero(~np.isnan(column))
+            order = present[np.argsort(column[present], kind="mergesort")]
+            self.sorted_indexes[name] = (column[order], order)
+        return self.sorted_indexes[name]
+
+    def hash_index(self, name):
+        """
+        @return: dict value -> array of row ids of a text column
+        """
+        name = self.resolve(name)
+        if name == "ticker":
+            return dict((ticker, np.array([row_id])) for ticker, row_id in self.row_ids.items())
+        if name not in self.hash_indexes:
+            index = {}
+            for row_id, value in enumerate(self.column(name)):
+                if value is not None:
+                    index.setdefault(value, []).append(row_id)
+            self.hash_indexes[name] = dict((value, np.array(ids)) for value, ids in index.items())
+        return self.hash_indexes[name]
+
+    def range(self, name, low=None, high=None, include_low=True, include_high=True):
+        """
+        @return: row ids (sorted by value) of a numeric column with low <(=) value <(=) high.
+        None bounds are open.
+        """
+        values, order = self.sorted_index(name)
+        start = 0 if low is None else \
+            np.searchsorted(values, low, side="left" if include_low else "right")
+        end = len(values) if high is None else \
+            np.searchsorted(values, high, side="right" if include_high else "left")
+        return order[start:end]
+
+    def lookup(self, name, values):
+        """
+        @return: sorted row ids of a text column holding one of values
+        """
+        if name == "ticker":
+            ids = [self.row_ids[value] for value in values if value in self.row_ids]
+            return np.array(sorted(set(ids)), dtype=np.int64)
+        index = self.hash_index(name)
+        matches = [index[value] for value in set(values) if value in index]
+        return np.sort(np.concatenate(matches)) if matches else np.array([], dtype=np.int64)
+
+    def indexed(self, condition):
+        """
+        @return: row ids matching condition from the indexes, or None if the condition is
+        not answered by an index
+        """
+        kind, name = condition[0], condition[1]
+        numeric = self.types[self.resolve(name)] == "float"
+        literals = {"compare": condition[3:], "between": condition[2:], "in": condition[2]}.get(kind, [])
+        for value in literals:
+            if numeric != isinstance(value, float):
+                raise QueryError("[fund_screener] Cannot compare %s with %r" % (name, value))
+        if kind == "compare":
+            op, value = condition[2], condition[3]
+            if op == "!=":
+                return None
+            if not numeric:
+                if op != "=":
+                    return None
+                return self.lookup(name, [value])
+            if op == "=":
+                return self.range(name, value, value)
+            if op in ("<", "<="):
+                return self.range(name, high=value, include_high=op == "<=")
+            return self.range(name, low=value, include_low=op == ">=")
+        if kind == "between":
+            return self.range(name, condition[2], condition[3]) if numeric else None
+        if kind == "in":
+            if numeric:
+                return np.unique(np.concatenate([self.range(name, value, value)
+                                                 for value in condition[2]]))
+            return self.lookup(name, condition[2])
+        return None
+
+    @staticmethod
+    def compare(left, op, right):
+        """
+        Elementwise comparison, false wherever a side has no value
+        """
+        if op == "<":
+            return left < right
+        if op == "<=":
+            return left <= right
+        if op == ">":
+            return left > right
+        if op == ">=":
+            return left >= right
+        if op == "=":
+            return left == right
+        return (left != right) & FundScreener.present(left) & FundScreener.present(right)
+
+    @staticmethod
+    def present(values):
+        if isinstance(values, np.ndarray):
+            if values.dtype == object:
+                return np.array([value is not None for value in values], dtype=bool)
+            return ~np.isnan(values)
+        return values is not None
+
+    def residual(self, condition, candidates):
+        """
+        @return: boolean mask of the candidates matching a condition not answered by an index
+        """
+        kind, name = condition[0], condition[1]
+        left = self.column(name)[candidates]
+        if kind == "compare_fields":
+            right = self.column(condition[3])[candidates]
+            if (left.dtype == object) != (right.dtype == object):
+                raise QueryError("[fund_screener] Cannot compare %s with %s" % (name, condition[3]))
+            with np.errstate(invalid="ignore"):
+                return FundScreener.compare(left, condition[2], right) & \
+                    FundScreener.present(left) & FundScreener.present(right)
+        if kind == "compare":
+            with np.errstate(invalid="ignore"):
+                return FundScreener.compare(left, condition[2], condition[3]) & FundScreener.present(left)
+        if kind == "between":
+            return FundScreener.present(left) & \
+                np.array([value is not None and condition[2] <= value <= condition[3] for value in left],
+                         dtype=bool)
+        return np.array([value in condition[2] for value in left], dtype=bool)
+
+    def order(self, candidates, order_by, limit):
+        """
+        @return: candidates sorted by the order by keys, cut to the first limit rows. Rows
+        without a value for a key sort last.
+        """
+        if not order_by:
+            return candidates[:limit] if limit is not None else candidates
+
+        keys = []
+        for name, descending in order_by:
+            values = self.column(name)[candidates]
+            if values.dtype == object:
+                # Sort text by rank
+                ranks = np.unique(np.array(["" if value is None else value for value in values]),
+                                  return_inverse=True)[1].astype(np.float64)
+                ranks[~FundScreener.present(values)] = np.nan
+                values = ranks
+            values = -values if descending else values.copy()
+            values[np.isnan(values)] = np.inf
+            keys.append(values)
+
+        if len(keys) == 1 and limit is not None and limit < len(candidates):
+            # Top k: partition around the k-th value, then sort the first k
+            if limit == 0:
+                return candidates[:0]
+            top = np.argpartition(keys[0], limit - 1)[:limit]
+            top = top[np.lexsort((top, keys[0][top]))]
+            return candidates[top]
+
+        # np.lexsort sorts by its last key first; ties keep row id order
+        order = np.lexsort([np.arange(len(candidates))] + keys[::-1])
+        order = order[:limit] if limit is not None else order
+        return candidates[order]
+
+    def select(self, query):
+        """
+        @param query: query text or parsed Query
+        @return: row ids of the funds matching query, in result order
+        @rtype: numpy.ndarray
+        """
+        if not isinstance(query, Query):
+            query = Query(query)
+        for name in query.fields():
+            self.resolve(name)
+
+        # Intersect the row ids of the indexed conditions, smallest first
+        matches = []
+        residuals = []
+        for condition in query.conditions:
+            ids = self.indexed(condition)
+            if ids is None:
+                residuals.append(condition)
+            else:
+                matches.append(ids)
+        matches.sort(key=len)
+        if matches:
+            candidates = np.sort(matches[0])
+            for ids in matches[1:]:
+                if len(candidates) == 0:
+                    break
+                candidates = np.intersect1d(candidates, ids, assume_unique=True)
+        else:
+            candidates = np.arange(len(self.tickers))
+
+        for condition in residuals:
+            if len(candidates) == 0:
+                break
+            candidates = candidates[self.residual(condition, candidates)]
+
+        return self.order(candidates, query.order_by, query.limit)
+
+    def rows(self, row_ids, fields):
+        """
+        @return: row dicts of fields for row_ids. Missing values are None.
+        """
+        columns = [(field, self.column(field)[row_ids]) for field in fields]
+        rows = [{} for row_id in row_ids]
+        for field, values in columns:
+            numeric = values.dtype != object
+            for row, value in zip(rows, values.tolist()):
+                row[field] = None if numeric and value != value else value
+        return rows
+
+    def query(self, query, fields=None):
+        """
+        @param query: query text, see the module documentation
+        @type query: str
+        @param fields: columns of the result rows. Defaults to the ticker and the columns
+        the query refers to.
+        @type fields: list
+        @return: matching funds as row dicts
+        @rtype: list
+        @raise QueryError: for queries that do not parse or refer to unknown columns
+        """
+        query = Query(query)
+        if fields is None:
+            fields = ["ticker"] + [field for field in query.fields() if field != "ticker"]
+        return self.rows(self.select(query), fields)
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Screen funds in the CSV tables of the scrapers")
+    argparser.add_argument("folder", help="folder of the <table>.csv files of an output_sinks.CsvSink")
+    argparser.add_argument("query", help="e.g. \"expense_ratio < 0.5 order by r5y desc limit 20\"")
+    argparser.add_argument("--fields", help="comma separated columns to print")
+    args = argparser.parse_args()
+
+    screener = FundScreener()
+    print >> sys.stderr, "loaded %s" % ", ".join(screener.load_folder(args.folder))
+    fields = args.fields.split(",") if args.fields else None
+
+    start = time.time()
+    result = screener.query(args.query, fields)
+    elapsed = time.time() - start
+
+    fields = fields or (["ticker"] + [field for field in Query(args.query).fields() if field != "ticker"])
+    writer = csv.writer(sys.stdout, delimiter="|")
+    writer.writerow(fields)
+    for row in result:
+        writer.writerow(["" if row[field] is None else row[field] for field in fields])
+    print >> sys.stderr, "%d funds in %.1f ms" % (len(result), elapsed * 1000)
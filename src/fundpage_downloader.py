@@ -1,9 +1,16 @@
 import csv
 import os
+import Queue
 import shutil
-from bs4 import BeautifulSoup
-import requests
+import threading
+import re
 import time
+import urlparse
+from download_journal import DownloadJournal
+from http_client import HttpClient
+from metrics import Metrics, ProgressReporter
+from page_store import PageStore
+from rate_limiter import AdaptiveRateController, HostRateLimiter
 
 
 class FundpageDownloader(object):
@@ -19,12 +26,41 @@ class FundpageDownloader(object):
     yfnc_baseurl_performance = "http://finance.yahoo.com/q/pm?s="
     yfnc_baseurl_risk = "http://finance.yahoo.com/q/rk?s="
 
+    # Default per-host request budgets in requests per second. Fast programmatic hits to
+    # Google finance get CAPTCHA responses, so Google starts at one page every 5 seconds.
+    # With adaptive throttling these are starting points and unlisted hosts start at one
+    # request per second; with fixed throttling unlisted hosts are not throttled.
+    default_rate_limits = {
+        "www.google.com": 0.2
+    }
+
+    # Responses recognised as blocked downloads: CAPTCHA pages carry a captcha handler
+    # in the onload attribute of their body, throttled requests get 429/503.
+    captcha_pattern = re.compile(r"<body[^>]*\sonload\s*=\s*[\"'][^\"']*captcha", re.IGNORECASE)
+    blocked_statuses = (429, 503)
+
+    # Pages smaller than this (in bytes) are a sign of throttling: the host answers, but
+    # with a stub. They are saved, but slow down adaptive throttling like a blocked page.
+    min_page_sizes = {
+        "www.google.com": 3000
+    }
+
     def __init__(self, tickerlist_file=None,
                  delimiter="|",
                  downloads_folder=None,
                  failed_downloads_file=None,
                  source="gfnc",
-                 fresh=False):
+                 fresh=False,
+                 nworkers=1,
+                 rate_limits=None,
+                 throttle="adaptive",
+                 page_store="loose",
+                 max_retries=5,
+                 retry_backoff=60,
+                 metrics_file=None,
+                 journal_file=None,
+                 sync_journal=False,
+                 base_url=None):
         """
         @param tickerlist_file: Pipe delimited file of <ticker>|<fundname>
         @type tickerlist_file: str
@@ -37,7 +73,39 @@ class FundpageDownloader(object):
         @type source: str
         @param fresh: Delete and recreate downloads folder
         @type fresh: bool
-
+        @param nworkers: Number of downloads in flight at a time
+        @type nworkers: int
+        @param rate_limits: Per-host request budgets, mapping host name to requests per
+        second or to a (requests per second, burst) tuple. Defaults to
+        FundpageDownloader.default_rate_limits
+        @type rate_limits: dict
+        @param throttle: "adaptive" starts every host at its rate in rate_limits and adapts
+        the rate to the responses of the host (see rate_limiter.AdaptiveRateController);
+        "fixed" holds every host to its rate in rate_limits
+        @type throttle: str
+        @param page_store: Layout of the downloads folder. "loose" writes one html file
+        per page, "pack" writes compressed pack files (see page_store.PackStore)
+        @type page_store: str
+        @param max_retries: Number of times a blocked ticker is retried before it is written
+        to failed_downloads_file
+        @type max_retries: int
+        @param retry_backoff: Seconds to wait before the first retry of a blocked ticker.
+        The wait doubles with every further attempt.
+        @type retry_backoff: float
+        @param metrics_file: When given, download metrics (bytes, request latency, CAPTCHA
+        hits, errors) are written to <metrics_file>.json and <metrics_file>.prom after
+        download_fundpages, see metrics.Metrics
+        @type metrics_file: str
+        @param journal_file: Journal of the download attempts (see download_journal), by
+        default download_journal_<source>.jsonl in the downloads folder. Tickers the
+        journal records as done are skipped, so an interrupted run is resumed by running
+        download_fundpages again.
+        @type journal_file: str
+        @param sync_journal: fsync every journal record
+        @type sync_journal: bool
+        @param base_url: scheme and host (e.g. http://localhost:8000) to request the pages
+        from instead of the real sites, at the same paths; see mock_finance_server
+        @type base_url: str
         """
         # Start a fresh downloads folder. If exists, delete and create. If doesn't exist,
         # just create.
@@ -57,7 +125,30 @@ class FundpageDownloader(object):
                 Either create externally or create new downloader instance with fresh=True'''\
                 % tickerlist_file
 
+        self.store = PageStore.create(self.downloads_folder, page_store)
+        if base_url is not None:
+            for name in ["gfnc_baseurl", "yfnc_baseurl_profile", "yfnc_baseurl_performance",
+                         "yfnc_baseurl_risk"]:
+                setattr(self, name, FundpageDownloader.rebase(getattr(FundpageDownloader, name), base_url))
         self.source = source
+        if journal_file is None:
+            journal_file = os.path.join(self.downloads_folder, "download_journal_%s.jsonl" % source)
+        self.journal = DownloadJournal(journal_file, sync=sync_journal)
+        self.nworkers = nworkers
+        if rate_limits is None:
+            rate_limits = FundpageDownloader.default_rate_limits
+        self.metrics = Metrics()
+        if throttle == "adaptive":
+            self.rate_limiter = AdaptiveRateController(rate_limits, metrics=self.metrics)
+        elif throttle == "fixed":
+            self.rate_limiter = HostRateLimiter(rate_limits)
+        else:
+            raise ValueError("[FundpageDownloader] Unknown throttle %s" % throttle)
+        self.metrics_file = metrics_file
+        self.http_client = HttpClient(pool_size=max(10, nworkers), metrics=self.metrics)
+        self.print_lock = threading.Lock()
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
 
         assert os.path.exists(tickerlist_file), \
             "[FundpageDownloader] Tickerlist file %s does not exist" % tickerlist_file
@@ -68,46 +159,252 @@ class FundpageDownloader(object):
             symbs = [record[0] for record in tickerlist]
             fundnames = [record[1] for record in tickerlist]
             self.funds = dict(zip(symbs, fundnames))
+            self.tickers = symbs
             self.nfunds = len(tickerlist)
-            del tickerlist, symbs, fundnames
+            del tickerlist, fundnames
 
-    def download_fundpages(self):
+    def download_fundpages(self, tickers=None):
             """
             Reads records from the supplied delimited file, extracts ticker symbol and passes
-            on to yfnc_fund_page_downloader(ticker) for the actual download task
+            on to download_fundpage(ticker) for the actual download task. The downloads are
+            spread over self.nworkers threads; every request waits on the rate limiter of
+            its host.
+
+            Fast programmatic hits to Google finance pages results in some pages getting
+            CAPTCHA response. Such responses are detected as they arrive and are not saved;
+            the ticker goes back on the queue and is retried with exponential backoff, as
+            are tickers the host failed with a server error (5xx).
+            Tickers still blocked after max_retries attempts are appended to
+            failed_downloads_file as they give up.
+
+            Every attempt is recorded in the download journal as it completes. Tickers the
+            journal already records as done (or unknown to the host) are skipped, so after
+            an interruption, or to retry the tickers that failed, the same call is simply
+            run again.
+
+            @param tickers: Tickers to download, in order of priority (see
+            refresh_scheduler). They are downloaded whatever the journal says. By default
+            the tickers of the ticker list not yet done are downloaded in list order.
+            @type tickers: list
             """
+            # If a 'failed_downloads' file exists already, rename it by appending a current
+            # timestamp to its name.
+            if os.path.exists(self.failed_downloads_file):
+                print "found failed downloads file %s" % self.failed_downloads_file
+                old_failed_downloads = "%s.%s" % (self.failed_downloads_file, str(int(time.time())))
+                os.rename(self.failed_downloads_file, old_failed_downloads)
+
+            # Queue entries are (time when ready, position in ticker list, attempt, ticker)
+            ticker_queue = Queue.PriorityQueue()
+            if tickers is None:
+                pending = [ticker for ticker in self.tickers if not self.journal.is_final(ticker)]
+            else:
+                pending = list(tickers)
+            for count, ticker in enumerate(pending):
+                ticker_queue.put((0, count, 0, ticker))
+            if tickers is None and len(pending) < self.nfunds:
+                print "resuming: %d of %d tickers already done" % (self.nfunds - len(pending), self.nfunds)
+                self.metrics.incr("funds_skipped_total", self.nfunds - len(pending), source=self.source)
+            self.remaining = len(pending)
+            progress = ProgressReporter(len(pending), label="downloaded")
+
+            with open(self.failed_downloads_file, "wb") as f:
+                failed_writer = csv.writer(f, delimiter="|")
+
+                def worker():
+                    while True:
+                        with self.print_lock:
+                            if self.remaining == 0:
+                                return
+                        try:
+                            ready, count, attempt, ticker = ticker_queue.get(timeout=1)
+                        except Queue.Empty:
+                            continue
+
+                        # Entry is backing off; put it back and check again shortly
+                        wait = ready - time.time()
+                        if wait > 0:
+                            ticker_queue.put((ready, count, attempt, ticker))
+                            time.sleep(min(wait, 1.0))
+                            continue
+
+                        try:
+                            with self.metrics.timer("fund_download_seconds", source=self.source):
+                                downloaded = self.download_fundpage(count, ticker, attempt)
+                        except Exception, E:
+                            # Network errors (requests.RequestException) and anything else
+                            # raised while saving the page fail this attempt only
+                            self.metrics.incr("download_errors_total", type=type(E).__name__)
+                            self.journal.record(ticker, "error", attempt=attempt,
+                                                error="%s: %s" % (type(E).__name__, E))
+                            with self.print_lock:
+                                print "[%s] could not download %s" % (type(E).__name__, ticker)
+                            downloaded = False
+
+                        if not downloaded and attempt < self.max_retries:
+                            self.metrics.incr("download_retries_total", source=self.source)
+                            delay = self.retry_backoff * 2 ** attempt
+                            ticker_queue.put((time.time() + delay, count, attempt + 1, ticker))
+                            continue
+
+                        with self.print_lock:
+                            if not downloaded:
+                                self.journal.record(ticker, "failed", attempt=attempt)
+                                print "Not downloaded %s" % ticker
+                                failed_writer.writerow([ticker, self.funds.get(ticker, "")])
+                                f.flush()
+                            self.remaining -= 1
+                        self.metrics.incr("funds_total", source=self.source,
+                                          outcome="downloaded" if downloaded else "failed")
+                        progress.update()
+
+                threads = [threading.Thread(target=worker) for _ in range(self.nworkers)]
+                for thread in threads:
+                    thread.daemon = True
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+            # Keep only the last record of every ticker
+            self.journal.compact()
+            print "journal: %s" % ", ".join("%d %s" % (n, status)
+                                            for status, n in sorted(self.journal.counts().items()))
+
+            if isinstance(self.rate_limiter, AdaptiveRateController):
+                print "request rates: %s" % ", ".join("%s %.2f/s" % (host, rate)
+                                                      for host, rate in sorted(self.rate_limiter.rates().items()))
+
+            if self.metrics_file is not None:
+                self.metrics.export(self.metrics_file)
+
+    def download_fundpage(self, count, ticker, attempt=0):
+        """
+        Downloads the page(s) of a single ticker from self.source and records the outcome
+        of every page in self.metrics and in the download journal
+        @param count: position of ticker in the ticker list
+        @type count: int
+        @type ticker: str
+        @param ticker: Ticker symbol
+        @param attempt: number of the attempt, starting at 0
+        @type attempt: int
+        @return: False if a page was blocked (CAPTCHA or rate limited) or the host failed
+        with a server error (5xx), so the ticker is retried; True otherwise
+        """
+        if self.source == "gfnc":
+            results = [self.download_gfnc_fundpage(ticker)]
+        elif self.source == "yfnc":
+            results = self.download_yfnc_fundpage(ticker)
+        else:
+            raise ValueError("[FundpageDownloader] Unknown source %s" % self.source)
+
+        for result in results:
+            if result.blocked and result.status in FundpageDownloader.blocked_statuses:
+                self.metrics.incr("rate_limited_total", source=self.source, status=result.status)
+            elif result.blocked:
+                self.metrics.incr("captcha_hits_total", source=self.source)
+            elif result.status >= 500:
+                self.metrics.incr("server_errors_total", source=self.source, status=result.status)
+            elif result.not_modified:
+                self.metrics.incr("pages_not_modified_total", source=self.source)
+            else:
+                self.metrics.incr("pages_downloaded_total", source=self.source)
+
+        self.journal.record(ticker, FundpageDownloader.journal_status(results),
+                            http_status=max(result.status for result in results),
+                            nbytes=sum(result.nbytes for result in results if not result.blocked),
+                            attempt=attempt)
+        return not any(result.blocked or result.status >= 500 for result in results)
 
-            for count, ticker in enumerate(self.funds):
-                print "downloading (%s of %s) %s..." % (count, self.nfunds, ticker),
-                if self.source == "gfnc":
-                    downloaded_page_size = self.download_gfnc_fundpage(ticker)
-                    # if downloaded_page_size < 3000:
-                    #     time.sleep(5)
-                    print "%s KB" % round(downloaded_page_size / 1000.0)
-                    time.sleep(5)
-                elif self.source == "yfnc":
-                    self.download_yfnc_fundpage(ticker)
-
-            # Validate that all downloaded pages contain valid data. Fast programmatic
-            # hits to Google finance pages results in come pages getting CAPTCHA response.
-            # The validator function writes un-downloaded symbols to a separate file.
-            if self.source == "gfnc":
-                self.list_failed_downloads()
+    @staticmethod
+    def journal_status(results):
+        """
+        @param results: outcome of the page(s) of a ticker
+        @type results: list (of http_client.FetchResult)
+        @return: status of the ticker for the download journal, see download_journal
+        @rtype: str
+        """
+        for result in results:
+            if result.blocked and result.status in FundpageDownloader.blocked_statuses:
+                return "rate_limited"
+            if result.blocked:
+                return "captcha"
+        for result in results:
+            if result.status >= 500:
+                return "server_error"
+        for result in results:
+            if result.status in (404, 410):
+                return "missing"
+            if result.status >= 400:
+                return "http_error"
+        return "done"
+
+    @staticmethod
+    def is_valid_page(status, head):
+        """
+        Checks a response as it arrives. Pages refused by the host (429/503) and CAPTCHA
+        pages, recognised by a 'captcha' handler in the body's onload attribute, are invalid.
+        @param status: HTTP status code
+        @type status: int
+        @param head: leading bytes of the response body
+        @type head: str
+        @rtype: bool
+        """
+        if status in FundpageDownloader.blocked_statuses:
+            return False
+        return FundpageDownloader.captcha_pattern.search(head) is None
+
+    @staticmethod
+    def rebase(url, base_url):
+        """
+        @return: url with its scheme and host replaced by those of base_url
+        @rtype: str
+
+        >>> FundpageDownloader.rebase("http://finance.yahoo.com/q/pr?s=", "http://localhost:8000")
+        'http://localhost:8000/q/pr?s='
+        """
+        url = urlparse.urlsplit(url)
+        return "%s%s?%s" % (base_url.rstrip("/"), url.path, url.query)
+
+    @staticmethod
+    def is_throttled(url, result):
+        """
+        @param url: page url
+        @type url: str
+        @type result: http_client.FetchResult
+        @return: True if the response says we are going too fast: the page was blocked, or
+        a fresh page is smaller than the host's min_page_sizes
+        @rtype: bool
+        """
+        if result.blocked:
+            return True
+        min_size = FundpageDownloader.min_page_sizes.get(urlparse.urlparse(url).netloc, 0)
+        return result.status == 200 and not result.not_modified and result.nbytes < min_size
+
+    def fetch(self, url, key):
+        """
+        Waits for the rate limiter of the url's host, downloads url and saves it in the
+        page store under key. Pages unchanged since the last download are not re-written,
+        and blocked pages are not saved at all. The outcome is fed back to the rate limiter.
+        @param url: page url
+        @type url: str
+        @param key: key of the page in the page store
+        @type key: str
+        @rtype: http_client.FetchResult
+        """
+        started = self.rate_limiter.acquire(url)
+        result = self.http_client.download(url, self.store, key, FundpageDownloader.is_valid_page)
+        self.rate_limiter.feedback(url, not FundpageDownloader.is_throttled(url, result), started)
+        return result
 
     def download_gfnc_fundpage(self, ticker):
         """
         Downloades one page per mutual fund from Google finance
         @type ticker: str
         @param ticker: Ticker symbol
-        @return: None
+        @rtype: http_client.FetchResult
         """
-        pageurl = FundpageDownloader.gfnc_baseurl + ticker
-        response = requests.get(pageurl)
-        filename = "%s/%s.html" % (self.downloads_folder, ticker)
-
-        with open(filename, "w") as f:
-            f.write(response.content)
-        return os.path.getsize(filename)
+        pageurl = self.gfnc_baseurl + ticker
+        return self.fetch(pageurl, ticker)
 
     def download_yfnc_fundpage(self, ticker):
         """
@@ -115,31 +412,26 @@ class FundpageDownloader(object):
         from Yahoo Finance.
         @type ticker: str
         @param ticker: Ticker symbol
-        @return: None
+        @return: list of http_client.FetchResult, one per page
         """
-        url_profile = FundpageDownloader.yfnc_baseurl_profile + ticker
-        url_performance = FundpageDownloader.yfnc_baseurl_performance + ticker
-        url_risk = FundpageDownloader.yfnc_baseurl_risk + ticker
+        url_profile = self.yfnc_baseurl_profile + ticker
+        url_performance = self.yfnc_baseurl_performance + ticker
+        url_risk = self.yfnc_baseurl_risk + ticker
 
         urls = {"profile": url_profile,
                 "performance": url_performance,
                 "risk": url_risk}
-        for kind in urls:
-            response = requests.get(urls[kind])
-            filename = "%s/%s_%s.html" % (self.downloads_folder, ticker, kind)
-            with open(filename, "w") as f:
-                f.write(response.content)
+        return [self.fetch(urls[kind], "%s_%s" % (ticker, kind)) for kind in urls]
 
     def list_failed_downloads(self):
         """
-        Separates downloaded webpages into those with data and those without.
-        The ones without data have captchas. We locate presencee of captchas
-        to detect un-downloaded pages
+        Audits pages already in the downloads folder, e.g. saved by an older version of
+        the downloader, and writes tickers whose saved page is a CAPTCHA page to
+        failed_downloads_file. download_fundpages detects CAPTCHAs as pages arrive and
+        does not need this pass.
         """
         print "Generating failed downloads..."
 
-        # failed_downloads = "../csv/failed_downloads.csv"
-
         # If a 'failed_downloads' file exists already, rename it by appending a current
         # timestamp to its name.
         if os.path.exists(self.failed_downloads_file):
@@ -150,11 +442,6 @@ class FundpageDownloader(object):
         with open(self.failed_downloads_file, "wb") as f:
             writer = csv.writer(f, delimiter="|")
             for ticker in self.funds:
-                page = os.path.join(self.downloads_folder, "%s.html" % ticker)
-                soup = BeautifulSoup(open(page))
-                try:
-                    if "captcha" in soup.body.attrs["onload"]:
-                        print "Not downloaded %s" % ticker
-                        writer.writerow([ticker, self.funds[ticker]])
-                except KeyError:
-                    pass
\ No newline at end of file
+                if FundpageDownloader.captcha_pattern.search(self.store.get(ticker)) is not None:
+                    print "Not downloaded %s" % ticker
+                    writer.writerow([ticker, self.funds[ticker]])
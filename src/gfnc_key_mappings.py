@@ -12,3 +12,57 @@ class GfncKeymappings(object):
         "Other": "pct_other"
     }
 
+    management_fields = [
+        "total_assets", "front_load", "deferred_load",
+        "expense_ratio", "management_fees", "fund_family"
+    ]
+
+    allocation_fields = [
+        "pct_cash", "pct_stock", "pct_bonds",
+        "pct_preferred", "pct_convertible", "pct_other"
+    ]
+
+    profile_fields = ["ticker"] + management_fields + allocation_fields
+
+    # Risk fields are grouped by the row of the risk table they are read from.
+    # Columns of each row are the 1, 3, 5 and 10 year values.
+    risk_field_rows = [
+        ["alpha1", "alpha3", "alpha5", "alpha10"],
+        ["beta1", "beta3", "beta5", "beta10"],
+        ["MAR1", "MAR3", "MAR5", "MAR10"],
+        ["R2_1", "R2_3", "R2_5", "R2_10"],
+        ["SD1", "SD3", "SD5", "SD10"],
+        ["sharpe1", "sharpe3", "sharpe5", "sharpe10"]
+    ]
+
+    risk_fields = ["ticker"] + reduce(lambda x, y: x + y, risk_field_rows)
+
+    # Strings for intervals for which return information is available in Google Finance
+    performance_intervals = [
+        "1 day", "1 week", "4 week", "3 month", "YTD",
+        "1 year", "3 years", "5 years"
+    ]
+
+    performance_fields = ["ticker"] + performance_intervals
+
+    # Database tables and their schemas, as (csv field, column, column type) triples.
+    # Column names follow sql/load_tables.sql, see output_sinks.
+    profile_table = "gfnc_profiles"
+    profile_schema = [("ticker", "ticker", "varchar(5)")] + \
+        [(field, field, "float") for field in management_fields[:-1]] + \
+        [("fund_family", "fund_family", "varchar(50)")] + \
+        [(field, "pct_stocks" if field == "pct_stock" else field, "float") for field in allocation_fields]
+
+    # Standardization rules of the numeric profile fields, see standardization. Missing
+    # total assets are written as the sentinel profile_missing_value.
+    profile_conversions = {"total_assets": "millions"}
+    profile_missing_value = -1.0
+
+    risk_table = "gfnc_risk"
+    risk_schema = [("ticker", "ticker", "varchar(5)")] + \
+        [(field, field.lower(), "float") for field in risk_fields[1:]]
+
+    performance_table = "gfnc_performance"
+    performance_columns = ["r1d", "r1w", "r4w", "r3m", "rytd", "r1y", "r3y", "r5y"]
+    performance_schema = [("ticker", "ticker", "varchar(5)")] + \
+        [(interval, column, "float") for interval, column in zip(performance_intervals, performance_columns)]
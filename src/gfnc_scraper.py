@@ -3,7 +3,39 @@ import re
 from bs4 import BeautifulSoup
 from tidylib import tidy_document
 from abstract_scraper import AbstractScraper
+from extraction_spec import Field, LabeledValues, Spec, CompiledSpec
 from gfnc_key_mappings import GfncKeymappings
+from output_sinks import CsvSink
+import parser_backends
+import standardization
+
+
+def clean_cell(text):
+    """
+    Unavailable fields are presented as '-' in the html, convert them to empty strings
+    """
+    text = text.strip()
+    return "" if text == "-" else text
+
+
+def clean_percentage(text):
+    """
+    clean_cell, also removing the percent '%' symbol at the end
+    """
+    return clean_cell(text).replace("%", "")
+
+
+def performance_converter(interval, base_pattern_string):
+    """
+    @return: converter reading the return over interval from the text of the performance
+    subsector, or None if the page does not list it
+    """
+    pattern = re.compile("%s%s" % (interval, base_pattern_string))
+
+    def convert(text):
+        match = pattern.search(text.replace("\n", " ").encode('ascii', errors='ignore'))
+        return match.group(1) if match is not None else None
+    return convert
 
 
 class GfncScraper(AbstractScraper):
@@ -11,7 +43,109 @@ class GfncScraper(AbstractScraper):
     Class for scraping google finance fundpages.
     This class is a sibling of the YfncFundpageScraper
     """
-    def __init__(self, fundpages_location, tickerlist_file, delimiter="|"):
+    # Common pattern
+    # The common pattern (base_pattern) is constructed by inspecting the performance_info
+    # An example raw performance_info string looks like the following:
+    #
+    # '   1 day       -0.45%    1 week       -0.57%    4 week   +2.82%\
+    #         3 month   +6.31%          YTD   +2.34%        1 year   +19.87%\
+    #         3 years*   +10.82%        5 years*   +21.35%       *annualized  '
+    #
+    # The three and five year return labels have an * after them so we catch it as a
+    # first character. The rest of the pattern is self explanatory.
+    base_pattern_string = "[\*]{0,1}[ ]+([\+\-]{1}[\d]+\.[\d]+)%"
+
+    # Locations of the profile, risk and performance data in the DOM of a fund page,
+    # as parser_backends paths. They keep the lookups of the original scrapers: the
+    # profile searched all of the body for the gf-viewc div, while the risk and
+    # performance scrapers (soup.body.div(...)) only searched the first div of the body.
+    first_div_path = [
+        ("body", {}, 0),
+        ("div", {}, 0)
+    ]
+
+    mutualfund_steps = [
+        ("div", {"id": "gf-viewc"}, 0),
+        ("div", {"class": "fjfe-content"}, 0),
+        ("div", {"class": "mutualfund"}, 0),
+        ("div", {"class": "g-section g-tpl-right-1"}, 0)
+    ]
+
+    mutualfund_path = [("body", {}, 0)] + mutualfund_steps
+
+    # 'sector' divs of the left column. Sector 2 holds the management table, sector 3
+    # the asset allocation table.
+    sectors_path = mutualfund_path + [
+        ("div", {"class": "g-unit g-first"}, 0),
+        ("div", {"class": "g-c"}, 0)
+    ]
+
+    management_table_path = sectors_path + [
+        ("div", {"class": "sector"}, 2),
+        ("div", {"class": "subsector"}, 0),
+        ("table", {}, 0)
+    ]
+
+    allocation_rows_path = sectors_path + [
+        ("div", {"class": "sector"}, 3),
+        ("table", {}, 0),
+        ("tr", {}, None)
+    ]
+
+    # Rows 1-6 of the risk table hold the rows of GfncKeymappings.risk_field_rows, columns
+    # 1-4 the 1, 3, 5 and 10 year values
+    risk_table_path = first_div_path + mutualfund_steps + [
+        ("div", {"class": "g-unit"}, 1),
+        ("div", {"class": "g-c sfe-break-right"}, 0),
+        ("div", {"class": "sector"}, 1),
+        ("div", {"class": "subsector"}, 0),
+        ("table", {}, 0)
+    ]
+
+    performance_subsector_path = first_div_path + [
+        ("div", {"class": "subsector"}, 1)
+    ]
+
+    # Extraction specs of the three tables, compiled once per scraper and extracted in
+    # one walk over each page (see extraction_spec)
+    specs = [
+        Spec("performance", [
+            Field(interval, performance_subsector_path,
+                  convert=performance_converter(interval, base_pattern_string))
+            for interval in GfncKeymappings.performance_intervals
+        ]),
+        Spec("risk", [
+            Field(field, risk_table_path + [("tr", {}, 1 + row), ("td", {}, 1 + column)],
+                  convert=clean_cell, type="float")
+            for row, fields in enumerate(GfncKeymappings.risk_field_rows)
+            for column, field in enumerate(fields)
+        ]),
+        Spec("profile", [
+            # 'total_assets' ("120M", "1.2B", "1,234,567") is left as scraped; it is
+            # converted to millions column-wise by standardize_profiles. The '%' symbol
+            # is removed from 'front_load', 'deferred_load', 'expense_ratio' and
+            # 'management_fees'.
+            Field(field, management_table_path + [("tr", {}, row), ("td", {}, 1)],
+                  convert=clean_percentage if 1 <= row <= 4 else clean_cell)
+            for row, field in enumerate(GfncKeymappings.management_fields)
+        ] + [
+            # Allocations only list the asset categories in the fund. A fund with 'cash'
+            # and 'stocks' will not have 'bond' = '-', 'convertibles'='-' etc, so all
+            # allocation fields default to empty.
+            LabeledValues(allocation_rows_path,
+                          label=([("td", {}, None)], 0),
+                          values=[([("td", {}, None)], 1, "")],
+                          keymap=dict((field, label) for label, field
+                                      in GfncKeymappings.allocations_keymap.items()),
+                          stride=3,
+                          normalize_label=lambda label: label.strip(),
+                          convert=lambda value: value.strip().replace("%", ""),
+                          defaults=GfncKeymappings.allocation_fields)
+        ])
+    ]
+
+    def __init__(self, fundpages_location, tickerlist_file, delimiter="|", nworkers=1,
+                 manifest_file=None, parser="bs4", metrics_file=None):
         """
         Constructs Google finance page scraper object by calling __init__ of AbstractScraper
         @param fundpages_location: Location of downloaded html fund pages (string)
@@ -20,251 +154,190 @@ class GfncScraper(AbstractScraper):
         @type tickerlist_file: str
         @param delimiter: delimiter in tickerlist_file
         @type delimiter: str
+        @param nworkers: number of worker processes used for scraping
+        @type nworkers: int
+        @param manifest_file: scrape manifest for incremental runs
+        @type manifest_file: str
+        @param parser: parser backend, "bs4" (BeautifulSoup over tidied pages) or "lxml"
+        @type parser: str
+        @param metrics_file: prefix of the JSON/Prometheus metrics files
+        @type metrics_file: str
         """
-        super(GfncScraper, self).__init__(fundpages_location, tickerlist_file, delimiter="|")
+        super(GfncScraper, self).__init__(fundpages_location, tickerlist_file, delimiter="|",
+                                          nworkers=nworkers, manifest_file=manifest_file,
+                                          metrics_file=metrics_file)
+        self.backend = parser_backends.create(parser, tidy=True, metrics=self.metrics)
+        self.extractor = CompiledSpec(GfncScraper.specs, self.backend, self.metrics)
 
-    def scrape(self, outputfile=None):
+    def scrape(self, outputfile=None, sink=None):
         """
-        Delegator function for google finance scraper
+        Delegator function for google finance scraper. Each fund page is read and
+        parsed once, and the same tree is handed to the performance, risk and profile
+        extractors. Writes <outputfile>_performance, <outputfile>_risk and
+        <outputfile>_profile CSV files, or the gfnc_performance, gfnc_risk and gfnc_profiles
+        tables of sink.
         @param outputfile: name of output CSV file where info is to be written
         @type outputfile: str
+        @param sink: output sink to write to instead of CSV files
+        @type sink: output_sinks.OutputSink
         """
-
-        # @TODO: Delegation after creating the soup
-        # Soup creation is an expensive step and it may make more sense to
-        # delegate after generating the soup of the downloaded page.
-
-        # ------------------------------------
-        # Get performance
-        # ------------------------------------
-        outputfile_performance = super(GfncScraper, self).insert_suffix(outputfile, "_performance")
-        print "writing to file %s" % outputfile_performance
-        self.get_performance(outputfile=outputfile)
-
-        # ------------------------------------
-        # Get risk
-        # ------------------------------------
-        outputfile_risk = super(GfncScraper, self).insert_suffix(outputfile, "_risk")
-        print "writing to file %s" % outputfile_risk
-        self.get_risk(outputfile=outputfile_risk)
-
-        # ------------------------------------
-        # Get profile
-        # ------------------------------------
-        outputfile_profile = super(GfncScraper, self).insert_suffix(outputfile, "_profile")
-        print "writing profile data to file %s" % outputfile_profile
-        self.get_profile(outputfile=outputfile_profile)
-
-    def get_profile(self, outputfile=None):
-
+        if sink is None:
+            sink = CsvSink(filenames={
+                GfncKeymappings.performance_table: self.insert_suffix(outputfile, "_performance"),
+                GfncKeymappings.risk_table: self.insert_suffix(outputfile, "_risk"),
+                GfncKeymappings.profile_table: self.insert_suffix(outputfile, "_profile")
+            })
+
+        print "writing to %s" % sink
+        performance_writer = sink.open_table(GfncKeymappings.performance_table,
+                                             GfncKeymappings.performance_schema, self.metrics)
+        risk_writer = sink.open_table(GfncKeymappings.risk_table,
+                                      GfncKeymappings.risk_schema, self.metrics)
+        profile_writer = sink.open_table(GfncKeymappings.profile_table,
+                                         GfncKeymappings.profile_schema, self.metrics)
+        try:
+            for batch in standardization.chunks(self.map_tickers("scrape_ticker")):
+                profiles = GfncScraper.standardize_profiles([profile for ticker, (_, _, profile) in batch])
+                for (ticker, (performance, risk, _)), profile in zip(batch, profiles):
+                    performance_writer.writerow(performance)
+                    risk_writer.writerow(risk)
+                    profile_writer.writerow(profile)
+        finally:
+            performance_writer.close()
+            risk_writer.close()
+            profile_writer.close()
+
+    def page_path(self, ticker):
         """
-        Scraper to get profile (net assets, exp ratio) data
+        @param ticker: Ticker symbol
+        @type ticker: str
+        @return: location of the downloaded fund page for ticker
         """
-        management_fields = ["total_assets", "front_load", "deferred_load", "expense_ratio", "management_fees", "fund_family"]
-        allocation_fields = ["pct_cash", "pct_stock", "pct_bonds", "pct_preferred", "pct_convertible", "pct_other"]
-
-        ticker_count = len(self.tickers)
-        profile_list = []
-        for ticker_no, ticker in enumerate(self.tickers):
-            page = os.path.join(self.fundpages_location, "%s.html" % ticker)
-            newpage, errors = tidy_document(open(page).read())
-            soup = BeautifulSoup(newpage)
-
-            # Initialize a dict to hold risk data of this ticker. The data will be added
-            # at the ned of the try block
-            profile_dict = {"ticker": ticker}
-
-            try:
-                profile_data_tables = \
-                    soup\
-                    .body\
-                    .findAll('div', id='gf-viewc')[0]\
-                    .findAll('div', class_='fjfe-content')[0]\
-                    .findAll('div', class_='mutualfund')[0]\
-                    .findAll('div', class_='g-section g-tpl-right-1')[0]\
-                    .findAll('div', class_='g-unit g-first')[0]\
-                    .findAll('div', class_='g-c')[0]\
-                    .findAll('div', class_='sector')
-
-                # Extract and clean profile fields
-                management_table = profile_data_tables[2]\
-                    .findAll('div', class_='subsector')[0]\
-                    .table
-
-                management_data_raw = [[col.text.strip() for col in row.findAll('td')]
-                                       for row in management_table.findAll('tr')]
-
-                management_data_clean = map(lambda x: '' if x == '-' else x,
-                                            [P[1] for P in management_data_raw])
-
-                # Clean up 'total_assets' fields by removing millions and billions suffix
-                total_assets = management_data_clean[0]
-                if total_assets.endswith("M"):
-                    total_assets = float(total_assets.replace("M", ""))
-                elif total_assets.endswith("B"):
-                    total_assets = 1000.0 * float(total_assets.replace("B", ""))
-                elif total_assets == "":
-                    total_assets = -1.0  # Sentinel value to indicate missing total_asset information
-                else:
-                    total_assets = float(total_assets.replace(",", "")) / 1000000.0  # Total assets in dollars, convert to Millions
-                management_data_clean[0] = total_assets
-
-                # Clean up 'front_load', 'deferred_load' and 'expense_ratio' fields
-                # by removing the percent '%' symbol at the end and converting to float
-                management_data_clean[1:4] = map(lambda x: x.replace("%", "") if x != "" else x,
-                                                 management_data_clean[1:4])
-
-                # Add management data to current fund profile
-                profile_dict.update(dict(zip(management_fields, management_data_clean)))
-
-                # Extract and clean asset allocation data
-                # allocation_table = soup.body.findAll('div', class_='sector')[3].table
-                allocation_table = profile_data_tables[3].table
-                allocation_data_raw = [[col.text.strip() for col in row.findAll('td')]
-                                       for row in allocation_table.findAll('tr')]
-
-                # Allocations only list the asset categories in the fund. A fund with 'cash'
-                # and 'stocks' will not have 'bond' = '-', 'convertibles'='-' etc.
-                # We therefore need to make sure that the output dictionary contains all the
-                # fields even if they are empty. We initialize an empty dictionary and fill it
-                # with values of existing asset categories for the current fund.
-                allocations_dict = dict.fromkeys(allocation_fields, "")
-                for asset_class, allocation_pct, _ in allocation_data_raw:
-                    allocations_dict[GfncKeymappings.allocations_keymap[asset_class]] = allocation_pct.replace("%", "")
-
-                # Add asset allocation data to profile data
-                profile_dict.update(allocations_dict)
-            except IndexError, E:
-                print "[IndexError: %s] could not parse %s" % (E.message, page)
-            except KeyError, K:
-                # print "[KeyError: %s] could not parse %s" % (K.message, page)
-                pass
-            # Append current fund profile to profiles_list
-            profile_list.append(profile_dict)
-
-            # publish progress
-            if ticker_no % 100 == 0:
-                print "%d of %d" % (ticker_no, ticker_count)
+        return os.path.join(self.fundpages_location, "%s.html" % ticker)
 
-        # Aggregate profile fields
-        profile_fields_all = ["ticker"] + management_fields + allocation_fields
-        super(GfncScraper, self).writecsv(profile_fields_all, profile_list, outputfile)
-
-    def get_risk(self, outputfile=None):
+    def load_page(self, ticker):
         """
-        Scraper function to get risk data
+        Reads and parses the fund page for ticker with the scraper's parser backend. This
+        is the expensive step of scraping, so callers extracting several tables should call
+        it once per page.
+        @param ticker: Ticker symbol
+        @type ticker: str
+        @return: parsed page, as produced by self.backend
         """
-        risk_fields = [["alpha1", "alpha3", "alpha5", "alpha10"],
-                       ["beta1", "beta3", "beta5", "beta10"],
-                       ["MAR1", "MAR3", "MAR5", "MAR10"],
-                       ["R2_1", "R2_3", "R2_5", "R2_10"],
-                       ["SD1", "SD3", "SD5", "SD10"],
-                       ["sharpe1", "sharpe3", "sharpe5", "sharpe10"]]
-
-        ticker_count = len(self.tickers)
-        risk_list = []
-        for ticker_no, ticker in enumerate(self.tickers):
-            page = os.path.join(self.fundpages_location, "%s.html" % ticker)
-            newpage, errors = tidy_document(open(page).read())
-            soup = BeautifulSoup(newpage)
-
-            # Initialize a dict to hold risk data of this ticker. The data will be added
-            # at the ned of the try block
-            riskdata_dict = {"ticker": ticker}
-
-            try:
-                # Retrieve the risk table by descending into the DOM
-                risktable = \
-                    soup\
-                    .body\
-                    .div(id="gf-viewc")[0]\
-                    .findAll("div", class_="fjfe-content")[0]\
-                    .findAll("div", class_="mutualfund")[0]\
-                    .findAll("div", class_="g-section g-tpl-right-1")[0]\
-                    .findAll("div", class_="g-unit")[1]\
-                    .findAll("div", class_="g-c sfe-break-right")[0]\
-                    .findAll("div", class_="sector")[1]\
-                    .findAll("div", class_="subsector")[0].table
-
-                riskdata_raw = [
-                    [col.text.strip() for col in row.findAll("td")]
-                    for row in risktable.findAll("tr")
-                ]
-
-                # Convert available fields to float. Unavailable fields are presented as '-'
-                # in the html, convert them to empty strings.
-                riskdata_float = [map(lambda x: float(x) if x != "-" else "", R[1:])
-                                  for R in riskdata_raw[1:-1]]
-
-                # Add the risk data for this ticker to riskdata_dict
-                for field_type, field_data in zip(risk_fields, riskdata_float):
-                    riskdata_dict.update(dict(zip(field_type, field_data)))
-            except (IndexError, AttributeError):
-                pass
-                # print "page could not be scraped for ticker %s" % ticker
-
-            # Append risk data for the current ticker to the list
-            risk_list.append(riskdata_dict)
+        return self.backend.parse(self.read_page(ticker))
 
-            # Print progress
-            if ticker_no % 100 == 0:
-                print "%d of %d" % (ticker_no, ticker_count)
+    def scrape_ticker(self, ticker):
+        """
+        Per-ticker extractor for scrape(). Parses the page once and extracts all three
+        tables in one walk over it.
+        @param ticker: Ticker symbol
+        @type ticker: str
+        @return: tuple of (performance, risk, profile) dicts
+        """
+        return self.timed_extract("all", self.extract_page, ticker, self.load_page(ticker))
 
-        # Flatten the risk_fields to feed to the CSV writer and add field
-        # "ticker" at the front
-        risk_fields_flattened = ["ticker"] + reduce(lambda x, y: x + y, risk_fields)
+    def extract_page(self, ticker, tree):
+        """
+        @param ticker: Ticker symbol
+        @type ticker: str
+        @param tree: parsed fund page, as returned by load_page
+        @return: tuple of (performance, risk, profile) dicts for ticker
+        """
+        return tuple(self.extract_tables(["performance", "risk", "profile"], ticker, tree))
 
-        # Write the CSV file
-        super(GfncScraper, self).writecsv(risk_fields_flattened, risk_list, outputfile)
+    def scrape_profile(self, ticker):
+        """
+        Per-ticker extractor for get_profile()
+        """
+        return self.timed_extract("profile", self.extract_profile, ticker, self.load_page(ticker))
 
-    def get_performance(self, outputfile=None):
+    def scrape_risk(self, ticker):
         """
-        Scraper function to get performance data
+        Per-ticker extractor for get_risk()
         """
-        # Strings for intervals for which return information is vailable in Google Finance
-        performance_fields = ["1 day", "1 week", "4 week", "3 month", "YTD",
-                              "1 year", "3 years", "5 years"]
+        return self.timed_extract("risk", self.extract_risk, ticker, self.load_page(ticker))
 
-        # Common pattern
-        # The common pattern (base_pattern) is constructed by inspecting the performance_info
-        # An example raw performance_info string looks like the following:
-        #
-        # '   1 day       -0.45%    1 week       -0.57%    4 week   +2.82%\
-        #         3 month   +6.31%          YTD   +2.34%        1 year   +19.87%\
-        #         3 years*   +10.82%        5 years*   +21.35%       *annualized  '
-        #
-        # The three and five year return labels have an * after them so we catch it as a
-        # first character. The rest of the pattern is self explanatory.
-        base_pattern_string = "[\*]{0,1}[ ]+([\+\-]{1}[\d]+\.[\d]+)%"
+    def scrape_performance(self, ticker):
+        """
+        Per-ticker extractor for get_performance()
+        """
+        return self.timed_extract("performance", self.extract_performance, ticker, self.load_page(ticker))
 
-        # Regex patterns for extracting returns for these intervals
-        intvl_patterns = [re.compile("%s%s" % (durn, base_pattern_string)) for durn in performance_fields]
+    def get_profile(self, outputfile=None, sink=None):
+        """
+        Scraper to get profile (net assets, exp ratio) data. Writes outputfile, or the
+        gfnc_profiles table of sink.
+        """
+        profiles = (profile for ticker, profile in self.map_tickers("scrape_profile"))
+        if sink is None:
+            sink = CsvSink(filenames={GfncKeymappings.profile_table: outputfile})
+        self.write_table(sink, GfncKeymappings.profile_table, GfncKeymappings.profile_schema,
+                         (profile for batch in standardization.chunks(profiles)
+                          for profile in GfncScraper.standardize_profiles(batch)))
+
+    @staticmethod
+    def standardize_profiles(profiles):
+        """
+        Converts total_assets of a batch of profile rows to millions of dollars, column-wise
+        (see standardization). Missing total assets become -1.0.
+        @param profiles: profile rows as produced by extract_profile
+        @type profiles: list (of dicts)
+        @rtype: list (of dicts)
+        """
+        return standardization.standardize_rows(profiles, GfncKeymappings.profile_conversions,
+                                                missing=GfncKeymappings.profile_missing_value)
 
-        # Create tuples of duration strings and their corresponding regexes
-        dur_patterns = zip(performance_fields, intvl_patterns)
+    def extract_profile(self, ticker, tree):
+        """
+        Extracts profile (net assets, exp ratio, allocations) data from a parsed fund page
+        @param ticker: Ticker symbol
+        @type ticker: str
+        @param tree: parsed fund page, as returned by load_page
+        @return: dict of profile fields for ticker
+        """
+        return self.extract_tables(["profile"], ticker, tree)[0]
 
-        ticker_count = len(self.tickers)
-        performance_list = []
-        for ticker_no, ticker in enumerate(self.tickers):
-            page = os.path.join(self.fundpages_location, "%s.html" % ticker)
-            with open(page) as fpage:
-                soup = BeautifulSoup(fpage)
-                try:
-                    performance_info = soup.body.div(class_="subsector")[1].text.replace("\n", " ").encode('ascii', errors='ignore')
-                    fund_data = {dur: re.search(pat, performance_info).group(1)
-                                 for dur, pat in dur_patterns
-                                 if re.search(pat, performance_info) is not None}
-                except IndexError:
-                    fund_data = {}
-            fund_data.update({"ticker": ticker})
-            performance_list.append(fund_data)
+    def get_risk(self, outputfile=None, sink=None):
+        """
+        Scraper function to get risk data. Writes outputfile, or the gfnc_risk table of sink.
+        """
+        risks = (risk for ticker, risk in self.map_tickers("scrape_risk"))
+        if sink is None:
+            sink = CsvSink(filenames={GfncKeymappings.risk_table: outputfile})
+        self.write_table(sink, GfncKeymappings.risk_table, GfncKeymappings.risk_schema, risks)
 
-            # Print progress
-            if ticker_no % 100 == 0:
-                print "%d of %d" % (ticker_no, ticker_count)
+    def extract_risk(self, ticker, tree):
+        """
+        Extracts risk data (alpha, beta, sharpe etc) from a parsed fund page
+        @param ticker: Ticker symbol
+        @type ticker: str
+        @param tree: parsed fund page, as returned by load_page
+        @return: dict of risk fields for ticker
+        """
+        return self.extract_tables(["risk"], ticker, tree)[0]
 
-        # write performance data to a CSV file
-        super(GfncScraper, self).writecsv(["ticker"] + performance_fields, performance_list, outputfile)
+    def get_performance(self, outputfile=None, sink=None):
+        """
+        Scraper function to get performance data. Writes outputfile, or the gfnc_performance
+        table of sink.
+        """
+        performances = (performance for ticker, performance
+                        in self.map_tickers("scrape_performance"))
+        if sink is None:
+            sink = CsvSink(filenames={GfncKeymappings.performance_table: outputfile})
+        self.write_table(sink, GfncKeymappings.performance_table, GfncKeymappings.performance_schema,
+                         performances)
+
+    def extract_performance(self, ticker, tree):
+        """
+        Extracts returns over the intervals in GfncKeymappings.performance_intervals
+        from a parsed fund page
+        @param ticker: Ticker symbol
+        @type ticker: str
+        @param tree: parsed fund page, as returned by load_page
+        @return: dict of performance fields for ticker
+        """
+        return self.extract_tables(["performance"], ticker, tree)[0]
 
     def get_performance2(self, outputfile=None):
         """
@@ -280,8 +353,7 @@ class GfncScraper(AbstractScraper):
         ticker_count = len(self.tickers)
         fund_performances = []
         for ticker_no, ticker in enumerate(self.tickers[:10]):
-            page = os.path.join(self.fundpages_location, "%s.html" % ticker)
-            tidy_html, errors = tidy_document(open(page).read())
+            tidy_html, errors = tidy_document(self.store.get(ticker))
             soup = BeautifulSoup(tidy_html)
             try:
                 performance_tags\
@@ -0,0 +1,133 @@
+import collections
+import time
+import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import Metrics
+
+
+# Outcome of HttpClient.download.
+# status: HTTP status code of the response
+# nbytes: uncompressed size of the saved page
+# not_modified: True if the server answered 304 and the saved page was left untouched
+# blocked: True if the response was rejected by the validator (e.g. a CAPTCHA page) and
+#          was not saved
+FetchResult = collections.namedtuple("FetchResult", ["status", "nbytes", "not_modified", "blocked"])
+
+
+class HttpClient(object):
+    """
+    Shared HTTP client for the downloaders. Wraps a requests.Session so connections are
+    kept alive and reused, negotiates gzip transfer, streams response bodies into a page
+    store and issues conditional GETs using the ETag/Last-Modified metadata saved with
+    each page.
+    """
+    # Size of the chunks in which response bodies are streamed to the page store
+    chunk_size = 64 * 1024
+
+    # Number of leading bytes of every response handed to the validator
+    sniff_size = 64 * 1024
+
+    def __init__(self, pool_size=10, timeout=60, metrics=None):
+        """
+        @param pool_size: number of keep-alive connections kept per host. Should be at least
+        the number of threads sharing this client.
+        @type pool_size: int
+        @param timeout: connect/read timeout in seconds
+        @type timeout: float
+        @param metrics: registry receiving request latency, response status and byte counts
+        @type metrics: metrics.Metrics
+        """
+        self.timeout = timeout
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Accept-Encoding": "gzip, deflate"})
+
+    def download(self, url, store, key, validate=None):
+        """
+        Downloads url into the page store under key. If a previous download of url is
+        saved under key, the request is made conditional on its ETag/Last-Modified values
+        and a 304 answer leaves the saved page untouched. Only 200 responses are saved; any
+        other status leaves the saved page and its metadata as they were.
+        @param url: page url
+        @type url: str
+        @param store: page store to write the page to
+        @type store: PageStore
+        @param key: key of the page in store
+        @type key: str
+        @param validate: function(status, head) returning False for responses that must not
+        be saved, e.g. CAPTCHA pages. head holds the first sniff_size bytes of the body.
+        @type validate: function
+        @rtype: FetchResult
+        """
+        meta = store.read_meta(key)
+        headers = {}
+        if meta.get("url") == url:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        host = urlparse.urlparse(url).netloc
+        start = time.time()
+        response = self.session.get(url, headers=headers, stream=True, timeout=self.timeout)
+        self.metrics.incr("http_responses_total", host=host, status=response.status_code)
+        try:
+            if response.status_code == 304:
+                return FetchResult(304, store.size(key), True, False)
+
+            # Validate the head of the body as it streams in, before anything is committed
+            head = ""
+            writer = store.open_writer(key)
+            try:
+                for chunk in response.iter_content(HttpClient.chunk_size):
+                    if len(head) < HttpClient.sniff_size:
+                        head += chunk[:HttpClient.sniff_size - len(head)]
+                    writer.write(chunk)
+            except:
+                writer.abort()
+                raise
+        finally:
+            response.close()
+            self.metrics.observe("http_request_seconds", time.time() - start, host=host)
+
+        if validate is not None and not validate(response.status_code, head):
+            writer.abort()
+            return FetchResult(response.status_code, len(head), False, True)
+
+        # Only good pages are saved; an error page must not replace the saved page or the
+        # validators it was fetched with
+        if response.status_code != 200:
+            writer.abort()
+            return FetchResult(response.status_code, 0, False, False)
+        nbytes = writer.commit({"url": url,
+                                "etag": response.headers.get("ETag"),
+                                "last_modified": response.headers.get("Last-Modified")})
+        self.metrics.incr("download_bytes_total", nbytes, host=host)
+
+        return FetchResult(response.status_code, nbytes, False, False)
+
+    def get(self, url):
+        """
+        Downloads url into memory, for callers that process pages without saving them
+        first. No conditional request is made, as there is no saved page to compare with.
+        @param url: page url
+        @type url: str
+        @return: (FetchResult, body); the FetchResult is never blocked, validation is left
+        to the caller
+        @rtype: tuple
+        """
+        host = urlparse.urlparse(url).netloc
+        start = time.time()
+        response = self.session.get(url, stream=True, timeout=self.timeout)
+        self.metrics.incr("http_responses_total", host=host, status=response.status_code)
+        try:
+            body = "".join(response.iter_content(HttpClient.chunk_size))
+        finally:
+            response.close()
+            self.metrics.observe("http_request_seconds", time.time() - start, host=host)
+        self.metrics.incr("download_bytes_total", len(body), host=host)
+        return FetchResult(response.status_code, len(body), False, False), body
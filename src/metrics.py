@@ -0,0 +1,191 @@
+import contextlib
+import json
+import sys
+import threading
+import time
+
+
+class Metrics(object):
+    """
+    Thread safe registry of counters and timers for the downloaders and scrapers.
+
+    Every metric is identified by a name and optional labels, e.g.
+        metrics.incr("captcha_hits_total", host="www.google.com")
+        with metrics.timer("scrape_parse_seconds"):
+            tree = backend.parse(html)
+
+    A timer keeps the number of observations, their sum and their maximum. Metrics of
+    scraper worker processes are collected with drain() and merged into the parent's
+    registry with merge(). The registry exports to a JSON summary (write_json) and to the
+    Prometheus text format (write_prometheus).
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.timers = {}
+
+    def __getstate__(self):
+        # Locks cannot be pickled; a registry shipped to a worker process gets a new one
+        return {"counters": self.counters, "timers": self.timers}
+
+    def __setstate__(self, state):
+        self.lock = threading.Lock()
+        self.counters = state["counters"]
+        self.timers = state["timers"]
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def incr(self, name, value=1, **labels):
+        """
+        Adds value to the counter name{labels}
+        """
+        key = Metrics._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        """
+        Records one observation of the timer name{labels}
+        """
+        key = Metrics._key(name, labels)
+        with self.lock:
+            count, total, longest = self.timers.get(key, (0, 0.0, 0.0))
+            self.timers[key] = (count + 1, total + seconds, max(longest, seconds))
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """
+        Times the enclosed block as one observation of name{labels}
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start, **labels)
+
+    def snapshot(self):
+        """
+        @return: picklable copy of all metrics, as a dict {"counters": .., "timers": ..}
+        """
+        with self.lock:
+            return {"counters": dict(self.counters), "timers": dict(self.timers)}
+
+    def drain(self):
+        """
+        Returns a snapshot and resets the registry, so consecutive snapshots never
+        overlap. Used by worker processes to hand their metrics to the parent.
+        """
+        with self.lock:
+            snapshot = {"counters": self.counters, "timers": self.timers}
+            self.counters = {}
+            self.timers = {}
+        return snapshot
+
+    def merge(self, snapshot):
+        """
+        Adds the metrics of a snapshot (e.g. from a worker process) to this registry
+        """
+        with self.lock:
+            for key, value in snapshot["counters"].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, (count, total, longest) in snapshot["timers"].items():
+                old_count, old_total, old_longest = self.timers.get(key, (0, 0.0, 0.0))
+                self.timers[key] = (old_count + count, old_total + total, max(old_longest, longest))
+
+    @staticmethod
+    def _series(name, labels):
+        if not labels:
+            return name
+        return "%s{%s}" % (name, ",".join('%s="%s"' % (label, str(value).replace('"', '\\"'))
+                                           for label, value in labels))
+
+    def summary(self):
+        """
+        @return: dict with the counters and, per timer, its count, total, mean and max seconds
+        """
+        snapshot = self.snapshot()
+        counters = dict((Metrics._series(name, labels), value)
+                        for (name, labels), value in snapshot["counters"].items())
+        timers = {}
+        for (name, labels), (count, total, longest) in snapshot["timers"].items():
+            timers[Metrics._series(name, labels)] = {"count": count,
+                                                     "total": round(total, 6),
+                                                     "mean": round(total / count, 6),
+                                                     "max": round(longest, 6)}
+        return {"counters": counters, "timers": timers}
+
+    def write_json(self, filename):
+        with open(filename, "wb") as f:
+            json.dump(self.summary(), f, indent=2, sort_keys=True)
+
+    def write_prometheus(self, filename):
+        """
+        Writes the metrics in the Prometheus text exposition format. Counters are exported
+        as is, timers as summaries (<name>_count and <name>_sum) plus a <name>_max gauge.
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for name in sorted(set(name for name, labels in snapshot["counters"])):
+            lines.append("# TYPE %s counter" % name)
+            for (series_name, labels), value in sorted(snapshot["counters"].items()):
+                if series_name == name:
+                    lines.append("%s %r" % (Metrics._series(name, labels), value))
+        for name in sorted(set(name for name, labels in snapshot["timers"])):
+            timers = sorted((labels, value) for (series_name, labels), value
+                            in snapshot["timers"].items() if series_name == name)
+            lines.append("# TYPE %s summary" % name)
+            for labels, (count, total, longest) in timers:
+                lines.append("%s %d" % (Metrics._series(name + "_count", labels), count))
+                lines.append("%s %r" % (Metrics._series(name + "_sum", labels), total))
+            lines.append("# TYPE %s_max gauge" % name)
+            for labels, (count, total, longest) in timers:
+                lines.append("%s %r" % (Metrics._series(name + "_max", labels), longest))
+        with open(filename, "wb") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def export(self, location):
+        """
+        Writes <location>.json and <location>.prom
+        """
+        self.write_json(location + ".json")
+        self.write_prometheus(location + ".prom")
+
+
+class ProgressReporter(object):
+    """
+    Prints "<label>: <done> of <total>" with the current rate at most once every
+    'interval' seconds, and once more when the last item is done. Replaces printing a
+    line for every item in hot loops.
+    """
+    def __init__(self, total, label="progress", interval=10.0, stream=None):
+        """
+        @param total: number of items to be processed
+        @type total: int
+        @param label: prefix of the progress lines
+        @type label: str
+        @param interval: minimum number of seconds between two progress lines
+        @type interval: float
+        """
+        self.total = total
+        self.label = label
+        self.interval = interval
+        self.stream = stream
+        self.done = 0
+        self.start = time.time()
+        self.last_report = None
+        self.lock = threading.Lock()
+
+    def update(self, n=1):
+        with self.lock:
+            self.done += n
+            now = time.time()
+            if self.done < self.total and self.last_report is not None \
+                    and now - self.last_report < self.interval:
+                return
+            self.last_report = now
+            elapsed = now - self.start
+            rate = self.done / elapsed if elapsed > 0 else 0.0
+            stream = self.stream if self.stream is not None else sys.stdout
+            stream.write("%s: %d of %d (%.1f/s)\n" % (self.label, self.done, self.total, rate))
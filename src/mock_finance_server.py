@@ -0,0 +1,228 @@
+import BaseHTTPServer
+import SocketServer
+import argparse
+import collections
+import hashlib
+import random
+import string
+import threading
+import time
+import urlparse
+from synthetic_corpus import SyntheticCorpus
+
+
+class MockFinanceServer(object):
+    """
+    Local stand-in for Google finance, Yahoo finance and marketwatch, so the downloaders can
+    be exercised offline. Pages of a SyntheticCorpus are served at the paths and query
+    strings of the real sites:
+        /finance?q=MUTF%3A<ticker>              Google finance (FundpageDownloader.gfnc_baseurl)
+        /q/pr?s=<ticker>, /q/pm?s=<ticker>,     Yahoo finance profile, performance and risk
+        /q/rk?s=<ticker>                        (FundpageDownloader.yfnc_baseurl_*)
+        /tools/mutual-fund/list/<letter>        marketwatch fund lists (TickerGenerator)
+    Unknown tickers and paths get a 404. Pages carry an ETag and conditional requests for
+    an unchanged page get a 304, like the real sites.
+
+    The misbehaviour of the real sites can be injected:
+        latency          every response is delayed by latency seconds on average
+        captcha_rate     fraction of page requests answered with a CAPTCHA page
+        error_rate       fraction of page requests answered with a 500
+        rate_limit       requests per second served over any one-second window; requests
+                         beyond it get a 429, or a CAPTCHA page with throttle="captcha"
+
+    Every response is counted by kind in self.stats.
+
+    >>> server = MockFinanceServer(SyntheticCorpus(nfunds=5, captcha_rate=0))
+    >>> server.respond("/finance?q=MUTF%%3A%s" % server.corpus.tickers[0], {})[0]
+    200
+    >>> server.respond("/q/rk?s=NOSUCH", {})[0]
+    404
+    """
+    def __init__(self, corpus, latency=0.0, captcha_rate=0.0, error_rate=0.0, rate_limit=None,
+                 throttle="429", seed=0):
+        """
+        @param corpus: funds to serve. Generate it with captcha_rate=0: CAPTCHA pages
+        baked into the corpus are served on every request, injected ones only sometimes.
+        @type corpus: SyntheticCorpus
+        @param latency: average delay of a response in seconds
+        @type latency: float
+        @param captcha_rate: fraction of page requests answered with a CAPTCHA page
+        @type captcha_rate: float
+        @param error_rate: fraction of page requests answered with a 500 error
+        @type error_rate: float
+        @param rate_limit: requests per second served, None for no limit
+        @type rate_limit: float
+        @param throttle: answer to requests over the rate limit: "429" or "captcha"
+        @type throttle: str
+        @param seed: random seed of the injected latency and failures
+        @type seed: int
+        """
+        self.corpus = corpus
+        self.latency = latency
+        self.captcha_rate = captcha_rate
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.throttle = throttle
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = collections.deque()
+        self.stats = collections.Counter()
+
+        # Pages are rendered in the order SyntheticCorpus.write_gfnc/write_yfnc render them,
+        # so the same corpus parameters serve the same pages the corpus writes to disk
+        self.pages = {}
+        for ticker in corpus.tickers:
+            self.pages[("gfnc", ticker)] = corpus.gfnc_page(ticker)
+        for ticker in corpus.tickers:
+            self.pages[("pr", ticker)] = corpus.yfnc_profile_page(ticker)
+            self.pages[("pm", ticker)] = corpus.yfnc_performance_page(ticker)
+            self.pages[("rk", ticker)] = corpus.yfnc_risk_page(ticker)
+        for letter in string.ascii_uppercase:
+            self.pages[("list", letter)] = corpus.marketwatch_page(letter)
+        self.httpd = None
+        self.thread = None
+
+    @staticmethod
+    def page_key(path):
+        """
+        @param path: path and query string of a request
+        @type path: str
+        @return: key of the requested page in self.pages, None if the url has no page
+        @rtype: tuple
+        """
+        url = urlparse.urlsplit(path)
+        query = urlparse.parse_qs(url.query)
+        if url.path == "/finance" and query.get("q", [""])[0].startswith("MUTF:"):
+            return "gfnc", query["q"][0][len("MUTF:"):]
+        if url.path in ("/q/pr", "/q/pm", "/q/rk") and "s" in query:
+            return url.path[len("/q/"):], query["s"][0]
+        if url.path.startswith("/tools/mutual-fund/list/"):
+            return "list", url.path[len("/tools/mutual-fund/list/"):]
+        return None
+
+    def over_rate_limit(self):
+        if self.rate_limit is None:
+            return False
+        now = time.time()
+        with self.lock:
+            # Only the requests served count towards the limit
+            while self.requests and self.requests[0] <= now - 1.0:
+                self.requests.popleft()
+            if len(self.requests) >= self.rate_limit:
+                return True
+            self.requests.append(now)
+            return False
+
+    def respond(self, path, headers):
+        """
+        Decides the response to a request, injecting the configured failures
+        @param path: path and query string of the request
+        @type path: str
+        @param headers: request headers
+        @type headers: dict
+        @return: (status, headers, body)
+        @rtype: tuple
+        """
+        key = MockFinanceServer.page_key(path)
+        with self.lock:
+            draw = self.random.random()
+        if self.over_rate_limit():
+            kind = "throttled"
+            if self.throttle == "captcha":
+                response = 200, {}, SyntheticCorpus.captcha_page
+            else:
+                response = 429, {"Retry-After": "1"}, "Too Many Requests\n"
+        elif key not in self.pages:
+            kind = "not_found"
+            response = 404, {}, "Not Found\n"
+        elif draw < self.captcha_rate:
+            kind = "captcha"
+            response = 200, {}, SyntheticCorpus.captcha_page
+        elif draw < self.captcha_rate + self.error_rate:
+            kind = "error"
+            response = 500, {}, "Internal Server Error\n"
+        else:
+            page = self.pages[key]
+            etag = '"%s"' % hashlib.md5(page).hexdigest()[:16]
+            if headers.get("If-None-Match") == etag:
+                kind = "not_modified"
+                response = 304, {"ETag": etag}, ""
+            else:
+                kind = "page"
+                response = 200, {"ETag": etag, "Content-Type": "text/html; charset=utf-8"}, page
+        with self.lock:
+            self.stats[kind] += 1
+        return response
+
+    def start(self, host="localhost", port=0):
+        """
+        Serves in a background thread
+        @param port: port to listen on, 0 for any free port
+        @type port: int
+        @return: base url of the server, e.g. http://localhost:41234
+        @rtype: str
+        """
+        self.httpd = ThreadingHTTPServer((host, port), MockFinanceHandler)
+        self.httpd.mock = self
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return "http://%s:%d" % (host, self.httpd.server_address[1])
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class MockFinanceHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Keep-alive, so the connection pool of HttpClient is exercised as with the real sites
+    protocol_version = "HTTP/1.1"
+    # Idle keep-alive connections are closed after this many seconds
+    timeout = 10
+
+    def do_GET(self):
+        mock = self.server.mock
+        status, headers, body = mock.respond(self.path, self.headers)
+        if mock.latency > 0:
+            time.sleep(mock.random.uniform(0.5, 1.5) * mock.latency)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Serve synthetic fund pages at the URLs of the finance sites")
+    argparser.add_argument("--port", type=int, default=8000)
+    argparser.add_argument("--funds", type=int, default=1000, help="number of synthetic funds")
+    argparser.add_argument("--seed", type=int, default=0)
+    argparser.add_argument("--latency", type=float, default=0.0, help="average response delay in seconds")
+    argparser.add_argument("--captcha-rate", type=float, default=0.0)
+    argparser.add_argument("--error-rate", type=float, default=0.0)
+    argparser.add_argument("--rate-limit", type=float, help="requests per second served")
+    argparser.add_argument("--throttle", choices=["429", "captcha"], default="429",
+                           help="answer to requests over the rate limit")
+    args = argparser.parse_args()
+
+    server = MockFinanceServer(SyntheticCorpus(nfunds=args.funds, seed=args.seed, captcha_rate=0),
+                               latency=args.latency, captcha_rate=args.captcha_rate,
+                               error_rate=args.error_rate, rate_limit=args.rate_limit,
+                               throttle=args.throttle, seed=args.seed)
+    print "serving %d funds at %s" % (args.funds, server.start(port=args.port))
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        server.stop()
+        print dict(server.stats)
@@ -0,0 +1,371 @@
+"""
+Output sinks for scraped rows.
+
+A sink receives the rows of the scrapers table by table, as they are produced:
+
+    writer = sink.open_table(table, schema, metrics)
+    writer.writerow(row)    # row is a dict keyed by csv field
+    writer.close()
+    ...
+    sink.close()
+
+The schema of a table is a list of (csv field, column, column type) triples, see the
+*_schema attributes of GfncKeymappings and YfncKeymappings. open_table (re)creates the
+table, like sql/load_tables.sql did, so a sink always holds the result of the last run.
+
+    CsvSink: pipe delimited CSV files, one per table (the original output)
+    SqliteSink: an embedded SQLite database, rows inserted in batches
+    PostgresSink: a PostgreSQL database, rows streamed in batches through COPY FROM STDIN
+    ArrowSink: typed columnar files, one per table, in the Arrow IPC file format (read
+        back by memory-mapping, without parsing) or as Parquet
+
+Empty fields are stored as NULL by the database and columnar sinks.
+"""
+import cStringIO
+import csv
+import datetime
+import os
+import sqlite3
+from abstract_scraper import CsvRowWriter
+
+
+def create(sink, location):
+    """
+    @param sink: "csv", "sqlite", "postgres", "arrow" or "parquet"
+    @type sink: str
+    @param location: folder for csv, arrow and parquet, database file for sqlite,
+    connection string (DSN) for postgres
+    @type location: str
+    @rtype: OutputSink
+    """
+    if sink == "csv":
+        return CsvSink(location)
+    elif sink == "sqlite":
+        return SqliteSink(location)
+    elif sink == "postgres":
+        return PostgresSink(location)
+    elif sink in ("arrow", "parquet"):
+        return ArrowSink(location, file_format=sink)
+    raise ValueError("[output_sinks] Unknown sink %s" % sink)
+
+
+class OutputSink(object):
+    """
+    Super class of the output sinks
+    """
+    def open_table(self, table, schema, metrics=None):
+        """
+        Creates table, replacing an existing table of that name, and returns a writer for it
+        @param table: table name
+        @type table: str
+        @param schema: list of (csv field, column, column type) triples
+        @type schema: list
+        @param metrics: registry counting the rows written
+        @type metrics: metrics.Metrics
+        @return: writer with writerow(row) and close() methods
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class CsvSink(OutputSink):
+    """
+    Writes every table to a pipe delimited CSV file <folder>/<table>.csv, or to the file
+    given for the table in 'filenames'. The header holds the csv fields of the schema.
+    """
+    def __init__(self, folder=None, filenames=None):
+        """
+        @param folder: folder of the CSV files, created if it does not exist
+        @type folder: str
+        @param filenames: table name -> CSV file, overriding <folder>/<table>.csv
+        @type filenames: dict
+        """
+        self.folder = folder
+        self.filenames = filenames or {}
+        if folder is not None and not os.path.exists(folder):
+            os.makedirs(folder)
+
+    def filename(self, table):
+        if table in self.filenames:
+            return self.filenames[table]
+        assert self.folder is not None, "[CsvSink] No output file for table %s" % table
+        return os.path.join(self.folder, "%s.csv" % table)
+
+    def open_table(self, table, schema, metrics=None):
+        return CsvRowWriter([field for field, column, column_type in schema],
+                            self.filename(table), metrics)
+
+    def __str__(self):
+        return "csv files %s" % ", ".join(sorted(self.filenames.values())) if self.filenames \
+            else "csv files in %s" % self.folder
+
+
+def _create_table_sql(table, schema):
+    return "create table %s (%s)" % (table, ", ".join("%s %s" % (column, column_type)
+                                                       for field, column, column_type in schema))
+
+
+class _BatchWriter(object):
+    """
+    Collects rows as tuples in schema order and hands them to flush_batch every
+    batch_size rows
+    """
+    def __init__(self, table, schema, batch_size, metrics):
+        self.table = table
+        self.fields = [field for field, column, column_type in schema]
+        self.columns = [column for field, column, column_type in schema]
+        self.batch_size = batch_size
+        self.metrics = metrics
+        self.batch = []
+        self.nrows = 0
+
+    def writerow(self, row):
+        self.batch.append(tuple(row.get(field, "") for field in self.fields))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.batch:
+            self.flush_batch(self.batch)
+            self.nrows += len(self.batch)
+            self.batch = []
+
+    def flush_batch(self, batch):
+        raise NotImplementedError
+
+    def close(self):
+        self.flush()
+        if self.metrics is not None:
+            self.metrics.incr("rows_written_total", self.nrows, output=self.table)
+
+
+class SqliteSink(OutputSink):
+    """
+    Writes every table to an embedded SQLite database
+    """
+    def __init__(self, database, batch_size=1000):
+        """
+        @param database: database file, created if it does not exist
+        @type database: str
+        @param batch_size: number of rows inserted (and committed) at a time
+        @type batch_size: int
+        """
+        self.database = database
+        self.batch_size = batch_size
+        self.connection = sqlite3.connect(database)
+
+    def open_table(self, table, schema, metrics=None):
+        self.connection.execute("drop table if exists %s" % table)
+        self.connection.execute(_create_table_sql(table, schema))
+        self.connection.commit()
+        return _SqliteWriter(self.connection, table, schema, self.batch_size, metrics)
+
+    def close(self):
+        self.connection.close()
+
+    def __str__(self):
+        return "sqlite database %s" % self.database
+
+
+class _SqliteWriter(_BatchWriter):
+    def __init__(self, connection, table, schema, batch_size, metrics):
+        super(_SqliteWriter, self).__init__(table, schema, batch_size, metrics)
+        self.connection = connection
+        self.insert_sql = "insert into %s (%s) values (%s)" \
+            % (table, ", ".join(self.columns), ", ".join("?" * len(self.columns)))
+
+    def flush_batch(self, batch):
+        self.connection.executemany(self.insert_sql,
+                                    ([None if value == "" else value for value in row]
+                                     for row in batch))
+        self.connection.commit()
+
+
+class PostgresSink(OutputSink):
+    """
+    Writes every table to a PostgreSQL database. Rows are buffered as pipe delimited CSV
+    and sent batch by batch with COPY ... FROM STDIN, the fast bulk load path of
+    PostgreSQL, without intermediate files on the database server.
+    """
+    def __init__(self, dsn, batch_size=5000):
+        """
+        @param dsn: psycopg2 connection string, e.g. "dbname=funds user=postgres"
+        @type dsn: str
+        @param batch_size: number of rows sent (and committed) per COPY
+        @type batch_size: int
+        """
+        try:
+            import psycopg2
+        except ImportError:
+            raise ImportError("[output_sinks] The postgres sink needs the psycopg2 package")
+        self.batch_size = batch_size
+        self.connection = psycopg2.connect(dsn)
+
+    def open_table(self, table, schema, metrics=None):
+        cursor = self.connection.cursor()
+        cursor.execute("drop table if exists %s" % table)
+        cursor.execute(_create_table_sql(table, schema))
+        self.connection.commit()
+        return _PostgresWriter(self.connection, table, schema, self.batch_size, metrics)
+
+    def close(self):
+        self.connection.close()
+
+    def __str__(self):
+        return "postgres database %s" % self.connection.dsn
+
+
+class _PostgresWriter(_BatchWriter):
+    def __init__(self, connection, table, schema, batch_size, metrics):
+        super(_PostgresWriter, self).__init__(table, schema, batch_size, metrics)
+        self.connection = connection
+        # In CSV mode COPY reads unquoted empty fields as NULL
+        self.copy_sql = "copy %s (%s) from stdin with csv delimiter as '|'" \
+            % (table, ", ".join(self.columns))
+
+    def flush_batch(self, batch):
+        buf = cStringIO.StringIO()
+        writer = csv.writer(buf, delimiter="|", quoting=csv.QUOTE_MINIMAL)
+        for row in batch:
+            writer.writerow([value.encode("utf-8") if isinstance(value, unicode) else value
+                             for value in row])
+        buf.seek(0)
+        cursor = self.connection.cursor()
+        cursor.copy_expert(self.copy_sql, buf)
+        self.connection.commit()
+
+
+class ArrowSink(OutputSink):
+    """
+    Writes every table to a typed columnar file <folder>/<table>.arrow (Arrow IPC file
+    format) or <folder>/<table>.parquet. Column types follow the schema: float columns
+    become float64, date columns date32 and varchar columns strings. Rows are converted
+    and written as record batches of batch_size rows, so a table is never held in memory
+    as a whole. Use read_table to load a table back.
+    """
+    # Formats of date fields on the fund pages, e.g. Yahoo's inception date "Jan 3, 1999"
+    date_formats = ["%b %d, %Y", "%Y-%m-%d"]
+
+    def __init__(self, folder, file_format="arrow", batch_size=10000):
+        """
+        @param folder: folder of the table files, created if it does not exist
+        @type folder: str
+        @param file_format: "arrow" or "parquet"
+        @type file_format: str
+        @param batch_size: number of rows per record batch
+        @type batch_size: int
+        """
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError("[output_sinks] The arrow and parquet sinks need the pyarrow package")
+        assert file_format in ("arrow", "parquet"), \
+            "[ArrowSink] Unknown file format %s" % file_format
+        self.pyarrow = pyarrow
+        self.folder = folder
+        self.file_format = file_format
+        self.batch_size = batch_size
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    def filename(self, table):
+        return os.path.join(self.folder, "%s.%s" % (table, self.file_format))
+
+    def arrow_type(self, column_type):
+        if column_type == "float":
+            return self.pyarrow.float64()
+        elif column_type == "date":
+            return self.pyarrow.date32()
+        return self.pyarrow.string()
+
+    def open_table(self, table, schema, metrics=None):
+        return _ArrowWriter(self, table, schema, metrics)
+
+    def __str__(self):
+        return "%s files in %s" % (self.file_format, self.folder)
+
+
+def _to_float(value):
+    if value is None or value == "":
+        return None
+    return float(value)
+
+
+def _to_date(value):
+    if value is None or value == "":
+        return None
+    for date_format in ArrowSink.date_formats:
+        try:
+            return datetime.datetime.strptime(value.strip(), date_format).date()
+        except ValueError:
+            pass
+    raise ValueError("unknown date format %s" % value)
+
+
+def _to_string(value):
+    if value is None or value == "":
+        return None
+    return value if isinstance(value, unicode) else str(value).decode("utf-8")
+
+
+class _ArrowWriter(_BatchWriter):
+    converters = {"float": _to_float, "date": _to_date}
+
+    def __init__(self, sink, table, schema, metrics):
+        super(_ArrowWriter, self).__init__(table, schema, sink.batch_size, metrics)
+        pyarrow = sink.pyarrow
+        self.pyarrow = pyarrow
+        self.types = [column_type for field, column, column_type in schema]
+        self.arrow_types = [sink.arrow_type(column_type) for column_type in self.types]
+        self.schema = pyarrow.schema([pyarrow.field(column, arrow_type)
+                                      for column, arrow_type in zip(self.columns, self.arrow_types)])
+        if sink.file_format == "parquet":
+            import pyarrow.parquet
+            self.writer = pyarrow.parquet.ParquetWriter(sink.filename(table), self.schema)
+        else:
+            self.sink_file = pyarrow.OSFile(sink.filename(table), "wb")
+            self.writer = pyarrow.RecordBatchFileWriter(self.sink_file, self.schema)
+        self.file_format = sink.file_format
+
+    def convert(self, value, column_type):
+        try:
+            return _ArrowWriter.converters.get(column_type, _to_string)(value)
+        except ValueError:
+            # A cell that does not parse as its column type is stored as NULL
+            if self.metrics is not None:
+                self.metrics.incr("conversion_errors_total", output=self.table, type=column_type)
+            return None
+
+    def flush_batch(self, batch):
+        # Transpose the rows of the batch into typed columns
+        arrays = [self.pyarrow.array([self.convert(value, column_type) for value in values],
+                                     type=arrow_type)
+                  for values, column_type, arrow_type in zip(zip(*batch), self.types, self.arrow_types)]
+        record_batch = self.pyarrow.RecordBatch.from_arrays(arrays, self.columns)
+        if self.file_format == "parquet":
+            self.writer.write_table(self.pyarrow.Table.from_batches([record_batch]))
+        else:
+            self.writer.write_batch(record_batch)
+
+    def close(self):
+        super(_ArrowWriter, self).close()
+        self.writer.close()
+        if self.file_format == "arrow":
+            self.sink_file.close()
+
+
+def read_table(filename):
+    """
+    Loads a table written by ArrowSink. Arrow files are memory-mapped, so the columns are
+    used in place, without copying or parsing.
+    @param filename: .arrow or .parquet file
+    @type filename: str
+    @rtype: pyarrow.Table
+    """
+    import pyarrow
+    if filename.endswith(".parquet"):
+        import pyarrow.parquet
+        return pyarrow.parquet.read_table(filename, memory_map=True)
+    return pyarrow.ipc.open_file(pyarrow.memory_map(filename, "r")).read_all()
@@ -0,0 +1,380 @@
+import glob
+import json
+import mmap
+import os
+import threading
+import zlib
+
+
+class PageStore(object):
+    """
+    Storage for downloaded html pages, addressed by key. Keys are "<ticker>" for
+    google finance pages, "<ticker>_<kind>" for yahoo finance pages and the start
+    letter for marketwatch ticker pages.
+
+    Two layouts are supported:
+        LooseFileStore: one <key>.html file per page (the original layout)
+        PackStore: compressed, append-only pack files plus an offset index
+
+    Downloaders write through open_writer(); scrapers read through get().
+    """
+    @staticmethod
+    def open(location):
+        """
+        Opens the page store at location, detecting its layout
+        @param location: folder holding the pages
+        @type location: str
+        @rtype: PageStore
+        """
+        if os.path.exists(os.path.join(location, PackStore.index_name)):
+            return PackStore(location)
+        return LooseFileStore(location)
+
+    @staticmethod
+    def create(location, layout="loose"):
+        """
+        @param location: folder holding the pages. Must exist.
+        @type location: str
+        @param layout: "loose" or "pack"
+        @type layout: str
+        @rtype: PageStore
+        """
+        if layout == "pack":
+            return PackStore(location)
+        elif layout == "loose":
+            return LooseFileStore(location)
+        raise ValueError("[PageStore] Unknown layout %s" % layout)
+
+    def get(self, key):
+        """
+        @return: page contents
+        @raise IOError: if there is no page for key
+        """
+        raise NotImplementedError
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def size(self, key):
+        """
+        @return: uncompressed size of the page in bytes
+        """
+        raise NotImplementedError
+
+    def keys(self):
+        raise NotImplementedError
+
+    def fingerprint(self, key):
+        """
+        @return: a cheap string that changes whenever the page under key is rewritten,
+        or None if there is no page for key
+        """
+        raise NotImplementedError
+
+    def read_meta(self, key):
+        """
+        @return: metadata dict (url, etag, last_modified) saved with the page, empty if none
+        """
+        raise NotImplementedError
+
+    def open_writer(self, key):
+        """
+        @return: a writer with write(chunk), commit(meta) and abort() methods. The page
+        only becomes visible to readers on commit.
+        """
+        raise NotImplementedError
+
+    def put(self, key, data, meta=None):
+        writer = self.open_writer(key)
+        writer.write(data)
+        return writer.commit(meta)
+
+    def close(self):
+        pass
+
+
+class LooseFileStore(PageStore):
+    """
+    One <key>.html file per page, with the download metadata in <key>.html.meta
+    """
+    meta_suffix = ".meta"
+
+    def __init__(self, location):
+        self.location = location
+
+    def path(self, key):
+        return os.path.join(self.location, "%s.html" % key)
+
+    def get(self, key):
+        with open(self.path(key), "rb") as f:
+            return f.read()
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def size(self, key):
+        return os.path.getsize(self.path(key))
+
+    def keys(self):
+        return [os.path.basename(page)[:-len(".html")]
+                for page in glob.glob(os.path.join(self.location, "*.html"))]
+
+    def fingerprint(self, key):
+        try:
+            stat = os.stat(self.path(key))
+        except OSError:
+            return None
+        return "%d-%r" % (stat.st_size, stat.st_mtime)
+
+    def read_meta(self, key):
+        metafile = self.path(key) + LooseFileStore.meta_suffix
+        if not (self.exists(key) and os.path.exists(metafile)):
+            return {}
+        try:
+            with open(metafile, "rb") as f:
+                return json.load(f)
+        except ValueError:
+            return {}
+
+    def open_writer(self, key):
+        return _LooseFileWriter(self, key)
+
+
+class _LooseFileWriter(object):
+    """
+    Streams a page into a .part file which is moved in place on commit, so an interrupted
+    transfer never leaves a truncated page behind
+    """
+    def __init__(self, store, key):
+        self.filename = store.path(key)
+        self.partfile = self.filename + ".part"
+        self.f = open(self.partfile, "wb")
+        self.nbytes = 0
+
+    def write(self, chunk):
+        self.f.write(chunk)
+        self.nbytes += len(chunk)
+
+    def commit(self, meta=None):
+        self.f.close()
+        os.rename(self.partfile, self.filename)
+        metafile = self.filename + LooseFileStore.meta_suffix
+        if meta:
+            with open(metafile, "wb") as f:
+                json.dump(meta, f)
+        elif os.path.exists(metafile):
+            os.remove(metafile)
+        return self.nbytes
+
+    def abort(self):
+        self.f.close()
+        os.remove(self.partfile)
+
+
+class PackStore(PageStore):
+    """
+    Pages are zlib compressed and appended to pack files pack-NNNN.pak. Every page written
+    appends a line to the index file pages.idx:
+
+        <key>\t<pack number>\t<offset>\t<compressed length>\t<size>\t<metadata json>
+
+    The last line for a key wins, so re-downloaded pages simply shadow their older copies,
+    which stay in the packs as dead bytes until compact() rewrites the live pages; stats()
+    reports how much of the packs is dead. A line cut short by a crash is ignored on load.
+    Readers memory-map the packs and decompress pages by random access.
+    """
+    index_name = "pages.idx"
+    pack_name = "pack-%04d.pak"
+
+    # Start a new pack file once the current one grows beyond this size
+    max_pack_size = 512 * 1024 * 1024
+
+    def __init__(self, location):
+        self.location = location
+        self.index_path = os.path.join(location, PackStore.index_name)
+        self.index = {}
+        self.maps = {}
+        self.lock = threading.Lock()
+        self.current_pack = 0
+        complete = True
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "rb") as f:
+                for line in f:
+                    complete = line.endswith("\n")
+                    try:
+                        key, pack, offset, length, size, meta = line.rstrip("\n").split("\t", 5)
+                        entry = (int(pack), int(offset), int(length), int(size), meta)
+                        json.loads(meta)
+                    except ValueError:
+                        continue
+                    self.index[key] = entry
+                    self.current_pack = max(self.current_pack, entry[0])
+        if not complete:
+            # End the line cut short by a crash, so the next entry starts on its own line
+            with open(self.index_path, "ab") as f:
+                f.write("\n")
+
+    def pack_path(self, pack):
+        return os.path.join(self.location, PackStore.pack_name % pack)
+
+    def _map(self, pack, end):
+        """
+        Returns a memory map of pack covering at least the first 'end' bytes. Packs grow as
+        pages are appended, so a map older than the requested page is replaced.
+        """
+        mapped = self.maps.get(pack)
+        if mapped is None or len(mapped) < end:
+            with open(self.pack_path(pack), "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[pack] = mapped
+        return mapped
+
+    def get(self, key):
+        try:
+            pack, offset, length, size, meta = self.index[key]
+        except KeyError:
+            raise IOError("[PackStore] No page for key %s in %s" % (key, self.location))
+        return zlib.decompress(self._map(pack, offset + length)[offset:offset + length])
+
+    def exists(self, key):
+        return key in self.index
+
+    def size(self, key):
+        return self.index[key][3]
+
+    def keys(self):
+        return self.index.keys()
+
+    def fingerprint(self, key):
+        if key not in self.index:
+            return None
+        pack, offset, length, size, meta = self.index[key]
+        return "%d-%d-%d" % (pack, offset, length)
+
+    def read_meta(self, key):
+        if key not in self.index:
+            return {}
+        return json.loads(self.index[key][4])
+
+    def open_writer(self, key):
+        return _PackWriter(self, key)
+
+    def append(self, key, compressed, size, meta):
+        """
+        Appends a compressed page to the current pack and records it in the index
+        """
+        with self.lock:
+            pack_path = self.pack_path(self.current_pack)
+            if os.path.exists(pack_path) and os.path.getsize(pack_path) > PackStore.max_pack_size:
+                self.current_pack += 1
+                pack_path = self.pack_path(self.current_pack)
+
+            with open(pack_path, "ab") as f:
+                f.seek(0, os.SEEK_END)
+                offset = f.tell()
+                f.write(compressed)
+
+            meta_json = json.dumps(meta or {})
+            with open(self.index_path, "ab") as f:
+                f.write("%s\t%d\t%d\t%d\t%d\t%s\n"
+                        % (key, self.current_pack, offset, len(compressed), size, meta_json))
+            self.index[key] = (self.current_pack, offset, len(compressed), size, meta_json)
+
+    def pack_numbers(self):
+        """
+        @return: sorted numbers of the pack files on disk
+        """
+        prefix, suffix = PackStore.pack_name.split("%04d")
+        return sorted(int(os.path.basename(path)[len(prefix):-len(suffix)])
+                      for path in glob.glob(os.path.join(self.location, prefix + "*" + suffix)))
+
+    def stats(self):
+        """
+        @return: dict with the number of pages and packs, the bytes of all packs, the
+        bytes of the live (last written) pages and the dead bytes compact() would free
+        """
+        with self.lock:
+            pack_bytes = sum(os.path.getsize(self.pack_path(pack)) for pack in self.pack_numbers())
+            live_bytes = sum(length for pack, offset, length, size, meta in self.index.values())
+            return {"pages": len(self.index), "packs": len(self.pack_numbers()),
+                    "pack_bytes": pack_bytes, "live_bytes": live_bytes,
+                    "dead_bytes": pack_bytes - live_bytes}
+
+    def compact(self):
+        """
+        Rewrites the live pages into new packs and drops the old ones, freeing the space of
+        shadowed copies. The new index replaces the old one in a single rename, so a crash
+        leaves either the old or the new store readable; packs left over by a crash are
+        removed by the next compact().
+        """
+        with self.lock:
+            old_packs = self.pack_numbers()
+            pack = max(old_packs + [self.current_pack]) + 1
+            pack_file = open(self.pack_path(pack), "wb")
+            index = {}
+            tmpfile = self.index_path + ".tmp"
+            with open(tmpfile, "wb") as f:
+                for key in sorted(self.index):
+                    old_pack, offset, length, size, meta = self.index[key]
+                    if pack_file.tell() > PackStore.max_pack_size:
+                        pack_file.close()
+                        pack += 1
+                        pack_file = open(self.pack_path(pack), "wb")
+                    new_offset = pack_file.tell()
+                    pack_file.write(self._map(old_pack, offset + length)[offset:offset + length])
+                    f.write("%s\t%d\t%d\t%d\t%d\t%s\n" % (key, pack, new_offset, length, size, meta))
+                    index[key] = (pack, new_offset, length, size, meta)
+                pack_file.flush()
+                os.fsync(pack_file.fileno())
+                pack_file.close()
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmpfile, self.index_path)
+
+            for mapped in self.maps.values():
+                mapped.close()
+            self.maps = {}
+            self.index = index
+            self.current_pack = pack
+            live_packs = set(entry[0] for entry in index.values()) | set([pack])
+            for old_pack in old_packs:
+                if old_pack not in live_packs:
+                    os.remove(self.pack_path(old_pack))
+
+    def import_store(self, source):
+        """
+        Copies every page of another store (e.g. an existing loose download folder) into
+        this pack store
+        @type source: PageStore
+        """
+        for key in sorted(source.keys()):
+            self.put(key, source.get(key), source.read_meta(key))
+
+    def close(self):
+        for mapped in self.maps.values():
+            mapped.close()
+        self.maps = {}
+
+
+class _PackWriter(object):
+    """
+    Compresses a page as it streams in and appends it to the pack store on commit
+    """
+    def __init__(self, store, key):
+        self.store = store
+        self.key = key
+        self.compressor = zlib.compressobj(6)
+        self.chunks = []
+        self.nbytes = 0
+
+    def write(self, chunk):
+        self.chunks.append(self.compressor.compress(chunk))
+        self.nbytes += len(chunk)
+
+    def commit(self, meta=None):
+        self.chunks.append(self.compressor.flush())
+        self.store.append(self.key, "".join(self.chunks), self.nbytes, meta)
+        return self.nbytes
+
+    def abort(self):
+        self.chunks = []
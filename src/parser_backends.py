@@ -0,0 +1,173 @@
+"""
+HTML parser backends for the scrapers.
+
+Both backends expose the same small set of tree operations so the extractors in
+GfncScraper and YfncScraper are written once:
+
+    parse(html)                 -> tree
+    compile(path)               -> selector, compiled once per scraper
+    select(node, selector)      -> list of nodes
+    find_all(node, tag, class_) -> list of descendant nodes
+    find(node, tag, class_)     -> first descendant node or None
+    next_sibling(node)          -> next sibling element or None
+    text(node)                  -> text of node and its descendants (unicode)
+
+A path is a list of steps (tag, attrs, index). Every step searches the descendants of
+the current node, like BeautifulSoup's findAll(tag, **attrs), and picks match 'index'.
+An index of None on the last step returns all matches. Class attributes follow
+BeautifulSoup's class_ semantics: a single class name matches any element carrying that
+class, a space separated value must match the whole class attribute.
+
+Bs4Backend is the BeautifulSoup (+ optional tidy pre-pass) reference implementation.
+LxmlBackend uses lxml's C parser and compiles every path into a single XPath expression.
+
+Backends record the time spent in tidy and in parsing as the scrape_tidy_seconds and
+scrape_parse_seconds timers of the metrics.Metrics registry they are created with.
+"""
+from metrics import Metrics
+
+
+def create(parser="bs4", tidy=False, metrics=None):
+    """
+    @param parser: "bs4" or "lxml"
+    @type parser: str
+    @param tidy: run tidy_document over pages before parsing. Only used by the bs4 backend;
+    lxml's parser repairs broken markup itself.
+    @type tidy: bool
+    @param metrics: registry receiving tidy and parse timings
+    @type metrics: metrics.Metrics
+    """
+    if parser == "bs4":
+        return Bs4Backend(tidy=tidy, metrics=metrics)
+    elif parser == "lxml":
+        return LxmlBackend(metrics=metrics)
+    raise ValueError("[parser_backends] Unknown parser %s" % parser)
+
+
+class Bs4Backend(object):
+    """
+    BeautifulSoup backend. Selectors are evaluated as chains of findAll calls.
+    """
+    name = "bs4"
+
+    def __init__(self, tidy=False, metrics=None):
+        self.tidy = tidy
+        self.metrics = metrics if metrics is not None else Metrics()
+
+    def parse(self, html):
+        from bs4 import BeautifulSoup
+        if self.tidy:
+            from tidylib import tidy_document
+            with self.metrics.timer("scrape_tidy_seconds"):
+                html, errors = tidy_document(html)
+        with self.metrics.timer("scrape_parse_seconds", parser=self.name):
+            return BeautifulSoup(html)
+
+    def compile(self, path):
+        return [(tag, Bs4Backend._attrs(attrs), index) for tag, attrs, index in path]
+
+    @staticmethod
+    def _attrs(attrs):
+        # BeautifulSoup takes the class attribute as the class_ keyword
+        return dict(("class_" if name == "class" else name, value)
+                    for name, value in attrs.items())
+
+    def select(self, node, selector):
+        for tag, attrs, index in selector:
+            matches = node.findAll(tag, **attrs)
+            if index is None:
+                return matches
+            node = matches[index] if index < len(matches) else None
+            if node is None:
+                return []
+        return [node]
+
+    def find_all(self, node, tag, class_=None):
+        if class_ is None:
+            return node.findAll(tag)
+        return node.findAll(tag, class_=class_)
+
+    def find(self, node, tag, class_=None):
+        if class_ is None:
+            return node.find(tag)
+        return node.find(tag, class_=class_)
+
+    def next_sibling(self, node):
+        return node.findNextSibling()
+
+    def text(self, node):
+        return node.text
+
+
+class LxmlBackend(object):
+    """
+    lxml backend. Paths are compiled into XPath expressions evaluated in C.
+    """
+    name = "lxml"
+
+    def __init__(self, metrics=None):
+        try:
+            from lxml import etree, html
+        except ImportError:
+            raise ImportError("[parser_backends] The lxml parser backend needs the lxml package")
+        self.etree = etree
+        self.html = html
+        self.compiled = {}
+        self.metrics = metrics if metrics is not None else Metrics()
+
+    def parse(self, html):
+        with self.metrics.timer("scrape_parse_seconds", parser=self.name):
+            return self.html.document_fromstring(html)
+
+    @staticmethod
+    def _predicate(attrs):
+        conditions = []
+        for name, value in sorted(attrs.items()):
+            if name == "class" and " " not in value:
+                conditions.append("contains(concat(' ', normalize-space(@class), ' '), ' %s ')" % value)
+            else:
+                conditions.append("@%s='%s'" % (name, value))
+        return "".join("[%s]" % condition for condition in conditions)
+
+    @staticmethod
+    def xpath(path):
+        """
+        Translates a path into one XPath expression relative to the context node, e.g.
+        [("div", {"id": "a"}, 0), ("td", {}, None)] -> (.//div[@id='a'])[1]//td
+        """
+        expression = "."
+        for tag, attrs, index in path:
+            expression = "%s//%s%s" % (expression, tag, LxmlBackend._predicate(attrs))
+            if index is not None:
+                expression = "(%s)[%d]" % (expression, index + 1)
+        return expression
+
+    def compile(self, path):
+        return self.etree.XPath(LxmlBackend.xpath(path))
+
+    def _compiled(self, tag, class_):
+        key = (tag, class_)
+        if key not in self.compiled:
+            attrs = {} if class_ is None else {"class": class_}
+            self.compiled[key] = self.compile([(tag, attrs, None)])
+        return self.compiled[key]
+
+    def select(self, node, selector):
+        return selector(node)
+
+    def find_all(self, node, tag, class_=None):
+        return self._compiled(tag, class_)(node)
+
+    def find(self, node, tag, class_=None):
+        matches = self._compiled(tag, class_)(node)
+        return matches[0] if matches else None
+
+    def next_sibling(self, node):
+        for sibling in node.itersiblings():
+            # Skip comments and processing instructions, whose tag is not a string
+            if isinstance(sibling.tag, basestring):
+                return sibling
+        return None
+
+    def text(self, node):
+        return unicode(node.text_content())
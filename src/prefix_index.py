@@ -0,0 +1,75 @@
+class PrefixIndex(object):
+    """
+    Compiled form of a key mapping {output key: label prefix}, as in YfncKeymappings.
+    The prefixes are stored in a character trie, so the output keys a scraped label belongs
+    to are found in a single walk over the label, instead of testing label.startswith(prefix)
+    for every key.
+
+    select(raw) gives exactly the result of the scan it replaces:
+
+        for key in keymap:
+            for field in raw:
+                if field.startswith(keymap[key]):
+                    selected[key] = raw[field]
+
+    i.e. when several raw labels start with the prefix of a key, the last of them in the
+    iteration order of raw wins.
+
+    >>> index = PrefixIndex({"turnover": "AnnualHoldingsTurnover",
+    ...                      "turnover_cat": "AverageforCategory",
+    ...                      "net_assets": "NetAssets"})
+    >>> sorted(index.match("AnnualHoldingsTurnover(asofJan31,2014)"))
+    ['turnover']
+    >>> index.match("Net")
+    []
+    >>> from collections import OrderedDict
+    >>> raw = OrderedDict([("NetAssets", "1.2B"), ("AverageforCategory", "80%"),
+    ...                    ("NetAssets(asofJan31)", "1.3B"), ("FundFamily", "Vanguard")])
+    >>> sorted(index.select(raw).items())
+    [('net_assets', '1.3B'), ('turnover_cat', '80%')]
+    """
+    def __init__(self, keymap):
+        """
+        @param keymap: output key -> label prefix
+        @type keymap: dict
+        """
+        # Every trie node is a dict of child nodes by character; the keys whose prefix ends
+        # at a node are listed under the None entry of that node
+        self.root = {}
+        for key, prefix in keymap.items():
+            node = self.root
+            for char in prefix:
+                node = node.setdefault(char, {})
+            node.setdefault(None, []).append(key)
+
+    def match(self, label):
+        """
+        @return: output keys whose prefix label starts with
+        @rtype: list
+        """
+        keys = list(self.root.get(None, []))
+        node = self.root
+        for char in label:
+            node = node.get(char)
+            if node is None:
+                break
+            keys.extend(node.get(None, []))
+        return keys
+
+    def select(self, raw, normalize=None):
+        """
+        @param raw: scraped label -> value
+        @type raw: dict
+        @param normalize: function applied to the selected values
+        @type normalize: function
+        @return: output key -> value of the last label of raw that starts with its prefix
+        @rtype: dict
+        """
+        selected = {}
+        for field, value in raw.items():
+            for key in self.match(field):
+                selected[key] = value
+        if normalize is not None:
+            for key in selected:
+                selected[key] = normalize(selected[key])
+        return selected
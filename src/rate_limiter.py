@@ -0,0 +1,211 @@
+import threading
+import time
+import urlparse
+
+
+class TokenBucket(object):
+    """
+    Thread safe token bucket. Tokens are added at 'rate' per second up to 'capacity'.
+    Every request takes one token, blocking until one is available.
+    """
+    def __init__(self, rate, capacity=1):
+        """
+        @param rate: tokens added per second, i.e. the sustained request rate
+        @type rate: float
+        @param capacity: maximum number of tokens, i.e. the allowed burst size
+        @type capacity: int
+        """
+        assert rate > 0, "[TokenBucket] rate must be positive, got %s" % rate
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.timestamp = time.time()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.time()
+        self.tokens = min(self.capacity, self.tokens + (now - self.timestamp) * self.rate)
+        self.timestamp = now
+
+    def acquire(self):
+        """
+        Takes one token from the bucket, sleeping until one is available.
+        """
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def set_rate(self, rate):
+        """
+        Changes the sustained request rate. Tokens accumulated so far are kept.
+        @type rate: float
+        """
+        assert rate > 0, "[TokenBucket] rate must be positive, got %s" % rate
+        with self.lock:
+            self._refill()
+            self.rate = float(rate)
+
+
+class HostRateLimiter(object):
+    """
+    Keeps one TokenBucket per host so that each site gets its own request budget.
+    Hosts without a configured rate are not limited.
+    """
+    def __init__(self, rate_limits=None):
+        """
+        @param rate_limits: mapping of host name to requests per second, or to a
+        (requests per second, burst) tuple
+        @type rate_limits: dict
+        """
+        self.buckets = {}
+        for host, limit in (rate_limits or {}).items():
+            if isinstance(limit, tuple):
+                rate, burst = limit
+            else:
+                rate, burst = limit, 1
+            self.buckets[host] = TokenBucket(rate, burst)
+
+    def acquire(self, url):
+        """
+        Blocks until a request to the host of url is allowed
+        @param url: url about to be requested
+        @type url: str
+        """
+        bucket = self.buckets.get(urlparse.urlparse(url).netloc)
+        if bucket is not None:
+            bucket.acquire()
+        return time.time()
+
+    def feedback(self, url, ok, started=None):
+        """
+        Fixed budgets do not adapt; see AdaptiveRateController.feedback
+        """
+        pass
+
+
+class AdaptiveRateController(object):
+    """
+    Per-host request rate that adapts to how the host responds (AIMD: additive increase,
+    multiplicative decrease). While responses come back valid the rate of the host grows
+    by 'increase' requests per second for every second of traffic; a blocked response
+    (CAPTCHA page, 429/503, suspiciously small page) cuts it by the factor 'decrease'. The
+    rate thus settles just under the fastest rate a host tolerates, probing upwards now
+    and then, instead of sitting at a hand-picked constant.
+
+    Requests already in flight when the rate is cut were sent at the old rate, so the
+    blocked responses they bring back do not cut the rate again: there is at most one cut
+    per round of requests, like the congestion window of TCP.
+
+    >>> controller = AdaptiveRateController(default_rate=2.0, increase=0.5)
+    >>> started = controller.acquire("http://finance.yahoo.com/q/pr?s=VFIAX")
+    >>> controller.feedback("http://finance.yahoo.com/q/pr?s=VFIAX", False, started)
+    >>> controller.feedback("http://finance.yahoo.com/q/pr?s=VFIAX", False, started)
+    >>> controller.rate("finance.yahoo.com")
+    1.0
+    >>> for _ in range(2):
+    ...     controller.feedback("http://finance.yahoo.com/q/pr?s=VFIAX", True)
+    >>> round(controller.rate("finance.yahoo.com"), 2)
+    1.83
+    """
+    def __init__(self, initial_rates=None, default_rate=1.0, min_rate=0.02, max_rate=20.0,
+                 increase=0.05, decrease=0.5, metrics=None):
+        """
+        @param initial_rates: mapping of host name to the requests per second it starts at
+        (or to a (rate, burst) tuple, the burst is ignored). Other hosts start at
+        default_rate.
+        @type initial_rates: dict
+        @type default_rate: float
+        @param min_rate: the rate of a host is never cut below min_rate
+        @type min_rate: float
+        @param max_rate: the rate of a host never grows beyond max_rate
+        @type max_rate: float
+        @param increase: requests per second added per second of unblocked traffic
+        @type increase: float
+        @param decrease: factor the rate is multiplied with when a host blocks a request
+        @type decrease: float
+        @param metrics: When given, cuts of the rate are counted as rate_cuts_total{host}
+        @type metrics: metrics.Metrics
+        """
+        assert 0 < decrease < 1, "[AdaptiveRateController] decrease must be in (0, 1)"
+        assert 0 < min_rate <= max_rate, "[AdaptiveRateController] need 0 < min_rate <= max_rate"
+        self.initial_rates = {}
+        for host, limit in (initial_rates or {}).items():
+            self.initial_rates[host] = limit[0] if isinstance(limit, tuple) else limit
+        self.default_rate = default_rate
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.increase = float(increase)
+        self.decrease = float(decrease)
+        self.metrics = metrics
+        self.lock = threading.Lock()
+        # host -> TokenBucket; host -> time of the last cut
+        self.buckets = {}
+        self.cut_times = {}
+
+    def _bucket(self, host):
+        with self.lock:
+            bucket = self.buckets.get(host)
+            if bucket is None:
+                rate = self.initial_rates.get(host, self.default_rate)
+                bucket = TokenBucket(min(max(rate, self.min_rate), self.max_rate))
+                self.buckets[host] = bucket
+                self.cut_times[host] = 0.0
+            return bucket
+
+    def acquire(self, url):
+        """
+        Blocks until a request to the host of url is allowed at the host's current rate
+        @param url: url about to be requested
+        @type url: str
+        @return: time the request was allowed, to be passed back to feedback
+        @rtype: float
+        """
+        self._bucket(urlparse.urlparse(url).netloc).acquire()
+        return time.time()
+
+    def feedback(self, url, ok, started=None):
+        """
+        Adapts the rate of the host of url to the outcome of a request
+        @param url: url that was requested
+        @type url: str
+        @param ok: False if the host blocked the request
+        @type ok: bool
+        @param started: value returned by acquire for this request. Blocked requests
+        started before the last cut of the rate do not cut it again.
+        @type started: float
+        """
+        host = urlparse.urlparse(url).netloc
+        bucket = self._bucket(host)
+        with self.lock:
+            rate = bucket.rate
+            if ok:
+                # One success takes 1/rate seconds of traffic
+                new_rate = min(self.max_rate, rate + self.increase / rate)
+            elif started is None or started > self.cut_times[host]:
+                new_rate = max(self.min_rate, rate * self.decrease)
+                self.cut_times[host] = time.time()
+                if self.metrics is not None:
+                    self.metrics.incr("rate_cuts_total", host=host)
+            else:
+                return
+            if new_rate != rate:
+                bucket.set_rate(new_rate)
+
+    def rate(self, host):
+        """
+        @return: current requests per second of host
+        @rtype: float
+        """
+        return self._bucket(host).rate
+
+    def rates(self):
+        """
+        @return: dict host -> current requests per second, for the hosts seen so far
+        """
+        with self.lock:
+            return dict((host, bucket.rate) for host, bucket in self.buckets.items())
@@ -0,0 +1,197 @@
+import argparse
+import csv
+import time
+from download_journal import DownloadJournal
+
+day = 24 * 3600.0
+
+
+class RefreshScheduler(object):
+    """
+    Decides which fund pages to re-download in a run, and in which order, so that a limited
+    request budget keeps the most-used data freshest.
+
+    Tickers are split into a hot set, the hot_set_size largest funds by last seen net/total
+    assets, and the long tail. A hot ticker is due once its page is hot_interval old, a
+    tail ticker once it is tail_interval old. Every run that ended without a ticker done
+    doubles its interval (up to max_backoff times), so dead or blocked tickers stop eating
+    the budget: a ticker that was attempted but never done ages from its last attempt, and
+    one the host does not know (404) waits max_backoff intervals. Tickers never attempted
+    are due right away.
+
+    Due tickers are ranked hot set first, then by urgency (age / interval, divided by
+    1 + failures), then by assets; the schedule is the head of that ranking that fits in
+    the budget. Page age and failures come from the download journal, so an interrupted
+    refresh re-planned afterwards does not schedule the tickers it already refreshed.
+
+    >>> scheduler = RefreshScheduler(["A", "B", "C", "D"], assets={"A": 10.0, "B": 900.0, "C": 5.0},
+    ...                              hot_set_size=1, now=30 * day)
+    >>> scheduler.last_done = {"A": 28 * day, "B": 29.5 * day, "C": 20 * day}.get
+    >>> scheduler.schedule()
+    ['D', 'C']
+    >>> scheduler.last_done = {"A": 20 * day, "B": 28 * day, "C": 20 * day}.get
+    >>> scheduler.schedule(budget=3)
+    ['B', 'D', 'A']
+    """
+    def __init__(self, tickers, journal=None, assets=None, hot_set_size=500,
+                 hot_interval=day, tail_interval=7 * day, max_backoff=8, now=None):
+        """
+        @param tickers: all tickers of the ticker list
+        @type tickers: list
+        @param journal: download journal of previous runs, see download_journal
+        @type journal: DownloadJournal
+        @param assets: mapping of ticker to last seen assets, see load_assets
+        @type assets: dict
+        @param hot_set_size: number of largest funds refreshed every hot_interval
+        @type hot_set_size: int
+        @param hot_interval: seconds after which a page of the hot set is stale
+        @type hot_interval: float
+        @param tail_interval: seconds after which a page of the long tail is stale
+        @type tail_interval: float
+        @param max_backoff: largest factor the interval of a failing ticker is stretched by
+        @type max_backoff: int
+        @param now: reference time of the plan, by default the current time
+        @type now: float
+        """
+        self.tickers = tickers
+        self.journal = journal
+        self.assets = assets or {}
+        self.hot_interval = hot_interval
+        self.tail_interval = tail_interval
+        self.max_backoff = max_backoff
+        self.now = time.time() if now is None else now
+        ranked = sorted((ticker for ticker in tickers if ticker in self.assets),
+                        key=lambda ticker: -self.assets[ticker])
+        self.hot_set = set(ranked[:hot_set_size])
+
+    @staticmethod
+    def load_assets(assets_file, delimiter="|"):
+        """
+        Reads the last seen size of every fund from a scraped table: the net_assets column
+        of the merged fund table (see fund_merger) or of the Yahoo profiles, or else the
+        total_assets column of the Google profiles. Missing and negative (placeholder)
+        values are left out.
+        @param assets_file: delimited file with a header row and a ticker column
+        @type assets_file: str
+        @return: dict ticker -> assets
+        """
+        assets = {}
+        with open(assets_file, "rb") as f:
+            reader = csv.reader(f, delimiter=delimiter)
+            header = next(reader)
+            column = header.index("net_assets") if "net_assets" in header \
+                else header.index("total_assets")
+            ticker_column = header.index("ticker")
+            for record in reader:
+                try:
+                    value = float(record[column])
+                except (IndexError, ValueError):
+                    continue
+                if value >= 0:
+                    assets[record[ticker_column]] = value
+        return assets
+
+    def last_done(self, ticker):
+        """
+        @return: time the page of ticker was last downloaded, None if never
+        """
+        state = self.journal.state(ticker) if self.journal is not None else None
+        return state.get("last_done") if state is not None else None
+
+    def last_attempt(self, ticker):
+        """
+        @return: time of the last download attempt of ticker, None if never attempted
+        """
+        state = self.journal.state(ticker) if self.journal is not None else None
+        return state.get("time") if state is not None else None
+
+    def is_missing(self, ticker):
+        """
+        @return: True if the host answered the last attempt of ticker with a 404
+        """
+        state = self.journal.state(ticker) if self.journal is not None else None
+        return state is not None and state.get("status") == "missing"
+
+    def failures(self, ticker):
+        """
+        @return: number of runs that ended without ticker done since it was last done
+        """
+        state = self.journal.state(ticker) if self.journal is not None else None
+        return state.get("failures", 0) if state is not None else 0
+
+    def interval(self, ticker):
+        """
+        @return: seconds after which the page of ticker is due again
+        """
+        interval = self.hot_interval if ticker in self.hot_set else self.tail_interval
+        if self.is_missing(ticker):
+            return interval * self.max_backoff
+        return interval * min(2 ** self.failures(ticker), self.max_backoff)
+
+    def urgency(self, ticker):
+        """
+        @return: age of the page of ticker in units of its interval; due tickers have an
+        urgency of at least 1. The age of a ticker never done runs from its last attempt;
+        tickers never attempted have infinite urgency.
+        """
+        since = self.last_done(ticker)
+        if since is None:
+            since = self.last_attempt(ticker)
+        if since is None:
+            return float("inf")
+        return (self.now - since) / self.interval(ticker)
+
+    def plan(self):
+        """
+        @return: list of (ticker, hot, urgency) of the due tickers, most important first
+        """
+        due = []
+        for ticker in self.tickers:
+            urgency = self.urgency(ticker)
+            if urgency >= 1:
+                due.append((ticker, ticker in self.hot_set, urgency))
+        due.sort(key=lambda (ticker, hot, urgency): (
+            not hot, -urgency / (1 + self.failures(ticker)), -self.assets.get(ticker, 0.0)))
+        return due
+
+    def schedule(self, budget=None, pages_per_ticker=1):
+        """
+        @param budget: maximum number of requests of the run, None for no limit
+        @type budget: int
+        @param pages_per_ticker: requests per ticker: 1 for Google, 3 for Yahoo
+        @type pages_per_ticker: int
+        @return: tickers to download in this run, most important first
+        @rtype: list
+        """
+        tickers = [ticker for ticker, hot, urgency in self.plan()]
+        if budget is not None:
+            tickers = tickers[:budget // pages_per_ticker]
+        return tickers
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Plan the fund pages to refresh in a download run")
+    argparser.add_argument("tickerlist", help="pipe delimited <ticker>|<fundname> file")
+    argparser.add_argument("journal", help="download journal of previous runs")
+    argparser.add_argument("--assets", help="scraped table with net_assets or total_assets")
+    argparser.add_argument("--hot-set", type=int, default=500, help="number of funds refreshed daily")
+    argparser.add_argument("--hot-days", type=float, default=1, help="refresh interval of the hot set")
+    argparser.add_argument("--tail-days", type=float, default=7, help="refresh interval of the other funds")
+    argparser.add_argument("--budget", type=int, help="maximum number of requests")
+    argparser.add_argument("--pages-per-ticker", type=int, default=1)
+    args = argparser.parse_args()
+
+    with open(args.tickerlist, "rb") as f:
+        tickers = [record[0] for record in csv.reader(f, delimiter="|")]
+    journal = DownloadJournal(args.journal)
+    scheduler = RefreshScheduler(tickers, journal,
+                                 RefreshScheduler.load_assets(args.assets) if args.assets else None,
+                                 hot_set_size=args.hot_set, hot_interval=args.hot_days * day,
+                                 tail_interval=args.tail_days * day)
+    plan = scheduler.plan()
+    scheduled = scheduler.schedule(args.budget, args.pages_per_ticker)
+    print "%d of %d tickers due (%d hot), %d scheduled" % (
+        len(plan), len(tickers), sum(1 for ticker, hot, urgency in plan if hot), len(scheduled))
+    for ticker, hot, urgency in plan[:len(scheduled)][:20]:
+        print "%-6s %-4s %.2f" % (ticker, "hot" if hot else "tail", urgency)
+    journal.close()
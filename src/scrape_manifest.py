@@ -0,0 +1,85 @@
+import hashlib
+import json
+import os
+
+
+class ScrapeManifest(object):
+    """
+    Remembers, per extractor method and ticker, the page that was scraped and the row(s)
+    extracted from it, so that a later run only re-extracts new or changed pages.
+
+    A page is recognised as unchanged by its store fingerprint (size/mtime or pack offset).
+    When the fingerprint differs, the page content is hashed and compared before falling
+    back to extraction, so a re-downloaded but identical page is not parsed again.
+
+    The manifest is saved as JSON:
+        {"<method>": {"<ticker>": {"fingerprint": .., "digest": .., "result": ..}}}
+
+    Delete the manifest after changing an extractor, otherwise stale rows are reused.
+    """
+    def __init__(self, manifest_file):
+        """
+        @param manifest_file: location of the manifest. Created on save if it does not exist.
+        @type manifest_file: str
+        """
+        self.manifest_file = manifest_file
+        self.entries = {}
+        if os.path.exists(manifest_file):
+            with open(manifest_file, "rb") as f:
+                self.entries = json.load(f)
+        self.pending = {}
+
+    def lookup(self, method_name, ticker, store, key):
+        """
+        @param method_name: extractor method
+        @type method_name: str
+        @param ticker: Ticker symbol
+        @type ticker: str
+        @param store: page store holding the page
+        @type store: PageStore
+        @param key: key of the page scraped for ticker
+        @type key: str
+        @return: the result extracted last time if the page is unchanged, None otherwise
+        """
+        fingerprint = store.fingerprint(key)
+        if fingerprint is None:
+            return None
+
+        entry = self.entries.get(method_name, {}).get(ticker)
+        if entry is not None and entry["fingerprint"] == fingerprint:
+            return entry["result"]
+
+        digest = hashlib.sha1(store.get(key)).hexdigest()
+        if entry is not None and entry["digest"] == digest:
+            entry["fingerprint"] = fingerprint
+            return entry["result"]
+
+        self.pending[(method_name, ticker)] = (fingerprint, digest)
+        return None
+
+    def record(self, method_name, ticker, result):
+        """
+        Stores the result extracted from a page previously passed to lookup()
+        """
+        fingerprint, digest = self.pending.pop((method_name, ticker))
+        self.entries.setdefault(method_name, {})[ticker] = {
+            "fingerprint": fingerprint,
+            "digest": digest,
+            "result": result
+        }
+
+    def save(self, method_name, tickers):
+        """
+        Writes the manifest, dropping entries of method_name for tickers no longer listed
+        @param tickers: tickers of the current run
+        @type tickers: list
+        """
+        listed = set(tickers)
+        method_entries = self.entries.get(method_name, {})
+        self.entries[method_name] = dict((ticker, entry) for ticker, entry in method_entries.items()
+                                         if ticker in listed)
+
+        tmpfile = self.manifest_file + ".tmp"
+        with open(tmpfile, "wb") as f:
+            json.dump(self.entries, f)
+        os.rename(tmpfile, self.manifest_file)
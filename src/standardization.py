@@ -0,0 +1,173 @@
+"""
+Column-wise standardization of scraped fields.
+
+Scraped values are strings as shown on the fund pages: "1.2B", "120.5M", "1,234,567",
+"0.75%", "-", "N/A". The rules below turn whole columns of them into NumPy float arrays
+in one vectorized pass, and are shared by the Google and Yahoo scrapers:
+
+    "float":    "," "%" "$" and blanks are removed, e.g. "0.75%" -> 0.75
+    "millions": amounts in millions of dollars. "M" and "B" (and "K", "T") suffixes are
+                scaled, plain amounts are dollars, e.g. "1.2B" -> 1200.0, "120M" -> 120.0,
+                "1,234,567" -> 1.234567
+
+The sentinels in missing_values ("", "-", "N/A", ...) and cells that are not numbers become
+NaN. Values that are already numbers (e.g. rows cached by a scrape manifest) are passed
+through unchanged.
+
+standardize_rows applies the rules of a table to a batch of row dicts; chunks cuts a row
+stream into such batches:
+
+    >>> standardize_rows([{"net_assets": "1.2B", "turnover": "N/A"},
+    ...                   {"net_assets": "120M", "turnover": "35%"}],
+    ...                  {"net_assets": "millions", "turnover": "float"})
+    [{'net_assets': 1200.0, 'turnover': ''}, {'net_assets': 120.0, 'turnover': 35.0}]
+"""
+import itertools
+import numpy as np
+
+# Cell values standing for a missing value
+missing_values = ["", "-", "--", "N/A", "NA"]
+
+# Characters removed from numeric cells before conversion
+strip_chars = [",", "%", "$", " "]
+
+# Scale of the suffixes of "millions" amounts, as multipliers for the larger units and
+# divisors for the smaller ones: multiplying by 1e-6 instead of dividing by 1e6 adds float
+# noise (396851193 -> 396.85119299999997). Amounts without a suffix are in dollars.
+millions_multipliers = {"M": 1.0, "B": 1e3, "T": 1e6}
+millions_divisors = {"K": 1e3}
+millions_plain_divisor = 1e6
+
+
+def _as_strings(values):
+    """
+    @return: tuple (cleaned string array, boolean array of cells that already hold numbers,
+    float array of those numbers)
+    """
+    numeric = np.array([isinstance(value, (int, long, float)) for value in values], dtype=bool)
+    numbers = np.zeros(len(values))
+    if numeric.any():
+        numbers[numeric] = [value for value, is_number in zip(values, numeric) if is_number]
+    strings = np.array(["" if is_number or value is None else value
+                        for value, is_number in zip(values, numeric)], dtype=unicode)
+    for char in strip_chars:
+        strings = np.char.replace(strings, char, "")
+    return strings, numeric, numbers
+
+
+def _parse(strings):
+    """
+    Converts a string array to float64, mapping missing values and non-numbers to NaN
+    """
+    result = np.full(len(strings), np.nan)
+    present = ~np.in1d(strings, missing_values)
+    try:
+        result[present] = strings[present].astype(np.float64)
+    except ValueError:
+        # Some cell is not a number; fall back to converting cell by cell
+        for index in np.flatnonzero(present):
+            try:
+                result[index] = float(strings[index])
+            except ValueError:
+                pass
+    return result
+
+
+def to_float(values):
+    """
+    "float" rule
+    @param values: column of cells
+    @type values: list
+    @rtype: numpy.ndarray
+    """
+    strings, numeric, numbers = _as_strings(values)
+    result = _parse(strings)
+    result[numeric] = numbers[numeric]
+    return result
+
+
+def to_millions(values):
+    """
+    "millions" rule
+    @param values: column of cells
+    @type values: list
+    @rtype: numpy.ndarray
+    """
+    strings, numeric, numbers = _as_strings(values)
+    multiplier = np.ones(len(strings))
+    divisor = np.full(len(strings), millions_plain_divisor)
+    for suffix, suffix_multiplier in millions_multipliers.items():
+        has_suffix = np.char.endswith(strings, suffix)
+        multiplier[has_suffix] = suffix_multiplier
+        divisor[has_suffix] = 1.0
+    for suffix, suffix_divisor in millions_divisors.items():
+        divisor[np.char.endswith(strings, suffix)] = suffix_divisor
+    suffixes = "".join(millions_multipliers) + "".join(millions_divisors)
+    result = _parse(np.char.rstrip(strings, suffixes)) * multiplier / divisor
+    result[numeric] = numbers[numeric]
+    return result
+
+
+rules = {
+    "float": to_float,
+    "millions": to_millions
+}
+
+
+def standardize_columns(columns, conversions):
+    """
+    @param columns: field -> column (list of cells)
+    @type columns: dict
+    @param conversions: field -> rule name, for the fields to convert
+    @type conversions: dict
+    @return: field -> float array, for the converted fields
+    @rtype: dict
+    """
+    return dict((field, rules[rule](columns[field])) for field, rule in conversions.items()
+                if field in columns)
+
+
+def standardize_rows(rows, conversions, missing="", fields=None):
+    """
+    Standardizes a batch of rows column by column
+    @param rows: row dicts
+    @type rows: list
+    @param conversions: field -> rule name, for the fields to convert
+    @type conversions: dict
+    @param missing: value written for missing and unparseable cells
+    @param fields: fields of the output rows, absent fields are set to "". Defaults to the
+    fields of each input row.
+    @type fields: list
+    @return: standardized row dicts, with floats in the converted fields
+    @rtype: list
+    """
+    if fields is None:
+        records = [dict(row) for row in rows]
+    else:
+        records = [dict((field, row.get(field, "")) for field in fields) for row in rows]
+    if not records:
+        return records
+
+    columns = dict((field, [record.get(field, "") for record in records]) for field in conversions)
+    for field, array in standardize_columns(columns, conversions).items():
+        values = array.tolist()
+        for index in np.flatnonzero(np.isnan(array)):
+            values[index] = missing
+        for record, value in zip(records, values):
+            # Without explicit fields, fields a row does not have are not added to it
+            if fields is not None or field in record:
+                record[field] = value
+    return records
+
+
+def chunks(iterable, size=1000):
+    """
+    Cuts an iterable into lists of at most size items, so streams can be standardized in
+    batches with bounded memory
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
@@ -0,0 +1,306 @@
+import argparse
+import os
+import random
+from page_store import PageStore
+
+
+class SyntheticCorpus(object):
+    """
+    Generates synthetic Google finance and Yahoo finance (profile, performance, risk)
+    fund pages with the DOM layout the scrapers expect, so that scraping can be
+    benchmarked and exercised without downloading real pages.
+
+    A configurable fraction of the pages is degraded the way real downloads are:
+    missing tables, '-' / 'N/A' values and CAPTCHA pages.
+    """
+    captcha_page = (
+        '<html><head><title>Sorry...</title></head>\n'
+        '<body onload="document.f.captcha.focus()">\n'
+        '<form name="f" action="CaptchaRedirect"><input name="captcha" type="text"></form>\n'
+        '</body></html>\n'
+    )
+
+    # Labels of the Yahoo profile table, keyed by the field names of YfncKeymappings
+    yfnc_profile_labels = {
+        "family": "Fund Family:",
+        "net_assets": "Net Assets:",
+        "inception": "Fund Inception Date:",
+        "sales_load": "Max Front End Sales Load:",
+        "12b1_fees": "Max 12b1 Fee:",
+        "prospectus_net_expense_ratio": "Prospectus Net Expense Ratio:",
+        "gross_expense_ratio": "Prospectus Gross Expense Ratio:",
+        "ar_expense_ratio": "Annual Report Expense Ratio (net):",
+        "turnover": "Annual Holdings Turnover:",
+        "turnover_cat": "Average for Category:"
+    }
+
+    yfnc_risk_labels = [
+        "Alpha (against Standard Index)", "Beta (against Standard Index)",
+        "Mean Annual Return", "R-squared (against Standard Index)",
+        "Standard Deviation", "Sharpe Ratio", "Treynor Ratio"
+    ]
+
+    families = ["Vanguard", "Fidelity Investments", "American Funds", "T. Rowe Price",
+                "PIMCO", "BlackRock", "Franklin Templeton", "JPMorgan"]
+
+    def __init__(self, nfunds=1000, seed=0, missing_rate=0.05, dash_rate=0.1, captcha_rate=0.02):
+        """
+        @param nfunds: number of funds to generate
+        @type nfunds: int
+        @param seed: random seed; the same seed always generates the same corpus
+        @type seed: int
+        @param missing_rate: fraction of pages with a missing table
+        @type missing_rate: float
+        @param dash_rate: fraction of values reported as unavailable ('-' or 'N/A')
+        @type dash_rate: float
+        @param captcha_rate: fraction of pages that are CAPTCHA pages
+        @type captcha_rate: float
+        """
+        self.nfunds = nfunds
+        self.random = random.Random(seed)
+        self.missing_rate = missing_rate
+        self.dash_rate = dash_rate
+        self.captcha_rate = captcha_rate
+        self.tickers = self.generate_tickers()
+
+    def generate_tickers(self):
+        tickers = set()
+        while len(tickers) < self.nfunds:
+            tickers.add("".join(self.random.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ") for _ in range(4)) + "X")
+        return sorted(tickers)
+
+    # ------------------------------------
+    # Value generators
+    # ------------------------------------
+    def _unavailable(self):
+        return self.random.random() < self.dash_rate
+
+    def _missing(self):
+        return self.random.random() < self.missing_rate
+
+    def _captcha(self):
+        return self.random.random() < self.captcha_rate
+
+    def _number(self, low, high, fmt="%.2f", dash="-"):
+        if self._unavailable():
+            return dash
+        return fmt % self.random.uniform(low, high)
+
+    def _signed_pct(self, low, high, dash="-"):
+        if self._unavailable():
+            return dash
+        return "%+.2f%%" % self.random.uniform(low, high)
+
+    def _assets(self, dash="-"):
+        if self._unavailable():
+            return dash
+        kind = self.random.random()
+        if kind < 0.45:
+            return "%.2fM" % self.random.uniform(1, 999)
+        elif kind < 0.9:
+            return "%.2fB" % self.random.uniform(1, 300)
+        return "{:,}".format(self.random.randint(100000, 999999999))
+
+    # ------------------------------------
+    # Google finance
+    # ------------------------------------
+    def gfnc_page(self, ticker):
+        """
+        @return: synthetic google finance page for ticker. As on the real pages, the fund
+        data sits in a wrapper div: the risk and performance lookups only search the first
+        div of the body (GfncScraper.first_div_path).
+        """
+        if self._captcha():
+            return SyntheticCorpus.captcha_page
+
+        returns = "\n".join(
+            '<tr><td class="key">%s</td>\n<td class="val">   %s</td></tr>'
+            % (label, self._signed_pct(-20, 40))
+            for label in ["1 day", "1 week", "4 week", "3 month", "YTD", "1 year", "3 years*", "5 years*"]
+        )
+
+        management_rows = [
+            ("Total assets", self._assets()),
+            ("Front load", self._number(0, 6, "%.2f%%")),
+            ("Deferred load", self._number(0, 5, "%.2f%%")),
+            ("Expense ratio", self._number(0.05, 2.5, "%.2f%%")),
+            ("Management fees", self._number(0.05, 1.5, "%.2f%%")),
+            ("Fund family", self.random.choice(SyntheticCorpus.families))
+        ]
+        management = "\n".join('<tr><td>%s</td><td>%s</td></tr>' % row for row in management_rows)
+
+        asset_classes = [asset_class for asset_class in
+                         ["Cash", "Stocks", "Bonds", "Preferred", "Convertible", "Other"]
+                         if self.random.random() < 0.6]
+        allocations = "\n".join('<tr><td>%s</td><td>%.2f%%</td><td></td></tr>'
+                                % (asset_class, self.random.uniform(0, 100))
+                                for asset_class in asset_classes)
+
+        risk_rows = "\n".join(
+            '<tr><td>%s</td>%s</tr>' % (label, "".join("<td>%s</td>" % self._number(-3, 30)
+                                                       for _ in range(4)))
+            for label in ["Alpha", "Beta", "Mean annual return", "R-squared",
+                          "Standard deviation", "Sharpe ratio"]
+        )
+        risk_table = (
+            '<div class="sector"><div class="subsector"><table>\n'
+            '<tr><th>Risk</th><th>1 year</th><th>3 years</th><th>5 years</th><th>10 years</th></tr>\n'
+            '%s\n<tr><td colspan="5">Data provided by Morningstar</td></tr>\n'
+            '</table></div></div>' % risk_rows
+        )
+        if self._missing():
+            risk_table = ""
+
+        return (
+            '<html><head><title>%(ticker)s mutual fund quote</title></head>\n<body>\n'
+            '<div class="fjfe-bodywrapper">\n'
+            '<div id="gf-viewc"><div class="fjfe-content"><div class="mutualfund">\n'
+            '<div class="g-section g-tpl-right-1">\n'
+            '<div class="g-unit g-first"><div class="g-c">\n'
+            '<div class="sector performance">\n'
+            '<div class="subsector"><span class="pr">%(price).2f</span></div>\n'
+            '<div class="subsector"><table>\n%(returns)s\n'
+            '<tr><td colspan="2">*annualized</td></tr></table></div>\n'
+            '</div>\n'
+            '<div class="sector"><div class="subsector"><p>%(ticker)s summary</p></div></div>\n'
+            '<div class="sector"><div class="subsector"><table>\n%(management)s\n</table></div></div>\n'
+            '<div class="sector"><table>\n%(allocations)s\n</table></div>\n'
+            '</div></div>\n'
+            '<div class="g-unit"><div class="g-c sfe-break-right">\n'
+            '<div class="sector"><p>Related funds</p></div>\n'
+            '%(risk_table)s\n'
+            '</div></div>\n'
+            '</div></div></div></div>\n</div>\n</body></html>\n'
+        ) % {"ticker": ticker, "price": self.random.uniform(5, 200), "returns": returns,
+             "management": management, "allocations": allocations, "risk_table": risk_table}
+
+    # ------------------------------------
+    # Yahoo finance
+    # ------------------------------------
+    @staticmethod
+    def _yfnc_page(ticker, body):
+        return ('<html><head><title>%s</title></head>\n<body>\n<div id="yfncsumtab">\n%s\n'
+                '</div>\n</body></html>\n' % (ticker, body))
+
+    def yfnc_profile_page(self, ticker):
+        values = {
+            "family": self.random.choice(SyntheticCorpus.families),
+            "net_assets": self._assets(dash="N/A"),
+            "inception": "Jan %d, %d" % (self.random.randint(1, 28), self.random.randint(1970, 2013)),
+            "sales_load": self._number(0, 6, "%.2f%%", dash="N/A"),
+            "12b1_fees": self._number(0, 1, "%.2f%%", dash="N/A"),
+            "prospectus_net_expense_ratio": self._number(0.05, 2.5, "%.2f%%", dash="N/A"),
+            "gross_expense_ratio": self._number(0.05, 2.5, "%.2f%%", dash="N/A"),
+            "ar_expense_ratio": self._number(0.05, 2.5, "%.2f%%", dash="N/A"),
+            "turnover": self._number(1, 300, "%d%%", dash="N/A"),
+            "turnover_cat": self._number(1, 300, "%d%%", dash="N/A")
+        }
+        sections = [["family", "net_assets", "inception"],
+                    ["sales_load", "12b1_fees"],
+                    ["prospectus_net_expense_ratio", "gross_expense_ratio", "ar_expense_ratio",
+                     "turnover", "turnover_cat"]]
+        if self._missing():
+            sections = sections[:1]
+
+        tables = []
+        for section_no, fields in enumerate(sections):
+            rows = "\n".join('<tr><td class="yfnc_datamodlabel1">%s</td>'
+                             '<td class="yfnc_datamoddata1">%s</td></tr>'
+                             % (SyntheticCorpus.yfnc_profile_labels[field], values[field])
+                             for field in fields)
+            tables.append('<table class="yfnc_mod_table_title1"><tr><td>Section %d</td></tr></table>\n'
+                          '<table class="yfnc_datamodoutline1">\n%s\n</table>' % (section_no, rows))
+        return SyntheticCorpus._yfnc_page(ticker, "\n".join(tables))
+
+    def yfnc_risk_page(self, ticker):
+        intervals = ["3 Years", "5 Years", "10 Years"]
+        if self._missing():
+            intervals = intervals[:1]
+
+        tables = []
+        for interval in intervals:
+            rows = "\n".join('<tr><td class="yfnc_tabledata1">%s</td><td class="yfnc_tabledata1">%s</td>'
+                             '<td class="yfnc_tabledata1">%s</td></tr>'
+                             % (label, self._number(-3, 30, dash="N/A"), self._number(-3, 30, dash="N/A"))
+                             for label in SyntheticCorpus.yfnc_risk_labels)
+            tables.append('<table class="yfnc_tableout1">\n'
+                          '<tr><td class="yfnc_tablehead1">%s</td><td>%s</td><td>Category Avg</td></tr>\n'
+                          '%s\n</table>' % (interval, ticker, rows))
+        return SyntheticCorpus._yfnc_page(ticker, "\n".join(tables))
+
+    def yfnc_performance_page(self, ticker):
+        trailing = "\n".join('<tr><td class="yfnc_datamodlabel1">%s</td>'
+                             '<td class="yfnc_datamoddata1">%s</td></tr>'
+                             % (label, self._number(-20, 40, "%.2f%%", dash="N/A"))
+                             for label in ["Year-to-Date", "1-Month", "3-Month"])
+        average = "\n".join('<tr><td class="yfnc_datamodlabel1">%s:</td>'
+                            '<td class="yfnc_datamoddata1">%s</td></tr>'
+                            % (label, self._number(-20, 40, "%.2f%%", dash="N/A"))
+                            for label in ["1-Year", "3-Year", "5-Year", "10-Year"])
+        tables = ['<table class="yfnc_datamodoutline1">\n%s\n</table>' % trailing]
+        if not self._missing():
+            tables.append('<table class="yfnc_datamodoutline1">\n%s\n</table>' % average)
+        return SyntheticCorpus._yfnc_page(ticker, "\n".join(tables))
+
+    # ------------------------------------
+    # Marketwatch
+    # ------------------------------------
+    def marketwatch_page(self, letter):
+        """
+        @return: synthetic marketwatch fund list page of the funds whose ticker starts with
+        letter, see ticker_generator
+        """
+        rows = "\n".join('<tr><td class="quotelist-name"><a href="/investing/fund/%s">%s Synthetic Fund</a></td>'
+                         '<td class="quotelist-symb">%s</td></tr>' % (ticker, ticker, ticker)
+                         for ticker in self.tickers if ticker.startswith(letter))
+        return ('<html><head><title>Mutual Funds: %s</title></head>\n<body>\n'
+                '<table class="quotelist">\n%s\n</table>\n</body></html>\n' % (letter, rows))
+
+    # ------------------------------------
+    # Writers
+    # ------------------------------------
+    def write_tickerlist(self, tickerlist_file):
+        with open(tickerlist_file, "wb") as f:
+            for ticker in self.tickers:
+                f.write("%s|%s Synthetic Fund\n" % (ticker, ticker))
+
+    def write_gfnc(self, location, layout="loose"):
+        """
+        Writes one google finance page per fund into a page store at location
+        """
+        if not os.path.exists(location):
+            os.makedirs(location)
+        store = PageStore.create(location, layout)
+        for ticker in self.tickers:
+            store.put(ticker, self.gfnc_page(ticker))
+        store.close()
+
+    def write_yfnc(self, location, layout="loose"):
+        """
+        Writes yahoo finance profile, performance and risk pages per fund into a page
+        store at location
+        """
+        if not os.path.exists(location):
+            os.makedirs(location)
+        store = PageStore.create(location, layout)
+        for ticker in self.tickers:
+            store.put("%s_profile" % ticker, self.yfnc_profile_page(ticker))
+            store.put("%s_performance" % ticker, self.yfnc_performance_page(ticker))
+            store.put("%s_risk" % ticker, self.yfnc_risk_page(ticker))
+        store.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic fund page corpus")
+    parser.add_argument("location", help="output folder")
+    parser.add_argument("--funds", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--layout", choices=["loose", "pack"], default="loose")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.location):
+        os.makedirs(args.location)
+    corpus = SyntheticCorpus(nfunds=args.funds, seed=args.seed)
+    corpus.write_tickerlist(os.path.join(args.location, "tickers.csv"))
+    corpus.write_gfnc(os.path.join(args.location, "gfnc"), args.layout)
+    corpus.write_yfnc(os.path.join(args.location, "yfnc"), args.layout)
@@ -0,0 +1,35 @@
+import unittest
+from fund_screener import FundScreener, QueryError
+from gfnc_key_mappings import GfncKeymappings
+
+
+class FundScreenerTest(unittest.TestCase):
+    def setUp(self):
+        self.screener = FundScreener()
+        self.screener.add_table(GfncKeymappings.profile_table, GfncKeymappings.profile_schema, [
+            {"ticker": "AAAAX", "total_assets": "50.0", "fund_family": "Vanguard"},
+            {"ticker": "BBBBX", "total_assets": "-1.0", "fund_family": "Fidelity"},
+            {"ticker": "CCCCX", "total_assets": "900.0", "fund_family": "Vanguard"}
+        ])
+
+    def tickers(self, query):
+        return [row["ticker"] for row in self.screener.query(query)]
+
+    def test_missing_sentinel_is_not_a_value(self):
+        self.assertEqual(self.tickers("total_assets < 100"), ["AAAAX"])
+        self.assertEqual(self.tickers("total_assets between -5 and 100"), ["AAAAX"])
+        self.assertEqual(self.tickers("total_assets in (-1, 50)"), ["AAAAX"])
+        self.assertEqual(self.tickers("fund_family = 'Fidelity'")[0], "BBBBX")
+        self.assertEqual(self.tickers("ticker in ('AAAAX', 'BBBBX', 'CCCCX') order by total_assets"),
+                         ["AAAAX", "CCCCX", "BBBBX"])
+        self.assertEqual(self.screener.query("ticker = 'BBBBX'", ["total_assets"]), [{"total_assets": None}])
+
+    def test_literal_types_are_checked(self):
+        for query in ["total_assets in ('x')", "total_assets between 'a' and 'b'",
+                      "total_assets between 1 and 'b'", "fund_family in (1)",
+                      "fund_family between 1 and 2", "fund_family = 1", "total_assets = 'x'"]:
+            self.assertRaises(QueryError, self.screener.query, query)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+import unittest
+from page_store import PackStore
+
+
+class PackStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix="page_store_test_")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_truncated_last_index_line_is_ignored(self):
+        store = PackStore(self.folder)
+        store.put("A", "<html>a</html>", {"etag": '"a"'})
+        store.put("B", "<html>b</html>")
+        store.close()
+        with open(store.index_path, "rb") as f:
+            index = f.read()
+        with open(store.index_path, "wb") as f:
+            f.write(index[:-10])
+
+        store = PackStore(self.folder)
+        self.assertEqual(store.keys(), ["A"])
+        self.assertEqual(store.get("A"), "<html>a</html>")
+        store.put("B", "<html>b2</html>")
+        store.close()
+
+        store = PackStore(self.folder)
+        self.assertEqual(sorted(store.keys()), ["A", "B"])
+        self.assertEqual(store.get("B"), "<html>b2</html>")
+        self.assertEqual(store.read_meta("A"), {"etag": '"a"'})
+        store.close()
+
+    def test_compact_keeps_live_pages_and_frees_dead_bytes(self):
+        store = PackStore(self.folder)
+        for version in range(5):
+            store.put("A", "<html>a%d</html>" % version)
+            store.put("B", "<html>b%d</html>" % version, {"version": version})
+        store.get("A")
+        self.assertGreater(store.stats()["dead_bytes"], 0)
+
+        store.compact()
+        stats = store.stats()
+        self.assertEqual(stats["dead_bytes"], 0)
+        self.assertEqual(stats["pages"], 2)
+        self.assertEqual(stats["packs"], 1)
+        self.assertEqual(store.get("A"), "<html>a4</html>")
+        store.put("C", "<html>c</html>")
+        store.close()
+
+        store = PackStore(self.folder)
+        self.assertEqual(store.get("A"), "<html>a4</html>")
+        self.assertEqual(store.get("B"), "<html>b4</html>")
+        self.assertEqual(store.get("C"), "<html>c</html>")
+        self.assertEqual(store.read_meta("B"), {"version": 4})
+        self.assertFalse(os.path.exists(store.pack_path(0)))
+        store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import collections
+import random
+import unittest
+from prefix_index import PrefixIndex
+from yfnc_key_mappings import YfncKeymappings
+
+
+def nested_scan(keymap, raw):
+    """
+    The keymap scan PrefixIndex.select replaces
+    """
+    selected = {}
+    for key in keymap:
+        for field in raw:
+            if field.startswith(keymap[key]):
+                selected[key] = raw[field]
+    return selected
+
+
+class PrefixIndexTest(unittest.TestCase):
+    keymap = {
+        "net_assets": "NetAssets",
+        "net": "Net",
+        "assets_alias": "NetAssets",
+        "turnover": "AnnualHoldingsTurnover",
+        "turnover_cat": "AverageforCategory",
+        "category": "Category",
+        "anything": ""
+    }
+
+    def assertSelectsLikeNestedScan(self, keymap, raw):
+        self.assertEqual(PrefixIndex(keymap).select(raw), nested_scan(keymap, raw))
+
+    def test_overlapping_and_duplicate_prefixes(self):
+        raw = collections.OrderedDict([
+            ("NetAssets", "1.2B"),
+            ("Net", "x"),
+            ("NetAssets(asofJan31)", "1.3B"),
+            ("AnnualHoldingsTurnover", "35%"),
+            ("Category", "Large Blend"),
+            ("AverageforCategory", "80%")
+        ])
+        selected = PrefixIndex(self.keymap).select(raw)
+        self.assertEqual(selected, nested_scan(self.keymap, raw))
+        self.assertEqual(selected["net_assets"], "1.3B")
+        self.assertEqual(selected["assets_alias"], "1.3B")
+        self.assertEqual(selected["net"], "1.3B")
+        self.assertEqual(selected["anything"], "80%")
+
+    def test_last_match_wins_in_raw_order(self):
+        labels = ["NetAssets(asofJan31)", "NetAssets", "NetAssets(asofFeb28)"]
+        for order in ([0, 1, 2], [2, 1, 0], [1, 2, 0]):
+            raw = collections.OrderedDict((labels[i], "v%d" % i) for i in order)
+            selected = PrefixIndex(self.keymap).select(raw)
+            self.assertEqual(selected, nested_scan(self.keymap, raw))
+            self.assertEqual(selected["net_assets"], "v%d" % order[-1])
+
+    def test_no_match(self):
+        raw = collections.OrderedDict([("Ne", "1"), ("Fund Family", "Vanguard")])
+        self.assertSelectsLikeNestedScan(self.keymap, raw)
+        self.assertEqual(PrefixIndex({"net_assets": "NetAssets"}).select(raw), {})
+
+    def test_normalize(self):
+        raw = collections.OrderedDict([("NetAssets", " 1.2B "), ("Category", " Blend ")])
+        self.assertEqual(PrefixIndex(self.keymap).select(raw, normalize=lambda value: value.strip()),
+                         dict((key, value.strip()) for key, value in nested_scan(self.keymap, raw).items()))
+
+    def test_random_label_sets(self):
+        rng = random.Random(0)
+        for keymap in (self.keymap, YfncKeymappings.profile_keymap, YfncKeymappings.risk_keymap,
+                       YfncKeymappings.performance_keymap):
+            prefixes = sorted(set(keymap.values()))
+            for _ in range(300):
+                raw = collections.OrderedDict()
+                for _ in range(rng.randint(0, 12)):
+                    prefix = rng.choice(prefixes)
+                    cut = rng.randint(0, len(prefix)) if rng.random() < 0.3 else len(prefix)
+                    label = prefix[:cut] + rng.choice(["", "", "(asofJan31)", "x", " "])
+                    raw[label] = str(rng.random())
+                self.assertSelectsLikeNestedScan(keymap, raw)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from download_journal import DownloadJournal
+from refresh_scheduler import RefreshScheduler, day
+
+
+class RefreshSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix="refresh_scheduler_test_")
+        self.journal = DownloadJournal(os.path.join(self.folder, "journal.jsonl"))
+        self.now = time.time()
+
+    def tearDown(self):
+        self.journal.close()
+        shutil.rmtree(self.folder)
+
+    def record(self, ticker, status, age_days):
+        """
+        Records an attempt of ticker age_days before self.now
+        """
+        self.journal.record(ticker, status)
+        state = self.journal.state(ticker)
+        state["time"] = self.now - age_days * day
+        if status == "done":
+            state["last_done"] = state["time"]
+
+    def scheduler(self, tickers, assets):
+        return RefreshScheduler(tickers, self.journal, assets, hot_set_size=1, now=self.now)
+
+    def test_dead_ticker_loses_to_stale_good_one(self):
+        self.record("BIG", "done", 2)
+        for _ in range(5):
+            self.record("DEAD", "missing", 1)
+        self.record("STALE", "done", 10)
+        scheduler = self.scheduler(["BIG", "DEAD", "STALE"], {"BIG": 900.0, "STALE": 5.0})
+        self.assertEqual(scheduler.schedule(budget=2), ["BIG", "STALE"])
+
+    def test_missing_ticker_is_retried_after_long_cool_down(self):
+        self.record("DEAD", "missing", 7 * 8 + 1)
+        scheduler = self.scheduler(["DEAD"], {})
+        self.assertEqual(scheduler.schedule(), ["DEAD"])
+
+    def test_failing_ticker_backs_off_from_last_attempt(self):
+        for _ in range(3):
+            self.record("FLAKY", "failed", 10)
+        self.record("STALE", "done", 8)
+        scheduler = self.scheduler(["FLAKY", "STALE"], {})
+        # Three failed runs stretch the tail interval to 8 x 7 days
+        self.assertEqual(scheduler.schedule(), ["STALE"])
+        self.record("FLAKY", "failed", 60)
+        self.assertEqual(self.scheduler(["FLAKY", "STALE"], {}).schedule(), ["STALE", "FLAKY"])
+
+    def test_never_attempted_ticker_comes_first_in_the_tail(self):
+        self.record("STALE", "done", 10)
+        scheduler = self.scheduler(["STALE", "NEW"], {})
+        self.assertEqual(scheduler.schedule(), ["NEW", "STALE"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import os
+import shutil
+import tempfile
+import unittest
+from gfnc_scraper import GfncScraper
+from synthetic_corpus import SyntheticCorpus
+from yfnc_scraper import YfncScraper
+
+
+def has_values(rows):
+    return any(value not in ("", None) for row in rows
+               for field, value in row.items() if field != "ticker")
+
+
+class SyntheticCorpusTest(unittest.TestCase):
+    """
+    The scrapers must find every table of the synthetic pages, or the benchmarks and
+    parity checks run on the corpus compare empty rows
+    """
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix="synthetic_corpus_test_")
+        self.corpus = SyntheticCorpus(nfunds=20, seed=1, captcha_rate=0)
+        self.tickerlist_file = os.path.join(self.folder, "tickers.csv")
+        self.corpus.write_tickerlist(self.tickerlist_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_gfnc_tables_are_found(self):
+        self.corpus.write_gfnc(os.path.join(self.folder, "gfnc"))
+        scraper = GfncScraper(os.path.join(self.folder, "gfnc"), self.tickerlist_file, parser="lxml")
+        tables = zip(*[scraper.extract_page(ticker, scraper.load_page(ticker))
+                       for ticker in scraper.tickers])
+        for name, rows in zip(["performance", "risk", "profile"], tables):
+            self.assertTrue(has_values(rows), "no %s values extracted" % name)
+
+    def test_yfnc_tables_are_found(self):
+        self.corpus.write_yfnc(os.path.join(self.folder, "yfnc"))
+        scraper = YfncScraper(os.path.join(self.folder, "yfnc"), self.tickerlist_file, parser="lxml")
+        for table in ["profile", "performance", "risk"]:
+            rows = [getattr(scraper, "extract_%s" % table)(
+                        ticker, scraper.backend.parse(scraper.store.get("%s_%s" % (ticker, table))))
+                    for ticker in scraper.tickers]
+            self.assertTrue(has_values(rows), "no %s values extracted" % table)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,66 @@
-import glob
+import HTMLParser
+import Queue
+import codecs
+import htmlentitydefs
 import os
 import re
 import shutil
 import string
-from bs4 import BeautifulSoup
+import threading
 import requests
+from http_client import HttpClient
+from metrics import Metrics
+from page_store import LooseFileStore
+from rate_limiter import HostRateLimiter
+
+
+class MarketwatchTickerParser(HTMLParser.HTMLParser):
+    """
+    Streaming extractor of the <ticker>, <name> pairs of a marketwatch fund list page. The
+    page is fed in chunks and only the 'quotelist-name' cells are looked at: the ticker
+    is read from the href of the first link of a cell, the name is the text of the cell.
+    No tree is built.
+    """
+    # Ticker symbols are anywhere between UPPERCASE 2-5 characters
+    tickerpattern = re.compile("/([A-Z]{2,5})")
+
+    def __init__(self):
+        HTMLParser.HTMLParser.__init__(self)
+        self.funds = []
+        self.in_name_cell = False
+        self.ticker = None
+        self.name = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "td" and "quotelist-name" in (dict(attrs).get("class") or "").split():
+            self.in_name_cell = True
+            self.ticker = None
+            self.name = []
+        elif tag == "a" and self.in_name_cell and self.ticker is None:
+            match = MarketwatchTickerParser.tickerpattern.search(dict(attrs).get("href") or "")
+            self.ticker = match.group(1) if match is not None else ""
+
+    def handle_endtag(self, tag):
+        if tag == "td" and self.in_name_cell:
+            self.in_name_cell = False
+            if self.ticker:
+                self.funds.append((self.ticker, "".join(self.name)))
+
+    def handle_data(self, data):
+        if self.in_name_cell:
+            self.name.append(data)
+
+    def handle_entityref(self, name):
+        if self.in_name_cell:
+            self.name.append(unichr(htmlentitydefs.name2codepoint[name])
+                             if name in htmlentitydefs.name2codepoint else "&%s;" % name)
+
+    def handle_charref(self, name):
+        if self.in_name_cell:
+            try:
+                self.name.append(unichr(int(name[1:], 16) if name[:1] in "xX" else int(name)))
+            except ValueError:
+                self.name.append("&#%s;" % name)
 
 
 class TickerGenerator:
@@ -14,53 +70,151 @@ class TickerGenerator:
     banned for an interval of time; so we download the HTMLs containing ticker symbols
     and _then_ scrape the HTMLs to extract <ticker>:<name> key-value pairs.
 
+    Downloaded pages are kept between runs, so a refresh only re-downloads the pages that
+    changed (conditional GET, see HttpClient).
+
     The class has different methods for various download sites such as Morningstar,
     marketwatch. Custom methods for other sites can be added as needed.
     """
+    default_rate_limits = {
+        "www.marketwatch.com": (5.0, 5)
+    }
 
-    def __init__(self, downloads_folder="."):
+    # Size of the chunks in which pages are fed to the streaming parser
+    chunk_size = 64 * 1024
+
+    def __init__(self, downloads_folder=".", metrics_file=None, fresh=False, nworkers=8,
+                 rate_limits=None):
         """
         stores
         @param downloads_folder: folder for storing downloaded pages
         @type downloads_folder: str
+        @param metrics_file: When given, download and extraction metrics are written to
+        <metrics_file>.json and <metrics_file>.prom after extract_marketwatch_tickers
+        @type metrics_file: str
+        @param fresh: Delete the pages of previous runs. By default they are kept and only
+        re-downloaded if they changed.
+        @type fresh: bool
+        @param nworkers: number of threads downloading pages
+        @type nworkers: int
+        @param rate_limits: mapping of host name to requests per second (or to a (rate,
+        burst) tuple). Defaults to TickerGenerator.default_rate_limits
+        @type rate_limits: dict
         """
         self.downloads_folder = downloads_folder
-        if os.path.exists(self.downloads_folder):
+        self.metrics = Metrics()
+        self.metrics_file = metrics_file
+        self.nworkers = nworkers
+        self.http_client = HttpClient(pool_size=max(10, nworkers), metrics=self.metrics)
+        if rate_limits is None:
+            rate_limits = TickerGenerator.default_rate_limits
+        self.rate_limiter = HostRateLimiter(rate_limits)
+        self.store = LooseFileStore(self.downloads_folder)
+        if fresh and os.path.exists(self.downloads_folder):
             shutil.rmtree(self.downloads_folder)
+        if not os.path.exists(self.downloads_folder):
             os.makedirs(self.downloads_folder)
-        else:
-            os.makedirs(self.downloads_folder)
+        self.print_lock = threading.Lock()
 
-    def download_marketwatch_ticker_pages(self, base_url=None):
+    def download_marketwatch_ticker_pages(self, base_url=None, letters=string.ascii_uppercase):
+        """
+        Downloads the fund list pages <base_url><letter> concurrently. Pages saved by a
+        previous run are requested conditionally and left untouched if unchanged.
+        @return: letters whose page could not be downloaded
+        @rtype: list
+        """
         # base_url = "http://www.marketwatch.com/tools/mutual-fund/list/"
-        for startletter in string.ascii_uppercase:
-            fund_url = base_url + startletter
-            print "downloading %s..." % fund_url
-            response = requests.get(fund_url)
-            with open(self.downloads_folder + "/" + startletter + ".html", "w") as f:
-                f.write(response.content)
+        letter_queue = Queue.Queue()
+        for startletter in letters:
+            letter_queue.put(startletter)
+        failed = []
+
+        def worker():
+            while True:
+                try:
+                    startletter = letter_queue.get_nowait()
+                except Queue.Empty:
+                    return
+                fund_url = base_url + startletter
+                self.rate_limiter.acquire(fund_url)
+                try:
+                    # Error pages are not saved, so the page of a previous run survives
+                    result = self.http_client.download(fund_url, self.store, startletter,
+                                                       validate=lambda status, head: status == 200)
+                except requests.RequestException, E:
+                    self.metrics.incr("download_errors_total", type=type(E).__name__)
+                    with self.print_lock:
+                        print "[%s] could not download %s" % (type(E).__name__, fund_url)
+                        failed.append(startletter)
+                    continue
+                if result.not_modified:
+                    self.metrics.incr("ticker_pages_not_modified_total")
+                    outcome = "unchanged"
+                elif result.status == 200:
+                    self.metrics.incr("ticker_pages_downloaded_total")
+                    outcome = "%d bytes" % result.nbytes
+                else:
+                    outcome = "status %d" % result.status
+                    with self.print_lock:
+                        failed.append(startletter)
+                with self.print_lock:
+                    print "%s: %s" % (fund_url, outcome)
+
+        threads = [threading.Thread(target=worker) for _ in range(min(self.nworkers, len(letters)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return sorted(failed)
+
+    def parse_marketwatch_page(self, key):
+        """
+        @param key: letter of the page in self.store
+        @return: list of (ticker, name) pairs of the page
+        """
+        html = self.store.get(key)
+        parser = MarketwatchTickerParser()
+        decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        with self.metrics.timer("ticker_page_parse_seconds"):
+            for start in xrange(0, len(html), TickerGenerator.chunk_size):
+                parser.feed(decoder.decode(html[start:start + TickerGenerator.chunk_size]))
+            parser.feed(decoder.decode("", final=True))
+            parser.close()
+        return parser.funds
 
     def extract_marketwatch_tickers(self, tickerlist_file):
         """
         This function, scrapes ticker HTMLs in "./marketwatch_mutf_tickers" and generates
-        <ticker>:<name> key-value pairs and writes it as a DSV file.
+        <ticker>:<name> key-value pairs and writes it as a DSV file. Tickers listed more than
+        once keep their first name; the file is written once, sorted by ticker, and
+        replaces the previous list only when complete.
         """
-        # Generate a regex pattern to match mutual funds. Ticker ymbols are anywhere between
-        # UPPERCASE 2-5 characters
-
         assert os.path.exists(self.downloads_folder), \
             "Folder %s does not exist" % self.downloads_folder
 
-        fundpages = glob.glob("%s/*.html" % self.downloads_folder)
-        tickerpattern = re.compile("/[A-Z]{2,5}")
-        with open(tickerlist_file, "w") as f:
-            for fundpage in fundpages:
-                soup = BeautifulSoup(open(fundpage).read())
-                fundname_tags = soup.findAll("td", class_="quotelist-name")
-                fundnames = [tag.text for tag in fundname_tags]
-                fundtickers = [re.findall(tickerpattern, tag.find("a").attrs["href"])[0][1:]
-                               for tag in fundname_tags]
-                for ticker, name in zip(fundtickers, fundnames):
-                    print "%s: %s" % (ticker, name)
-                    f.write("%s|%s\n" % (ticker, name))
+        funds = {}
+        for fundpage in sorted(self.store.keys()):
+            try:
+                page_funds = self.parse_marketwatch_page(fundpage)
+            except HTMLParser.HTMLParseError, E:
+                self.metrics.incr("ticker_page_errors_total", type=type(E).__name__)
+                print "%s: %s" % (fundpage, E)
+                continue
+            for ticker, name in page_funds:
+                if ticker in funds:
+                    self.metrics.incr("duplicate_tickers_total")
+                else:
+                    funds[ticker] = name.strip()
+            self.metrics.incr("tickers_extracted_total", len(page_funds))
+            print "%s: %d tickers" % (fundpage, len(page_funds))
+
+        partial_file = tickerlist_file + ".partial"
+        with open(partial_file, "wb") as f:
+            for ticker in sorted(funds):
+                f.write("%s|%s\n" % (ticker, funds[ticker].encode("utf-8")))
+        os.rename(partial_file, tickerlist_file)
+        print "%d unique tickers written to %s" % (len(funds), tickerlist_file)
 
+        if self.metrics_file is not None:
+            self.metrics.export(self.metrics_file)
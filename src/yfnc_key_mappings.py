@@ -86,3 +86,37 @@ class YfncKeymappings(object):
 
     performance_fields = ["ticker", "R1", "R3", "R5", "R10"]
 
+    # Database tables and their schemas, as (csv field, column, column type) triples, see
+    # output_sinks. Column names may not start with a digit, hence fees_12b1.
+    profile_table = "yfnc_profiles"
+    profile_schema = [
+        ("ticker", "ticker", "varchar(5)"),
+        ("family", "family", "varchar(100)"),
+        ("sales_load", "sales_load", "float"),
+        ("net_assets", "net_assets", "float"),
+        ("prospectus_net_expense_ratio", "prospectus_net_expense_ratio", "float"),
+        ("gross_expense_ratio", "gross_expense_ratio", "float"),
+        ("ar_expense_ratio", "ar_expense_ratio", "float"),
+        ("inception", "inception", "date"),
+        ("12b1_fees", "fees_12b1", "float"),
+        ("turnover", "turnover", "float"),
+        ("turnover_cat", "turnover_cat", "float")
+    ]
+
+    # Standardization rules of the numeric fields, see standardization
+    profile_conversions = {
+        "net_assets": "millions",
+        "sales_load": "float",
+        "turnover": "float",
+        "turnover_cat": "float"
+    }
+
+    risk_conversions = dict((field, "float") for field in risk_fields[1:])
+
+    risk_table = "yfnc_risk"
+    risk_schema = [("ticker", "ticker", "varchar(5)")] + \
+        [(field, field, "float") for field in risk_fields[1:]]
+
+    performance_table = "yfnc_performance"
+    performance_schema = [("ticker", "ticker", "varchar(5)")] + \
+        [(field, field.lower(), "float") for field in performance_fields[1:]]
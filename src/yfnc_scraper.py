@@ -1,17 +1,67 @@
 import csv
-from pprint import pprint
 import re
 import string
-from bs4 import BeautifulSoup
-from abstract_scraper import AbstractScraper
+from abstract_scraper import AbstractScraper, CsvRowWriter
+from extraction_spec import CompiledSpec, LabeledValues, NEXT_SIBLING, Spec
+from output_sinks import CsvSink
+import standardization
 from yfnc_key_mappings import YfncKeymappings
+import parser_backends
+
+
+def normalize_profile_label(label):
+    """
+    Removes colons, newlines and blanks from the labels of the profile page, e.g.
+    "Annual Holdings Turnover (as of Jan 31, 2014):" -> "AnnualHoldingsTurnover(asofJan31,2014)"
+    """
+    return re.sub("[ ]+", "", label.encode("ascii").translate(string.maketrans("", ""), ":\n"))
 
 
 class YfncScraper(AbstractScraper):
     """
     Methods for scraping downloaded yahoo finance webpages
     """
-    def __init__(self, fundpages_location, tickerlist_file, delimiter="|"):
+    # Extraction specs of the profile, risk and performance pages (see extraction_spec).
+    # Labels are scraped "raw", as unstandardized names with parens, colons etc, and
+    # mapped to the output fields through the prefixes of the YfncKeymappings keymaps.
+    specs = [
+        # Every 'yfnc_mod_table_title1' table is followed by a table of label and data cells
+        Spec("profile", [
+            LabeledValues([("table", {"class": "yfnc_mod_table_title1"}, None), NEXT_SIBLING],
+                          label=([("td", {"class": "yfnc_datamodlabel1"}, None)], 0),
+                          values=[([("td", {"class": "yfnc_datamoddata1"}, None)], 0, "")],
+                          keymap=YfncKeymappings.profile_keymap,
+                          match="prefix",
+                          normalize_label=normalize_profile_label,
+                          convert=lambda value: value.replace("%", "").replace("N/A", ""))
+        ]),
+        # Every 'yfnc_tableout1' table holds the values of one interval. Its data cells
+        # are triples of label, security value and category value.
+        Spec("risk", [
+            LabeledValues([("table", {"class": "yfnc_tableout1"}, None)],
+                          label=([("td", {"class": "yfnc_tabledata1"}, None)], 0),
+                          values=[([("td", {"class": "yfnc_tabledata1"}, None)], 1, "__SEC"),
+                                  ([("td", {"class": "yfnc_tabledata1"}, None)], 2, "__CAT")],
+                          keymap=YfncKeymappings.risk_keymap,
+                          match="prefix",
+                          stride=3,
+                          header=[("td", {"class": "yfnc_tablehead1"}, 0)],
+                          label_format="%(label)s(%(header)s)%(suffix)s",
+                          convert=lambda value: value.replace("N/A", ""))
+        ]),
+        # The second 'yfnc_datamodoutline1' table holds the average returns
+        Spec("performance", [
+            LabeledValues([("table", {"class": "yfnc_datamodoutline1"}, 1)],
+                          label=([("td", {"class": "yfnc_datamodlabel1"}, None)], 0),
+                          values=[([("td", {"class": "yfnc_datamoddata1"}, None)], 0, "")],
+                          keymap=YfncKeymappings.performance_keymap,
+                          match="prefix",
+                          convert=lambda value: value.replace("%", "").replace("N/A", ""))
+        ])
+    ]
+
+    def __init__(self, fundpages_location, tickerlist_file, delimiter="|", nworkers=1,
+                 manifest_file=None, parser="bs4", metrics_file=None):
         """
         Constructs yahoo finance page scraper object by calling __init__ of AbstractScraper
         @param fundpages_location: Location of downloaded html fund pages (string)
@@ -20,249 +70,270 @@ class YfncScraper(AbstractScraper):
         @type tickerlist_file: str
         @param delimiter: delimiter in tickerlist_file
         @type delimiter: str
+        @param nworkers: number of worker processes used for scraping
+        @type nworkers: int
+        @param manifest_file: scrape manifest for incremental runs
+        @type manifest_file: str
+        @param parser: parser backend, "bs4" or "lxml"
+        @type parser: str
+        @param metrics_file: prefix of the JSON/Prometheus metrics files
+        @type metrics_file: str
         """
-        super(YfncScraper, self).__init__(fundpages_location, tickerlist_file, delimiter="|")
+        super(YfncScraper, self).__init__(fundpages_location, tickerlist_file, delimiter="|",
+                                          nworkers=nworkers, manifest_file=manifest_file,
+                                          metrics_file=metrics_file)
+        self.backend = parser_backends.create(parser, metrics=self.metrics)
+        self.extractor = CompiledSpec(YfncScraper.specs, self.backend, self.metrics)
 
-    def scrape(self, output_file):
+    def scrape(self, output_file=None, sink=None):
         """
-        Delegator function for getting profiles, performance, and risk
+        Delegator function for getting profiles, performance, and risk. Writes
+        <output_file>_profile.csv, <output_file>_performance.csv and <output_file>_risk.csv,
+        or the yfnc_profiles, yfnc_performance and yfnc_risk tables of sink.
         """
-        self.get_profiles(output_file="%s_profile.csv" % output_file)
-        self.get_performance(output_file="%s_performance.csv" % output_file)
-        self.get_risk(output_file="%s_risk.csv" % output_file)
-
-    def get_profiles(self, output_file=None):
+        if sink is None:
+            self.get_profiles(output_file="%s_profile.csv" % output_file)
+            self.get_performance(output_file="%s_performance.csv" % output_file)
+            self.get_risk(output_file="%s_risk.csv" % output_file)
+        else:
+            self.get_profiles(sink=sink)
+            self.get_performance(sink=sink)
+            self.get_risk(sink=sink)
+
+    def get_profiles(self, output_file=None, keep_unstd=False, sink=None):
         """
         Generates fund profile data from downloaded html pages and produces a CSV file
         containing profile data for each ticker.
-        """
-        profile_list = []
-        for ticker in self.tickers:
-            profile_page = "%s/%s_profile.html" % (self.fundpages_location, ticker)
-            try:
-                with open(profile_page) as fprofile:
-                    profile_soup = BeautifulSoup(fprofile)
-                    title_tables = profile_soup.findAll("table", class_="yfnc_mod_table_title1")
-                    translations = string.maketrans("", "")
-                    deletions = ":\n"
-                    raw_profile = {}
-
-                    # Scrape values of all fields form the HTML tables and store them in
-                    # raw_profile dictionary. This dictionary is "raw" in the sense that
-                    # the labelkeys are unstandardized names (with parens, colons etc)
-                    # The label keys will be standardized in the next step with the help
-                    # of YfncKeymappings.profile_keymap
-                    for table in title_tables:
-                        data_table = table.findNextSibling()
-                        labels = data_table.findAll("td", class_="yfnc_datamodlabel1")
-                        labelkeys = [re.sub("[ ]+", "", l.text
-                                            .encode("ascii")
-                                            .translate(translations, deletions))
-                                     for l in labels]
-                        values = data_table.findAll("td", class_="yfnc_datamoddata1")
-                        labelvals = [v.text for v in values]
-                        raw_profile.update(dict(zip(labelkeys, labelvals)))
-
-                    # Standardize interesting fields using YfncKeymappings.profile_keymap
-                    # and create a nice dictionary for output
-                    selected_profile_data = {"ticker": ticker}
-                    for key in YfncKeymappings.profile_keymap:
-                        for field in raw_profile:
-                            if field.startswith(YfncKeymappings.profile_keymap[key]):
-                                norm_field = raw_profile[field].replace("%", "").replace("N/A", "")
-                                selected_profile_data.update({key: norm_field})
 
-                # Standardized profile with selected fields is now available. Append it to
-                # to the list of profiles
-                pprint(selected_profile_data)
-                profile_list.append(selected_profile_data)
-            except IOError:
-                print "Profile page for ticker %s does not exist...skipping" % ticker
-
-        # Now list of profiles is available, write it to an intermediate CSV file
-        unstd_output_filename = YfncScraper.insert_suffix(output_file, "__UNSTD__")
-        YfncScraper.writecsv(YfncKeymappings.profile_fields, profile_list, unstd_output_filename)
-
-        # This CSV written in the above step file is unstandardized:
-        # It has field values like net_assets = "120M". We need to standardize this and
-        # other fields so they are proper numeric format for database ingestion. We use
-        # standardize_profiles to do this final cleanup.
-        YfncScraper.standardize_profiles(unstd_output_filename, output_file)
+        Scraped values are unstandardized: they have field values like net_assets = "120M".
+        Rows are standardized in memory by standardize_profile_rows, so they are proper
+        numeric format for database ingestion, before they are written.
+        @param keep_unstd: also write the unstandardized rows to <output_file>__UNSTD__,
+        for debugging
+        @type keep_unstd: bool
+        @param sink: output sink to write the yfnc_profiles table to instead of output_file
+        @type sink: output_sinks.OutputSink
+        """
+        profiles = (profile for ticker, profile in self.map_tickers("scrape_profile", "%s_profile"))
+        unstd_output_filename = YfncScraper.insert_suffix(output_file, "__UNSTD__") \
+            if keep_unstd and output_file is not None else None
+        if sink is None:
+            sink = CsvSink(filenames={YfncKeymappings.profile_table: output_file})
+        self.write_table(sink, YfncKeymappings.profile_table, YfncKeymappings.profile_schema,
+                         YfncScraper.standardize_rows(profiles,
+                                                      YfncScraper.standardize_profile_rows,
+                                                      YfncKeymappings.profile_fields,
+                                                      unstd_output_filename))
+
+    def scrape_profile(self, ticker):
+        """
+        Per-ticker extractor for get_profiles()
+        @param ticker: Ticker symbol
+        @type ticker: str
+        @return: dict of selected profile fields, or None if the profile page does not exist
+        """
+        try:
+            profile_tree = self.backend.parse(self.read_page("%s_profile" % ticker))
+        except IOError:
+            self.metrics.incr("missing_pages_total", table="profile")
+            return None
+        return self.timed_extract("profile", self.extract_profile, ticker, profile_tree)
+
+    def extract_profile(self, ticker, profile_tree):
+        """
+        Extracts selected profile fields from a parsed profile page
+        @param ticker: Ticker symbol
+        @type ticker: str
+        @param profile_tree: parsed page, as produced by self.backend
+        @return: dict of selected profile fields
+        """
+        return self.extract_tables(["profile"], ticker, profile_tree)[0]
 
-    def get_risk(self, output_file="./_risks.csv"):
+    def get_risk(self, output_file="./_risks.csv", keep_unstd=False, sink=None):
         """
         Gets the risk statistics for a mutual fund ticker symbol.
         The function assumes the knowledge of the schema for Yahoo
         finance pages for the give security.
-        """
-        risk_list = []
-        for ticker in self.tickers:
-            risk_page = "%s/%s_risk.html" % (self.fundpages_location, ticker)
-            try:
-                with open(risk_page) as frisk:
-                    risk_soup = BeautifulSoup(frisk)
-                    risk_tables = risk_soup.findAll("table", class_="yfnc_tableout1")
-                    raw_risk = {}
-
-                    # Scrape values of risk fields form the HTML tables and store them in
-                    # raw_risk dictionary. This dictionary is "raw" in the sense that
-                    # the labelkeys are unstandardized names (with parens, colons etc)
-                    # The label keys will be standardized in the next step with the help
-                    # of YfncKeymappings.risk_keymaps
-
-                    for table in risk_tables:
-                        interval = table.find("td", class_="yfnc_tablehead1").text
-                        intervaldata = table.findAll("td", class_="yfnc_tabledata1")
-                        assert len(intervaldata) % 3 == 0, \
-                            "ticker = %s, len(intervaldata) = %d (should be multiple if 3) " \
-                            % (ticker, len(intervaldata))
-
-                        labels = intervaldata[0::3]
-                        securitydata_tags = intervaldata[1::3]
-                        categorydata_tags = intervaldata[2::3]
 
-                        securitydata = dict(
-                            zip(
-                                [l.text + "(" + interval + ")__SEC" for l in labels],
-                                [s.text for s in securitydata_tags]
-                            )
-                        )
-
-                        categorydata = dict(
-                            zip(
-                                [l.text + "(" + interval + ")__CAT" for l in labels],
-                                [c.text for c in categorydata_tags]
-                            )
-                        )
-
-                        raw_risk.update(securitydata)
-                        raw_risk.update(categorydata)
-                        pprint(raw_risk)
+        Rows are standardized in memory by standardize_risk_rows before they are written.
+        @param keep_unstd: also write the unstandardized rows to <output_file>__UNSTD__,
+        for debugging
+        @type keep_unstd: bool
+        @param sink: output sink to write the yfnc_risk table to instead of output_file
+        @type sink: output_sinks.OutputSink
+        """
+        risks = (risk for ticker, risk in self.map_tickers("scrape_risk", "%s_risk"))
+        unstd_output_filename = YfncScraper.insert_suffix(output_file, "__UNSTD__") \
+            if keep_unstd and output_file is not None else None
+        if sink is None:
+            sink = CsvSink(filenames={YfncKeymappings.risk_table: output_file})
+        self.write_table(sink, YfncKeymappings.risk_table, YfncKeymappings.risk_schema,
+                         YfncScraper.standardize_rows(risks,
+                                                      YfncScraper.standardize_risk_rows,
+                                                      YfncKeymappings.risk_fields,
+                                                      unstd_output_filename))
+
+    def scrape_risk(self, ticker):
+        """
+        Per-ticker extractor for get_risk()
+        @param ticker: Ticker symbol
+        @type ticker: str
+        @return: dict of selected risk fields, or None if the risk page does not exist
+        """
+        try:
+            risk_tree = self.backend.parse(self.read_page("%s_risk" % ticker))
+        except IOError:
+            self.metrics.incr("missing_pages_total", table="risk")
+            return None
+        return self.timed_extract("risk", self.extract_risk, ticker, risk_tree)
+
+    def extract_risk(self, ticker, risk_tree):
+        """
+        Extracts selected risk fields from a parsed risk page
+        @param ticker: Ticker symbol
+        @type ticker: str
+        @param risk_tree: parsed page, as produced by self.backend
+        @return: dict of selected risk fields
+        """
+        return self.extract_tables(["risk"], ticker, risk_tree)[0]
 
-                    # Standardize interesting fields using YfncKeymappings.risk_keymap
-                    # and create a nice dictionary for output
-                    selected_risk_data = {"ticker": ticker}
-                    for key in YfncKeymappings.risk_keymap:
-                        for field in raw_risk:
-                            if field.startswith(YfncKeymappings.risk_keymap[key]):
-                                norm_field = raw_risk[field].replace("N/A", "")
-                                selected_risk_data.update({key: norm_field})
+    def get_performance(self, output_file="./_performance.csv", sink=None):
+        """
+        Gets performance statistics. 1, 3, 5 and 10 yr returns. Writes output_file, or the
+        yfnc_performance table of sink.
+        """
+        performances = (performance for ticker, performance
+                        in self.map_tickers("scrape_performance", "%s_performance"))
 
-                pprint(selected_risk_data)
-                risk_list.append(selected_risk_data)
-            except IOError:
-                print "Risk page for ticker %s does not exist...skipping" % ticker
+        # Stream the performance data to the sink
+        if sink is None:
+            sink = CsvSink(filenames={YfncKeymappings.performance_table: output_file})
+        self.write_table(sink, YfncKeymappings.performance_table, YfncKeymappings.performance_schema,
+                         performances)
 
-        # Now list of profiles is available, write it to an intermediate CSV file
-        unstd_output_filename = YfncScraper.insert_suffix(output_file, "__UNSTD__")
-        YfncScraper.writecsv(YfncKeymappings.risk_fields, risk_list, unstd_output_filename)
+    def scrape_performance(self, ticker):
+        """
+        Per-ticker extractor for get_performance()
+        @param ticker: Ticker symbol
+        @type ticker: str
+        @return: dict of selected performance fields, or None if the performance page
+        does not exist
+        """
+        try:
+            perf_tree = self.backend.parse(self.read_page("%s_performance" % ticker))
+        except IOError:
+            self.metrics.incr("missing_pages_total", table="performance")
+            return None
+        return self.timed_extract("performance", self.extract_performance, ticker, perf_tree)
+
+    def extract_performance(self, ticker, perf_tree):
+        """
+        Extracts selected performance fields from a parsed performance page
+        @param ticker: Ticker symbol
+        @type ticker: str
+        @param perf_tree: parsed page, as produced by self.backend
+        @return: dict of selected performance fields
+        """
+        return self.extract_tables(["performance"], ticker, perf_tree)[0]
 
-        # Now list of fund risks is available, write it to a csvfile
-        YfncScraper.standardize_risk(unstd_output_filename, output_file,
-                                             range(1, len(YfncKeymappings.risk_fields)))
+    @staticmethod
+    def standardize_profile_rows(rows):
+        """
+        Standardizes a batch of profile rows so they can be fed to database. The numeric
+        fields of YfncKeymappings.profile_conversions are converted column by column with
+        the rules of the standardization module: net_assets amounts ("120M", "1.2B") become
+        floats in millions, percentages and sentinels ("N/A", "-") become floats and empty
+        fields.
+
+        @param rows: profile rows as produced by scrape_profile
+        @type rows: list (of dicts)
+        @return: standardized rows holding every field of YfncKeymappings.profile_fields
+        @rtype: list (of dicts)
+        """
+        return standardization.standardize_rows(rows, YfncKeymappings.profile_conversions,
+                                                fields=YfncKeymappings.profile_fields)
 
-    def get_performance(self, output_file="./_performance.csv"):
+    @staticmethod
+    def standardize_profile_row(row):
         """
-        Gets performance statistics. 1, 3, 5 and 10 yr returns.
+        Standardizes a single profile row, see standardize_profile_rows
         """
-        performance_list = []
-        for ticker in self.tickers:
-            performance_page = "%s/%s_performance.html" % (self.fundpages_location, ticker)
-            try:
-                with open(performance_page) as fperf:
-                    perf_soup = BeautifulSoup(fperf)
-                    perf_tables = perf_soup.findAll("table", class_="yfnc_datamodoutline1")
+        return YfncScraper.standardize_profile_rows([row])[0]
 
-                    # Scrape values of performance fields form the HTML tables and store them in
-                    # raw_performance dictionary. This dictionary is "raw" in the sense that
-                    # the labelkeys are unstandardized names (with parens, colons etc)
-                    # The label keys will be standardized in the next step with the help
-                    # of YfncKeymappings.performance_keymaps
-                    try:
-                        avg_returns = perf_tables[1]
-                        intervals = [tag.text for tag in
-                                     avg_returns.findAll("td", class_="yfnc_datamodlabel1")]
-                        returns = [tag.text for tag in
-                                   avg_returns.findAll("td", class_="yfnc_datamoddata1")]
-                    except IndexError:
-                        # No tables with specified class were found in the HTML
-                        intervals = returns = []
+    @staticmethod
+    def standardize_risk_rows(rows, fields_to_stdize=None):
+        """
+        Standardizes a batch of risk rows. Fields which are supposed to be floats are
+        converted column by column.
+
+        @param rows: risk rows as produced by scrape_risk
+        @type rows: list (of dicts)
+        @param fields_to_stdize: fields to convert. Defaults to all fields but the ticker
+        @type fields_to_stdize: list
+        @return: standardized rows holding every field of YfncKeymappings.risk_fields
+        @rtype: list (of dicts)
+        """
+        if fields_to_stdize is None:
+            conversions = YfncKeymappings.risk_conversions
+        else:
+            conversions = dict((field, "float") for field in fields_to_stdize)
+        return standardization.standardize_rows(rows, conversions, fields=YfncKeymappings.risk_fields)
 
-                    raw_performance = dict(zip(intervals, returns))
+    @staticmethod
+    def standardize_risk_row(row, fields_to_stdize=None):
+        """
+        Standardizes a single risk row, see standardize_risk_rows
+        """
+        return YfncScraper.standardize_risk_rows([row], fields_to_stdize)[0]
 
-                    # Standardize interesting fields using YfncKeymappings.profile_keymap
-                    # and create a nice dictionary for output
-                    selected_performance = {"ticker": ticker}
-                    for key in YfncKeymappings.performance_keymap:
-                        for field in raw_performance:
-                            if field.startswith(YfncKeymappings.performance_keymap[key]):
-                                # norm field removes "%" and "N/A" characters
-                                norm_field = raw_performance[field]\
-                                    .replace("%", "") \
-                                    .replace("N/A", "")
-                                selected_performance.update({key: norm_field})
-                pprint(selected_performance)
-                performance_list.append(selected_performance)
-            except IOError:
-                print "Performance page for ticker %s does not exist...skipping" % ticker
-        # Now list of fund risks is available, write it to a csvfile
-        YfncScraper.writecsv(YfncKeymappings.performance_fields, performance_list, output_file)
+    @staticmethod
+    def standardize_rows(rows, standardize, fields=None, unstd_output_file=None, batch_size=1000):
+        """
+        Pipeline stage applying 'standardize' to a row stream, batch_size rows at a time.
+        The raw rows can optionally be written to unstd_output_file as a debug artifact.
+        @param rows: unstandardized rows
+        @type rows: iterable (of dicts)
+        @param standardize: batch standardization function, taking and returning a list of rows
+        @type standardize: function
+        @param fields: fields of the raw rows, needed for unstd_output_file
+        @type fields: list
+        @param unstd_output_file: file to write the raw rows to, or None
+        @type unstd_output_file: str
+        @param batch_size: number of rows standardized at a time
+        @type batch_size: int
+        """
+        writer = CsvRowWriter(fields, unstd_output_file) if unstd_output_file is not None else None
+        try:
+            for batch in standardization.chunks(rows, batch_size):
+                if writer is not None:
+                    for row in batch:
+                        writer.writerow(row)
+                for row in standardize(batch):
+                    yield row
+        finally:
+            if writer is not None:
+                writer.close()
 
     @staticmethod
     def standardize_profiles(inputfile_name, outputfile_name):
         """
-        Standardizes fields so they can be fed to database. This includes making
-        sure that the field types are compatible with the types with which the database will
-        ingest them. This includes removing commas, "M" and "B" for millions and billions etc.
+        Standardizes a profile CSV file written before standardization (see
+        standardize_profile_rows).
 
         The fields are written to the input file in the order of
         yfnc_key_mappings.profile_keymappings
 
-        For net_assets field, removes commas in amounts, if the amount ends in "M" removes "M"
-        and converts to float, if the amount ends with "B", removes "B" converts to float and
-        and multiplies by 1000.
-
         @param inputfile_name: filename string
         @type inputfile_name: str
         @param outputfile_name: output file name string
         @type outputfile_name: str
         @rtype: None
         """
-        with open(inputfile_name, "rb") as infile, \
-                open(outputfile_name, "wb") as outfile:
-
-            reader = csv.reader(infile, delimiter="|")
-            writer = csv.writer(outfile, delimiter="|")
-
-            #extract the header and advance the cursor to next row
-            header = reader.next()
-            writer.writerow(header)
-
-            net_assets_pattern = re.compile("[^\d\-\.MB]")
-            turnover_pattern = re.compile("[^\d\-\.]")
-            replacement = ""
-            for record in reader:
-                # Standardize "net_assets" field
-                net_assets = record[3]
-                net_assets_std = re.sub(net_assets_pattern, replacement, net_assets)
-                if net_assets_std.endswith("M"):
-                    net_assets_std = float(net_assets_std.replace("M", ""))
-                elif net_assets_std.endswith("B"):
-                    net_assets_std = 1000.0 * float(net_assets_std.replace("B", ""))
-                record[3] = net_assets_std
-
-                # Standardize
-                # "sales_load" (record 2)
-                # "turnover" (record 9),
-                # "turnover_cat" (record 10)
-
-                float_fields = [2, 9, 10]
-                for fieldno in float_fields:
-                    raw_field = record[fieldno]
-                    if raw_field != "":
-                        record[fieldno] = float(re.sub(turnover_pattern, replacement, raw_field))
-
-                writer.writerow(record)
+        with open(inputfile_name, "rb") as infile:
+            reader = csv.DictReader(infile, delimiter="|")
+            YfncScraper.writecsv(YfncKeymappings.profile_fields,
+                                 YfncScraper.standardize_rows(reader, YfncScraper.standardize_profile_rows),
+                                 outputfile_name)
 
     @staticmethod
     def standardize_performance(filename):
@@ -271,8 +342,8 @@ class YfncScraper(AbstractScraper):
     @staticmethod
     def standardize_risk(inputfile_name, outputfile_name, cols_to_stdize):
         """
-        Standardizes risk. Non-numeric characters ("," etc) in fields which are supposed
-        to be floats
+        Standardizes a risk CSV file written before standardization (see
+        standardize_risk_rows).
 
         @param inputfile_name: filename string
         @type inputfile_name: str
@@ -281,23 +352,11 @@ class YfncScraper(AbstractScraper):
         @param cols_to_stdize: Columns to standardize
         @type cols_to_stdize: list
         """
-        with open(inputfile_name, "rb") as infile, \
-                open(outputfile_name, "wb") as outfile:
-            reader = csv.reader(infile, delimiter="|")
-            writer = csv.writer(outfile, delimiter="|")
-
-            # Extract header and write to outputfile
-            header = reader.next()
-            writer.writerow(header)
-
-            pattern = re.compile("[^\d\.\-]")
-            replacement = ""
-            for record in reader:
-                for col in cols_to_stdize:
-                    raw_field = record[col]
-                    if raw_field != "":
-                        record[col] = float(re.sub(pattern, replacement, raw_field))
-                writer.writerow(record)
-
-
-
+        fields_to_stdize = [YfncKeymappings.risk_fields[col] for col in cols_to_stdize]
+        with open(inputfile_name, "rb") as infile:
+            reader = csv.DictReader(infile, delimiter="|")
+            YfncScraper.writecsv(YfncKeymappings.risk_fields,
+                                 YfncScraper.standardize_rows(
+                                     reader,
+                                     lambda batch: YfncScraper.standardize_risk_rows(batch, fields_to_stdize)),
+                                 outputfile_name)